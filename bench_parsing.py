@@ -0,0 +1,351 @@
+"""esptool 输出解析与日志渲染基准测试
+
+transcripts/ 目录保存了用 esp_emulator 模拟设备录制的 esptool 原始输出，覆盖
+各芯片的常用命令（read_mac、chip_id、flash_id、write_flash、verify_flash、
+erase_flash、read_flash）和几种失败情况（设备无响应、端口不存在、校验不一致），
+文件名为 <esptool版本>_<芯片>_<场景>.txt。
+
+run 子命令把这些输出逐行回放，经过与三个工具相同的处理路径：
+    flasher  烧录工具：子进程输出逐行解析 + 阶段看门狗
+    readmac  MAC读取工具：重定向 stdout 的文本块（print 分两次写出行和换行）按行解析
+    unified  综合工具：子进程输出逐行解析
+    ui       日志事件队列：投递、批量合并、按内容选择日志颜色（有显示器时加 --tk 写入真实 Text 控件）
+报告每条路径的 行/秒、tracemalloc 统计的内存峰值/残留，以及识别出的芯片/MAC/错误数（用于发现漏识别），
+可与保存的基线比较，吞吐下降或内存峰值上升超过阈值时退出码为 1。
+
+用法:
+    python bench_parsing.py run --repeat 20 --save baseline.json
+    python bench_parsing.py run --baseline baseline.json --threshold 20
+    python bench_parsing.py record --tag v5.6
+    python bench_parsing.py record --tag v4.8 --python /path/to/venv/bin/python
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+TRANSCRIPT_DIR = os.path.join(_HERE, 'transcripts')
+
+RECORD_CHIPS = ('ESP32', 'ESP32-S3', 'ESP32-C3')
+
+# 录制时去掉的行：pty 不支持 DTR/RTS 和 USB 描述符，真实串口上不会出现
+_EMULATOR_ONLY = (
+    'Chip was NOT reset',
+    'VID/PID',
+    'Device PID identification',
+    'Failed to get PID',
+    'not a USB-serial',
+)
+
+# 录制用的设备端口和固件文件名（写入语料前替换临时路径）
+_PORT_PLACEHOLDER = '/dev/ttyUSB0'
+_FIRMWARE_PLACEHOLDER = 'firmware.bin'
+
+
+def _firmware_image(path, size, seed):
+    """生成可重复的测试固件：前半部分随机数据，后半部分重复内容（接近真实镜像的压缩率）"""
+    rng = random.Random(seed)
+    half = size // 2
+    data = bytes(rng.getrandbits(8) for _ in range(half))
+    data += (b'\xe9\x03\x02\x20' + bytes(range(60))) * ((size - half) // 64 + 1)
+    with open(path, 'wb') as f:
+        f.write(data[:size])
+
+
+def _run_transcript(python, args, port, firmwares, timeout=120):
+    """运行一次 esptool，返回规范化后的输出文本"""
+    proc = subprocess.run(
+        [python, '-m', 'esptool'] + args,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        text=True, timeout=timeout,
+    )
+    lines = []
+    for line in proc.stdout.splitlines():
+        if any(marker in line for marker in _EMULATOR_ONLY):
+            continue
+        if port:
+            line = line.replace(port, _PORT_PLACEHOLDER)
+        for path, name in firmwares.items():
+            line = line.replace(path, name)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def _save(tag, chip, scenario, text):
+    name = f"{tag}_{chip}_{scenario}.txt"
+    with open(os.path.join(TRANSCRIPT_DIR, name), 'w', encoding='utf-8', newline='\n') as f:
+        f.write(text)
+    print(f"  {name}: {text.count(chr(10))} 行")
+
+
+def record(args):
+    """用模拟设备录制各芯片、各命令的 esptool 输出"""
+    import esp_emulator
+
+    os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix='esp_transcripts_')
+    firmware = os.path.join(workdir, 'fw.bin')
+    other = os.path.join(workdir, 'other.bin')
+    _firmware_image(firmware, 192 * 1024, 1)
+    _firmware_image(other, 192 * 1024, 2)
+    names = {firmware: _FIRMWARE_PLACEHOLDER, other: 'other.bin',
+             os.path.join(workdir, 'dump.bin'): 'dump.bin'}
+
+    for chip in RECORD_CHIPS:
+        print(f"{chip}:")
+        device = esp_emulator.start_devices(1, chip, '4MB')[0]
+        port = device.port
+        base = ['--port', port, '--baud', str(args.baud)]
+        scenarios = [
+            ('read_mac', ['read_mac']),
+            ('chip_id', ['chip_id']),
+            ('flash_id', ['flash_id']),
+            ('write_flash', ['write_flash', '-z', '0x10000', firmware]),
+            ('verify_flash', ['verify_flash', '0x10000', firmware]),
+            ('verify_mismatch', ['verify_flash', '0x10000', other]),
+            ('read_flash', ['read_flash', '0x10000', '0x8000', os.path.join(workdir, 'dump.bin')]),
+            ('erase_flash', ['erase_flash']),
+        ]
+        try:
+            for scenario, command in scenarios:
+                _save(args.tag, chip, scenario, _run_transcript(args.python, base + command, port, names))
+        finally:
+            device.stop()
+
+    # 失败情况与芯片无关：没有应答的串口、不存在的串口
+    print("失败场景:")
+    master, slave = os.openpty()
+    try:
+        silent = os.ttyname(slave)
+        text = _run_transcript(args.python, ['--port', silent, '--connect-attempts', '2', 'chip_id'],
+                               silent, names)
+        _save(args.tag, 'none', 'no_response', text)
+    finally:
+        os.close(master)
+        os.close(slave)
+    text = _run_transcript(args.python, ['--port', '/dev/ttyUSB_missing', 'chip_id'], None, names)
+    _save(args.tag, 'none', 'no_port', text)
+
+
+def load_corpus(pattern='*.txt'):
+    """读取语料，返回 [(文件名, [行])]"""
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(TRANSCRIPT_DIR, pattern))):
+        with open(path, encoding='utf-8') as f:
+            corpus.append((os.path.basename(path), f.read().splitlines()))
+    return corpus
+
+
+class _NullLog:
+    def log(self, message):
+        pass
+
+
+def _facts(parser):
+    return bool(parser.chip) + bool(parser.mac) + bool(parser.fatal)
+
+
+def _replay_flasher(corpus):
+    """烧录工具 _run_esptool 的输出处理"""
+    from esptool_output import EsptoolOutputParser
+    from flash_watchdog import PhaseWatchdog
+
+    log_window = _NullLog()
+    facts = 0
+    for _, lines in corpus:
+        parser = EsptoolOutputParser()
+        watchdog = PhaseWatchdog()
+        for line in lines:
+            text_line = line.rstrip("\r\n")
+            parser.feed(text_line)
+            log_window.log(text_line)
+            watchdog.feed(text_line)
+            watchdog.expired()
+        watchdog.finish()
+        facts += _facts(parser)
+    return facts
+
+
+def _replay_readmac(corpus):
+    """MAC读取工具 DualOutput 的文本块解析"""
+    from esptool_output import EsptoolOutputParser
+
+    log_window = _NullLog()
+    facts = 0
+    for _, lines in corpus:
+        parser = EsptoolOutputParser()
+        for line in lines:
+            for text in (line, "\n"):
+                parser.feed_text(text)
+                if text.strip():
+                    log_window.log(text.strip())
+        parser.close()
+        facts += _facts(parser)
+    return facts
+
+
+def _replay_unified(corpus):
+    """综合工具逐行解析"""
+    from esptool_output import EsptoolOutputParser
+
+    facts = 0
+    for _, lines in corpus:
+        parser = EsptoolOutputParser()
+        for line in lines:
+            parser.feed(line + "\n")
+        facts += _facts(parser)
+    return facts
+
+
+def _make_ui_replay(text_widget=None, batch=200):
+    """日志事件队列：每 batch 行模拟一次主循环节拍"""
+    import esp32_flasher
+    from ui_dispatch import UIDispatcher, EVENT_PORT_LOG
+
+    def render(port, lines):
+        chunks = []
+        for message in lines:
+            tag, _ = esp32_flasher.classify_log_line(message)
+            chunks.extend((message + "\n", tag))
+        if text_widget is not None:
+            text_widget.insert("end", *chunks)
+
+    def replay(corpus):
+        dispatcher = UIDispatcher(None, max_batch=batch * 4)
+        dispatcher.register(EVENT_PORT_LOG, render)
+        logger = dispatcher.port_logger(_PORT_PLACEHOLDER)
+        pending = 0
+        for _, lines in corpus:
+            for line in lines:
+                logger.log(line)
+                pending += 1
+                if pending >= batch:
+                    dispatcher.flush()
+                    pending = 0
+        while dispatcher.flush():
+            pass
+        return dispatcher.dispatched_total
+
+    return replay
+
+
+def _measure(replay, corpus, repeat):
+    """返回 行/秒、峰值KiB、残留KiB 和识别出的结果数"""
+    line_count = sum(len(lines) for _, lines in corpus)
+    # 预热（模块导入、正则编译），并决定每次计时回放几遍语料，使单次计时不短于 50ms
+    start = time.perf_counter()
+    facts = replay(corpus)
+    rounds = max(1, int(0.05 / max(time.perf_counter() - start, 1e-6)))
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            replay(corpus)
+        elapsed = (time.perf_counter() - start) / rounds
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    replay(corpus)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'lines_per_sec': line_count / best if best else 0.0,
+        'peak_kib': (peak - before) / 1024,
+        'retained_kib': max(0, current - before) / 1024,
+        'facts': facts,
+    }
+
+
+def run(args):
+    corpus = load_corpus(args.pattern)
+    if not corpus:
+        print(f"没有找到语料: {TRANSCRIPT_DIR}", file=sys.stderr)
+        return 2
+    line_count = sum(len(lines) for _, lines in corpus)
+    print(f"语料: {len(corpus)} 个文件, {line_count} 行, 每项重复 {args.repeat} 次取最快")
+
+    text_widget = None
+    if args.tk:
+        import tkinter as tk
+        root = tk.Tk()
+        root.withdraw()
+        text_widget = tk.Text(root)
+
+    targets = {
+        'flasher': _replay_flasher,
+        'readmac': _replay_readmac,
+        'unified': _replay_unified,
+        'ui': _make_ui_replay(text_widget),
+    }
+    results = {}
+    for name, replay in targets.items():
+        results[name] = _measure(replay, corpus, args.repeat)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    regressions = []
+    print(f"{'路径':<10}{'行/秒':>14}{'峰值KiB':>12}{'残留KiB':>12}{'识别数':>10}{'对比基线':>14}")
+    for name, result in results.items():
+        change = ''
+        old = baseline.get(name)
+        if old and old.get('lines_per_sec'):
+            ratio = result['lines_per_sec'] / old['lines_per_sec'] - 1
+            change = f"{ratio * 100:+.1f}%"
+            if ratio * 100 < -args.threshold:
+                regressions.append(f"{name}: 吞吐下降 {-ratio * 100:.1f}%")
+            if old.get('peak_kib') and result['peak_kib'] > old['peak_kib'] * (1 + args.threshold / 100.0) + 4:
+                regressions.append(f"{name}: 内存峰值 {old['peak_kib']:.1f} -> {result['peak_kib']:.1f} KiB")
+        print(f"{name:<10}{result['lines_per_sec']:>14,.0f}{result['peak_kib']:>12.1f}"
+              f"{result['retained_kib']:>12.1f}{result['facts']:>10}{change:>14}")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if regressions:
+        print("性能回退:")
+        for message in regressions:
+            print(f"  {message}")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="esptool 输出解析与日志渲染基准测试")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = sub.add_parser('run', help="回放语料并报告吞吐和内存")
+    run_parser.add_argument('--repeat', type=int, default=10, help="每条路径重复次数（取最快一次）")
+    run_parser.add_argument('--pattern', default='*.txt', help="只回放匹配的语料文件，如 'v5*'")
+    run_parser.add_argument('--baseline', help="与保存的基线 JSON 比较")
+    run_parser.add_argument('--save', help="把结果保存为基线 JSON")
+    run_parser.add_argument('--threshold', type=float, default=20.0, help="判定回退的百分比")
+    run_parser.add_argument('--tk', action='store_true', help="日志路径写入真实的 Tk Text 控件（需要显示器）")
+
+    record_parser = sub.add_parser('record', help="用模拟设备录制 esptool 输出")
+    record_parser.add_argument('--tag', required=True, help="语料文件名前缀，通常为 esptool 版本，如 v5.6")
+    record_parser.add_argument('--python', default=sys.executable, help="运行 esptool 的 Python 解释器")
+    record_parser.add_argument('--baud', type=int, default=460800, help="烧录波特率")
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args)
+        return 0
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
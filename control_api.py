@@ -0,0 +1,312 @@
+"""本机控制接口（HTTP + WebSocket），供 MES 等上位系统驱动烧录工位
+
+默认只监听 127.0.0.1。请求和响应都是 JSON：
+
+    GET  /status               工位状态：串口、进行中的任务、当前固件清单
+    POST /manifest             加载固件清单 {"firmwares": [{"path": ..., "address": "0x10000"}], ...}
+                               或 {"path": "清单文件.json"}（文件内容同上，相对路径按清单所在目录解析）
+    POST /jobs                 开始烧录 {"ports": ["COM3", ...]}，省略 ports 时与"开始烧录"按钮相同
+    POST /jobs/stop            停止烧录 {"port": "COM3"}，省略 port 时停止全部
+    GET  /records?since=N      第 N 条（从 0 开始）之后的烧录记录
+    GET  /events               WebSocket，推送任务事件（每条消息一个 JSON 对象，含 type 字段）
+
+配置了令牌时，请求需带 "Authorization: Bearer <令牌>" 头（WebSocket 也可用 ?token=<令牌>）。
+
+浏览器中的网页也能向本机端口发请求，因此无论是否配置令牌：
+- 带 Origin 头（浏览器发出）且不是本机页面的请求返回 403，WebSocket 同样检查
+- POST 请求的 Content-Type 必须是 application/json（表单无法跨站伪造），否则返回 415
+- 未配置令牌时，Host 头只接受 localhost、127.0.0.1、::1 和监听地址，防止 DNS 重绑定
+
+具体操作由工具提供的 handler 对象完成，handler 需实现 api_status()、api_load_manifest(data)、
+api_start(data)、api_stop(data)、api_records(since)；参数错误时抛出 ValueError，返回 400。
+"""
+import base64
+import hashlib
+import hmac
+import json
+import queue
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_OP_TEXT = 0x1
+_OP_CLOSE = 0x8
+_OP_PING = 0x9
+_OP_PONG = 0xA
+
+# 订阅者的事件队列长度，客户端读得太慢时丢弃新事件
+_SUBSCRIBER_QUEUE = 1000
+# 无事件时发送 ping 的间隔（秒）
+_KEEPALIVE = 15
+_MAX_BODY = 1024 * 1024
+_LOCAL_HOSTS = frozenset({'localhost', '127.0.0.1', '::1'})
+_ANY_HOSTS = frozenset({'', '0.0.0.0', '::'})
+
+
+def _hostname(value):
+    """Host/Origin 头中的主机名（小写，去掉端口和 IPv6 的方括号），无法解析时返回 None"""
+    try:
+        return urlsplit(value if '//' in value else f'//{value}').hostname
+    except ValueError:
+        return None
+
+
+class EventHub:
+    """任务事件的发布/订阅，publish 可在任意线程中调用，没有订阅者时几乎没有开销"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=_SUBSCRIBER_QUEUE)
+        with self._lock:
+            self._subscribers = self._subscribers + [q]
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not q]
+
+    def publish(self, event_type, **data):
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        data['type'] = event_type
+        data['time'] = round(time.time(), 3)
+        for q in subscribers:
+            try:
+                q.put_nowait(data)
+            except queue.Full:
+                pass
+
+
+def _ws_frame(opcode, payload=b''):
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 1 << 16:
+        header += bytes([126]) + struct.pack('>H', length)
+    else:
+        header += bytes([127]) + struct.pack('>Q', length)
+    return header + payload
+
+
+def _read_exact(rfile, size):
+    data = rfile.read(size)
+    if data is None or len(data) < size:
+        raise ConnectionError("连接已关闭")
+    return data
+
+
+def _ws_read_frame(rfile):
+    """读取客户端的一帧，返回 (opcode, payload)"""
+    first, second = _read_exact(rfile, 2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', _read_exact(rfile, 2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', _read_exact(rfile, 8))[0]
+    mask = _read_exact(rfile, 4) if second & 0x80 else None
+    payload = _read_exact(rfile, length) if length else b''
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+class ControlServer:
+    """HTTP 控制接口，在后台线程中运行"""
+
+    def __init__(self, handler, hub, token=None):
+        self.handler = handler
+        self.hub = hub
+        self.token = token or None
+        self._server = None
+        self._hosts = _LOCAL_HOSTS
+
+    @property
+    def serving(self):
+        return self._server is not None
+
+    def serve(self, host, port):
+        """开始监听，返回实际端口"""
+        control = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                # 工具的 stderr 已重定向到日志窗口，请求不写日志
+                pass
+
+            def do_GET(self):
+                control._dispatch(self, 'GET')
+
+            def do_POST(self):
+                control._dispatch(self, 'POST')
+
+        if host.lower() not in _ANY_HOSTS:
+            self._hosts = _LOCAL_HOSTS | {host.strip('[]').lower()}
+        self._server = ThreadingHTTPServer((host, int(port)), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="控制接口", daemon=True).start()
+        return self._server.server_address[1]
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _authorized(self, request, query):
+        if not self.token:
+            return True
+        header = request.headers.get('Authorization', '')
+        if hmac.compare_digest(header, f'Bearer {self.token}'):
+            return True
+        return hmac.compare_digest(query.get('token', [''])[0], self.token)
+
+    def _rejected(self, request, method):
+        """跨站请求和 DNS 重绑定的检查，返回 (状态码, 原因)；通过时返回 None"""
+        origin = request.headers.get('Origin')
+        if origin is not None and _hostname(origin) not in self._hosts:
+            return 403, f'不接受来自 {origin} 的跨站请求'
+        if not self.token and _hostname(request.headers.get('Host', '')) not in self._hosts:
+            return 403, f'不接受 Host: {request.headers.get("Host", "")}'
+        if method == 'POST':
+            content_type = request.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if content_type != 'application/json':
+                return 415, 'POST 请求的 Content-Type 应为 application/json'
+        return None
+
+    def _dispatch(self, request, method):
+        url = urlsplit(request.path)
+        path = url.path.rstrip('/') or '/'
+        query = parse_qs(url.query)
+        rejected = self._rejected(request, method)
+        if rejected:
+            request.close_connection = True
+            self._send_json(request, rejected[0], {'error': rejected[1]})
+            return
+        if not self._authorized(request, query):
+            self._send_json(request, 401, {'error': '未授权'})
+            return
+        try:
+            if method == 'GET' and path == '/events':
+                self._serve_events(request)
+                return
+            if method == 'GET' and path == '/status':
+                result = self.handler.api_status()
+            elif method == 'GET' and path == '/records':
+                result = self.handler.api_records(int(query.get('since', ['0'])[0]))
+            elif method == 'POST' and path == '/manifest':
+                result = self.handler.api_load_manifest(self._read_json(request))
+            elif method == 'POST' and path == '/jobs':
+                result = self.handler.api_start(self._read_json(request))
+            elif method == 'POST' and path == '/jobs/stop':
+                result = self.handler.api_stop(self._read_json(request))
+            else:
+                self._send_json(request, 404, {'error': f'未知接口 {method} {path}'})
+                return
+        except ValueError as e:
+            self._send_json(request, 400, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_json(request, 500, {'error': str(e)})
+            return
+        self._send_json(request, 200, result)
+
+    def _read_json(self, request):
+        length = int(request.headers.get('Content-Length') or 0)
+        if length > _MAX_BODY:
+            raise ValueError("请求体过大")
+        body = request.rfile.read(length) if length else b''
+        if not body.strip():
+            return {}
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"请求体不是有效的JSON: {e}")
+        if not isinstance(data, dict):
+            raise ValueError("请求体应为JSON对象")
+        return data
+
+    def _send_json(self, request, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json; charset=utf-8')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _serve_events(self, request):
+        """把 HTTP 连接升级为 WebSocket 并持续推送事件"""
+        key = request.headers.get('Sec-WebSocket-Key')
+        if request.headers.get('Upgrade', '').lower() != 'websocket' or not key:
+            self._send_json(request, 426, {'error': '此接口需要 WebSocket 连接'})
+            return
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode('ascii')).digest()).decode('ascii')
+        request.send_response(101, 'Switching Protocols')
+        request.send_header('Upgrade', 'websocket')
+        request.send_header('Connection', 'Upgrade')
+        request.send_header('Sec-WebSocket-Accept', accept)
+        request.end_headers()
+        request.wfile.flush()
+        request.close_connection = True
+
+        events = self.hub.subscribe()
+        closed = threading.Event()
+        send_lock = threading.Lock()
+
+        def send(opcode, payload=b''):
+            with send_lock:
+                request.wfile.write(_ws_frame(opcode, payload))
+                request.wfile.flush()
+
+        def read_loop():
+            # 处理客户端的 ping/close，其他消息忽略
+            try:
+                while not closed.is_set():
+                    opcode, payload = _ws_read_frame(request.rfile)
+                    if opcode == _OP_CLOSE:
+                        send(_OP_CLOSE, payload[:2])
+                        break
+                    if opcode == _OP_PING:
+                        send(_OP_PONG, payload)
+            except (OSError, ConnectionError, ValueError):
+                pass
+            closed.set()
+            # 队列满时发送循环也会在 closed 置位后的下一次检查中退出
+            try:
+                events.put_nowait(None)
+            except queue.Full:
+                pass
+
+        threading.Thread(target=read_loop, name="控制接口读取", daemon=True).start()
+        try:
+            send(_OP_TEXT, json.dumps({'type': 'hello', 'status': self.handler.api_status()},
+                                      ensure_ascii=False).encode('utf-8'))
+            while not closed.is_set():
+                try:
+                    event = events.get(timeout=_KEEPALIVE)
+                except queue.Empty:
+                    send(_OP_PING)
+                    continue
+                if event is None:
+                    break
+                send(_OP_TEXT, json.dumps(event, ensure_ascii=False).encode('utf-8'))
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            closed.set()
+            self.hub.unsubscribe(events)
+            try:
+                request.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
@@ -0,0 +1,148 @@
+"""设备识别与跟踪
+
+原生USB芯片（ESP32-S3/C3/C6 的 USB-Serial/JTAG）在复位后会重新枚举，
+在端口监控看来就像插入了一块新板子。这里按 MAC 地址和 USB 序列号记录
+最近完成的设备，用于在冷却时间内识别并跳过刚烧录完成的设备。
+
+只有乐鑫原生USB（VID 303A）的序列号由芯片 MAC 派生、每块板子不同；CP210x、CH34x、
+FTDI 等USB转串口芯片的序列号常常是同一个值（如 "0001"），不能用来区分板子。
+"""
+import re
+import threading
+import time
+
+_MAC_PATTERN = re.compile(r'^[0-9a-f]{2}(:[0-9a-f]{2}){5}$')
+ESPRESSIF_VID = 0x303A
+
+
+def normalize_mac(mac):
+    """统一MAC地址格式，便于比较；无效地址（如 "Unknown"）返回 None"""
+    if not mac:
+        return None
+    mac = mac.strip().lower().replace('-', ':')
+    return mac if _MAC_PATTERN.match(mac) else None
+
+
+class RecentDeviceTable:
+    """最近完成设备表，按 MAC 和 USB 序列号两种键查询
+
+    usb_serial 只应传入 native_usb_serial() 的结果，USB转串口芯片的序列号可能在多块板子间重复。
+    """
+
+    def __init__(self, cooldown=60.0):
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._by_mac = {}
+        self._by_serial = {}
+
+    def mark(self, mac=None, usb_serial=None):
+        """记录一台刚完成的设备"""
+        now = time.monotonic()
+        mac = normalize_mac(mac)
+        with self._lock:
+            if mac:
+                self._by_mac[mac] = now
+            if usb_serial:
+                self._by_serial[usb_serial] = now
+
+    def is_recent(self, mac=None, usb_serial=None):
+        """设备是否在冷却时间内完成过"""
+        if self.cooldown <= 0:
+            return False
+        mac = normalize_mac(mac)
+        with self._lock:
+            self._purge(time.monotonic())
+            return bool((mac and mac in self._by_mac) or
+                        (usb_serial and usb_serial in self._by_serial))
+
+    def clear(self):
+        with self._lock:
+            self._by_mac.clear()
+            self._by_serial.clear()
+
+    def _purge(self, now):
+        for table in (self._by_mac, self._by_serial):
+            expired = [key for key, stamp in table.items() if now - stamp > self.cooldown]
+            for key in expired:
+                del table[key]
+
+
+def native_usb_serial(port_info):
+    """乐鑫原生USB设备的序列号（由芯片 MAC 派生，每块板子不同）；USB转串口芯片和非USB端口返回 None"""
+    if getattr(port_info, 'vid', None) != ESPRESSIF_VID:
+        return None
+    return getattr(port_info, 'serial_number', None) or None
+
+
+def device_key(port_info):
+    """稳定的设备标识：乐鑫原生USB按序列号，其他按USB物理位置，最后退回端口名
+
+    原生USB芯片的序列号在重新枚举前后保持不变，可以据此找回同一块板子；
+    USB转串口芯片的序列号可能在多块板子间重复，改按所在的USB位置区分。
+    """
+    serial_number = native_usb_serial(port_info)
+    if serial_number:
+        return f"usb:{serial_number}"
+    location = getattr(port_info, 'location', None)
+    if location:
+        return f"loc:{location}"
+    return port_info.device
+
+
+def find_port(key, ports):
+    """在端口列表中查找标识为 key 的设备，返回端口名"""
+    for info in ports:
+        if device_key(info) == key:
+            return info.device
+    return None
+
+
+class FlashSession:
+    """一次烧录任务的设备会话
+
+    会话按稳定设备标识索引，端口名可能随重新枚举而变化；
+    工作线程每次调用 esptool 前都应读取 session.port。
+    """
+
+    def __init__(self, key, port):
+        self.key = key
+        self.port = port
+        self.cancel_event = threading.Event()
+        self.phase = "准备"
+        self.phase_started = time.monotonic()  # 当前阶段的开始时间
+        self.process = None  # 正在运行的 esptool 进程
+        self.removed_phase = None  # 因设备拔出而终止时所处的阶段
+        self.baud = None  # 本次任务使用的波特率，通信错误重试时可能降低
+        self.retries = 0  # 已自动重试的次数
+        self.phase_times = {}  # esptool 各阶段累计耗时（秒）
+        self.hub = None  # 所在的USB集线器（并发限制和速率统计按集线器进行）
+        self.write_kbps = []  # 各段写入的有效速率（kbit/s）
+        self.sync_attempts = 0  # 各次 esptool 调用的同步尝试次数合计
+        self.reset = 'default_reset'  # 连接时的复位方式（esptool --before）
+        self.reset_candidates = []  # 同步失败时依次尝试的复位方式
+        self.reset_failed = []  # 本次任务中同步失败过的复位方式
+        self.connected = False  # 芯片检测成功（复位方式有效）
+        self.leases = []  # 本任务持有租约的端口（重新枚举后端口名可能变化）
+        self._attached = threading.Event()
+        self._attached.set()
+
+    @property
+    def follows_reenumeration(self):
+        """只有乐鑫原生USB设备（按序列号标识）才能可靠地跨端口名识别"""
+        return self.key.startswith('usb:')
+
+    @property
+    def detached(self):
+        return not self._attached.is_set()
+
+    def detach(self):
+        """端口消失，等待设备重新出现"""
+        self._attached.clear()
+
+    def attach(self, port):
+        """设备以 port 重新出现"""
+        self.port = port
+        self._attached.set()
+
+    def wait_attached(self, timeout):
+        return self._attached.wait(timeout)
@@ -1,13 +1,11 @@
+# 最先导入，启动耗时从这里开始计算
+import startup_timing
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
 import threading
 import time
 import json
 import os
-import locale
-import subprocess
-import sys
-import io
 
 # 导入serial模块
 try:
@@ -18,14 +16,33 @@ except ImportError:
     import serial.tools.list_ports
     list_ports = serial.tools.list_ports
 
-# 导入esptool模块（打包后也可用）
-try:
-    import esptool
-except ImportError:
-    esptool = None
+from ui_dispatch import UIDispatcher, EVENT_LOG, EVENT_PORT_LOG
+from flash_engine import FlashEngine, FlashOptions, SUCCESS, VERIFIED, SKIPPED
+from esptool_launcher import run_passthrough
+from port_lease import describe_holder
+from flash_retry import describe_error
+from flash_trace import TraceRecorder, CAT_WAIT
+from sampling_profiler import SamplingProfiler, parse_tool_args
+from lot_stats import LotTracker, DEFAULT_WINDOWS, format_duration
+from station_metrics import StationMetrics, hub_of
+from control_api import ControlServer, EventHub
+from flash_verify import MODE_LABELS, HASH, mode_from_label
 
 font_size = 10
 
+
+def classify_log_line(message):
+    """日志行的显示标签，以及需要同步到状态栏的状态（没有则为 None）"""
+    if "错误" in message or "失败" in message or "Error" in message:
+        return "error", "错误"
+    elif "警告" in message or "Warning" in message:
+        return "warning", None
+    elif "成功" in message or "完成" in message:
+        return "success", "完成"
+    elif "开始" in message:
+        return "info", "烧录中..."
+    return "info", None
+
 # 科技感配色方案 - 冷静蓝 + 深色文字
 COLORS = {
     'primary': '#1d4ed8',        # 科技蓝（更深以提升对比）
@@ -208,12 +225,12 @@ class LogWindow:
         log_toolbar.pack(fill="x", pady=(0, 10))
         
         # 工具栏标题
-        toolbar_label = ttk.Label(
+        self.toolbar_label = ttk.Label(
             log_toolbar, 
             text=f"端口: {port}",
             font=('Microsoft YaHei UI', font_size, 'bold')
         )
-        toolbar_label.pack(side="left")
+        self.toolbar_label.pack(side="left")
         
         # 添加清除日志按钮
         clear_button = ttk.Button(
@@ -275,6 +292,14 @@ class LogWindow:
         
     def clear_log(self):
         self.log_text.delete(1.0, tk.END)
+
+    def set_port(self, port):
+        """设备重新枚举后更新显示的端口名"""
+        try:
+            self.window.title(f"端口 {port} 烧录日志")
+            self.toolbar_label.config(text=f"端口: {port}")
+        except Exception:
+            pass
         
     def destroy(self):
         self.window.destroy()
@@ -301,10 +326,20 @@ class ESP32Flasher:
         # 应用现代风格
         set_modern_style(root)
         
+        # 工作线程通过事件队列与UI交互，由主循环定时批量处理
+        self.ui = UIDispatcher(self.root)
+        self.ui.register(EVENT_LOG, self._append_log_lines)
+        self.ui.register(EVENT_PORT_LOG, self._append_port_log_lines)
+        # 时间线记录（按需开启，导出为 Chrome trace）
+        self.tracer = TraceRecorder()
+        self.ui.tracer = self.tracer
+        # 性能分析（采样所有线程的 CPU 与内存分配，按需开启）
+        self.profiler = SamplingProfiler('flasher')
+        self.ui.start()
+        
         # 初始化基本变量
         self.log_windows = {}
-        self.flash_cancel_events = {}
-        self.flash_processes = {}
+        self._port_detected_at = {}  # 端口名 -> 主线程发现新端口的时间（时间线中的排队区间）
         self.config = {'firmware_paths': [''] * 8, 'firmware_addresses': ['0x0'] * 8}  # 修改为8个
         self.port_enables = []  # 添加串口启用状态列表
         
@@ -313,9 +348,35 @@ class ESP32Flasher:
         self.flash_success_count = 0  # 成功次数
         self.flash_fail_count = 0  # 失败次数
         self.flash_total_count = 0  # 总次数
+        # 批次统计（目标数量、台/小时、周期、首次通过率、ETA），随记录增量更新
+        self.lot = LotTracker()
+        self.lot_frame = None
+        self._lot_rows = {}  # (类别, 名称) -> 周期列表中的行
+        self.hub_frame = None
+        self._hub_rows = {}  # 集线器 -> 集线器列表中的行
+        self.link_frame = None
+        self._link_rows = {}  # 端口位置 -> 链路质量列表中的行
+        # 监控指标（config.json 中 metrics_port 不为 0 时提供 HTTP 抓取）
+        self._setup_metrics()
+        # 烧录流程由不依赖界面的引擎执行，界面只提供参数并通过回调显示进度
+        self.engine = FlashEngine(
+            on_log=self._on_job_log,
+            on_message=self.log,
+            on_job_started=self._on_job_started,
+            on_phase=self._on_job_phase,
+            on_reattached=self._on_job_reattached,
+            on_record=self._on_job_record,
+            on_job_finished=self._on_job_finished,
+            tracer=self.tracer,
+            metrics=self.metrics
+        )
+        # 本机控制接口（config.json 中 api_port 不为 0 时开启），任务事件通过 events 推送
+        self.events = EventHub()
+        self.control_server = None
         
         # 创建UI
         self.create_ui()
+        startup_timing.mark("构建界面")
         
         # 主窗口关闭时，停止烧录并退出
         try:
@@ -323,40 +384,217 @@ class ESP32Flasher:
         except Exception:
             pass
         
-        # 延迟加载配置和启动监控
-        self.root.after(100, self.delayed_init)
+        # 窗口绘制完成后（主循环空闲时）再加载配置和启动监控
+        self.root.after_idle(self.delayed_init)
 
     def delayed_init(self):
         """延迟初始化，提高启动速度"""
+        startup_timing.mark("首次绘制")
         # 加载配置
         self.load_config()
+        startup_timing.mark("加载配置")
+        self._inspect_slots([i for i in range(8) if self.firmware_enables[i].get()])
         
         # 初始化串口列表
         self.refresh_ports()
+        startup_timing.mark("扫描串口")
+        self._start_metrics_server()
+        self._start_control_server()
         
         # 启动串口监控
         self.log("正在启动串口监控线程...")
         self.port_monitor_thread = threading.Thread(target=self.monitor_ports, daemon=True)
         self.port_monitor_thread.start()
         self.log("串口监控线程已启动，等待设备插入...")
+        self.log(startup_timing.summary())
         
         # 重定向标准输出到日志框
         import sys
         sys.stdout = LogRedirector(self.log)
         sys.stderr = LogRedirector(self.log)
 
+        # 就绪后再创建不影响烧录的界面部分
+        self.root.after_idle(self._build_lot_panel)
+        self.root.after_idle(self._build_hub_panel)
+        self.root.after_idle(self._build_link_panel)
+        self.root.after_idle(self._build_history_panel)
+
+    def _setup_metrics(self):
+        self.metrics = StationMetrics('flasher')
+        self.metrics.gauge('esp32_ui_queue_depth', 'Pending UI events', self.ui.depth)
+        self.metrics.gauge('esp32_ui_queue_max_latency_seconds', 'Worst UI event latency since start',
+                           lambda: round(self.ui.max_latency, 4))
+        self.metrics.gauge('esp32_active_sessions', 'Flash jobs in progress per USB hub',
+                           self._sessions_per_hub, ('hub',))
+
+    @property
+    def port_info(self):
+        """端口名 -> list_ports 信息（USB序列号等），由监控线程刷新"""
+        return self.engine.port_info
+
+    @property
+    def flash_sessions(self):
+        """进行中的烧录任务：稳定设备标识 -> FlashSession"""
+        return self.engine.sessions
+
+    def _sessions_per_hub(self):
+        hubs = {}
+        for session in list(self.flash_sessions.values()):
+            info = self.port_info.get(session.port)
+            hub = hub_of(getattr(info, 'location', None))
+            hubs[(hub,)] = hubs.get((hub,), 0) + 1
+        return hubs
+
+    def _start_metrics_server(self):
+        port = int(self.config.get('metrics_port', 0) or 0)
+        if not port or self.metrics.serving:
+            return
+        host = self.config.get('metrics_host', '127.0.0.1')
+        try:
+            self.metrics.serve(host, port)
+            self.log(f"监控指标: http://{host}:{port}/metrics")
+        except OSError as e:
+            self.log(f"监控指标端口 {host}:{port} 启动失败: {str(e)}")
+
+    def _start_control_server(self):
+        port = int(self.config.get('api_port', 0) or 0)
+        if not port or self.control_server is not None:
+            return
+        host = self.config.get('api_host', '127.0.0.1')
+        server = ControlServer(self, self.events, self.config.get('api_token'))
+        try:
+            server.serve(host, port)
+        except OSError as e:
+            self.log(f"控制接口端口 {host}:{port} 启动失败: {str(e)}")
+            return
+        self.control_server = server
+        self.log(f"控制接口: http://{host}:{port}/status，事件推送: ws://{host}:{port}/events")
+
+    # ---- 控制接口（在HTTP线程中调用，界面相关的操作交给主线程执行） ----
+
+    def api_status(self):
+        return self.ui.call_wait(self._api_status)
+
+    def _api_status(self):
+        now = time.monotonic()
+        sessions = [{
+            'key': session.key,
+            'port': session.port,
+            'phase': session.phase,
+            'retries': session.retries,
+            'phase_seconds': round(now - session.phase_started, 1),
+        } for session in self.flash_sessions.values()]
+        firmwares = [{
+            'path': self.firmware_paths[i].get(),
+            'address': self.firmware_addresses[i].get(),
+            'enabled': bool(self.firmware_enables[i].get()),
+        } for i in range(8) if self.firmware_paths[i].get()]
+        return {
+            'tool': 'flasher',
+            'ports': sorted(self.port_info),
+            'sessions': sessions,
+            'firmwares': firmwares,
+            'auto_flash': bool(self.auto_flash.get()),
+            'baudrate': self.baud_combobox.get(),
+            'erase_flash': bool(self.erase_flash.get()),
+            'records': len(self.flash_records),
+            'hubs': self.engine.scheduler.snapshot(),
+            'links': self.engine.link_quality.summary(),
+            'profiles': [profile.describe() for profile in self.engine.profiles.profiles],
+            'reset_strategies': self.engine.reset_strategies.summary(),
+            'busy_ports': {port: describe_holder(holder) for port, holder
+                           in self.engine.leases.busy_ports(sorted(self.port_info)).items()},
+        }
+
+    def api_load_manifest(self, data):
+        if data.get('path'):
+            manifest_path = os.path.abspath(data['path'])
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError) as e:
+                raise ValueError(f"无法读取固件清单 {manifest_path}: {e}")
+            base_dir = os.path.dirname(manifest_path)
+        else:
+            manifest = data
+            base_dir = os.getcwd()
+
+        entries = manifest.get('firmwares') if isinstance(manifest, dict) else None
+        if not isinstance(entries, list) or not entries:
+            raise ValueError("固件清单中缺少 firmwares 列表")
+        if len(entries) > 8:
+            raise ValueError("固件清单最多 8 个固件")
+        firmwares = []
+        for entry in entries:
+            if not isinstance(entry, dict) or not entry.get('path'):
+                raise ValueError("固件清单的每一项都需要 path")
+            path = os.path.join(base_dir, entry['path'])
+            if not os.path.isfile(path):
+                raise ValueError(f"固件文件不存在: {path}")
+            address = str(entry.get('address', '0x0'))
+            try:
+                int(address, 0)
+            except ValueError:
+                raise ValueError(f"固件地址无效: {address}")
+            firmwares.append((os.path.abspath(path), address))
+        return self.ui.call_wait(self._apply_manifest, firmwares, manifest)
+
+    def _apply_manifest(self, firmwares, manifest):
+        """把固件清单填入界面的固件栏（主线程）"""
+        for i in range(8):
+            path, address = firmwares[i] if i < len(firmwares) else ('', '0x0')
+            self.firmware_paths[i].set(path)
+            self.firmware_addresses[i].delete(0, tk.END)
+            self.firmware_addresses[i].insert(0, address)
+            self.firmware_enables[i].set(i < len(firmwares))
+        if 'baudrate' in manifest:
+            self.baud_combobox.set(str(manifest['baudrate']))
+        if 'erase_flash' in manifest:
+            self.erase_flash.set(bool(manifest['erase_flash']))
+        self.save_config()
+        self.log(f"控制接口加载固件清单: {len(firmwares)} 个固件")
+        return {'firmwares': [{'path': path, 'address': address} for path, address in firmwares]}
+
+    def api_start(self, data):
+        ports = data.get('ports')
+        if ports is not None and (not isinstance(ports, list) or not all(isinstance(p, str) for p in ports)):
+            raise ValueError("ports 应为端口名列表")
+        return self.ui.call_wait(self._api_start, ports)
+
+    def _api_start(self, ports):
+        firmwares = self._selected_firmwares()
+        if not firmwares and not self.engine.profiles.profiles:
+            raise ValueError("没有启用的有效固件")
+        if ports is None:
+            ports = self._selected_ports()
+        if not ports:
+            raise ValueError("没有可烧录的端口")
+        busy = [port for port in ports if self.engine.session_on_port(port)]
+        ports = [port for port in ports if port not in busy]
+        self.start_flash_ports(ports, firmwares)
+        return {'started': ports, 'busy': busy}
+
+    def api_stop(self, data):
+        port = data.get('port')
+        self.ui.call_wait(self.stop_flash, port)
+        return {'stopped': port or 'all'}
+
+    def api_records(self, since):
+        records = self.ui.call_wait(lambda: self.flash_records[max(0, since):])
+        return {'records': records, 'next': max(0, since) + len(records)}
+
     def monitor_ports(self):
         """优化串口监控逻辑"""
         old_ports = set()
         while True:
             try:
-                current_ports = set(port.device for port in list_ports.comports())
+                current_ports = self.engine.refresh_ports()
                 
                 if current_ports != old_ports:
                     # 创建副本并使用默认参数捕获值，避免引用问题
                     old_ports_copy = old_ports.copy()
                     current_ports_copy = current_ports.copy()
-                    self.root.after(0, lambda o=old_ports_copy, c=current_ports_copy: self.handle_port_changes(o, c))
+                    self.ui.call(self.handle_port_changes, old_ports_copy, current_ports_copy)
                     old_ports = current_ports
                 
                 # 增加睡眠时间，减少CPU使用
@@ -372,13 +610,27 @@ class ESP32Flasher:
 
     def handle_port_changes(self, old_ports, current_ports):
         """统一处理端口变化"""
-        # 处理移除的端口
+        # 处理移除的端口：不等待esptool超时，立即终止或等待设备重新枚举
         for port in (old_ports - current_ports):
+            self.events.publish('port_removed', port=port)
+            self.engine.port_lost(port)
             if port in self.log_windows:
                 self.close_log_window(port)
         
-        # 处理新增的端口
+        # 处理新增的端口；属于进行中任务的设备（重新枚举）直接交还给原任务
         new_ports = current_ports - old_ports
+        for port in new_ports:
+            self.events.publish('port_added', port=port)
+        if self.tracer.enabled:
+            detected_at = self.tracer.now()
+            for port in new_ports:
+                self._port_detected_at[port] = detected_at
+                self.tracer.instant("端口插入", port)
+        for port in list(new_ports):
+            if self.engine.port_appeared(port):
+                new_ports.discard(port)
+        # 扫码枪、调试器等非目标设备不进入自动烧录
+        new_ports = set(self.engine.filter_new_ports(sorted(new_ports)))
         if new_ports:
             self.log(f"[调试] 检测到新端口: {list(new_ports)}")
             self.log(f"[调试] 自动烧录状态: {self.auto_flash.get()}")
@@ -418,7 +670,8 @@ class ESP32Flasher:
         
         self.log(f"[调试] 共有 {enabled_count} 个固件被启用，{len(selected_firmwares)} 个有效")
         
-        if not selected_firmwares:
+        # 配置了按芯片选择的固件配置时，界面上的固件只用于没有匹配配置的芯片
+        if not selected_firmwares and not self.engine.profiles.profiles:
             self.log("错误: 没有选择有效的固件，无法执行自动烧录")
             self.log("提示: 请勾选至少一个固件前的复选框，并确保固件路径有效")
             return
@@ -431,18 +684,20 @@ class ESP32Flasher:
             self.log("没有新端口可用于自动烧录")
             return
         
+        # 刚烧录完成后重新枚举的原生USB设备，按USB序列号直接识别
+        if self.engine.recent_action == 'skip':
+            for port in list(enabled_ports):
+                if self.engine.recent_devices.is_recent(usb_serial=self.engine.usb_serial(port)):
+                    self.log(f"端口 {port} 是刚烧录完成的设备（复位后重新枚举），跳过")
+                    enabled_ports.remove(port)
+            if not enabled_ports:
+                return
+        
         self.log(f"开始为 {len(enabled_ports)} 个新端口烧录 {len(selected_firmwares)} 个固件")
         
-        # 为每个新端口创建烧录线程
-        for port in enabled_ports:
-            self.log(f"[调试] 启动烧录线程: {port}")
-            thread = threading.Thread(
-                target=self.flash_process_multi,
-                args=(port, selected_firmwares),
-                daemon=True
-            )
-            thread.start()
-            self.log(f"烧录线程已启动: {port}")
+        # 为每个新端口提交烧录任务
+        for job in self.start_flash_ports(enabled_ports, selected_firmwares, auto=True):
+            self.log(f"烧录线程已启动: {job.port}")
 
     def create_ui(self):
         # 创建左右分割主窗口
@@ -460,28 +715,11 @@ class ESP32Flasher:
         history_title = ttk.Label(history_frame, text="烧录记录", font=('Microsoft YaHei UI', 11, 'bold'), foreground=COLORS['text_primary'])
         history_title.pack(anchor="w", pady=(0, 15))
         
-        columns = ("time", "port", "mac", "chip", "status")
-        self.history_tree = ttk.Treeview(history_frame, columns=columns, show="headings", height=20)
-        self.history_tree.heading("time", text="时间")
-        self.history_tree.heading("port", text="端口")
-        self.history_tree.heading("mac", text="MAC地址")
-        self.history_tree.heading("chip", text="芯片")
-        self.history_tree.heading("status", text="状态")
-        
-        self.history_tree.column("time", width=70, anchor="center")
-        self.history_tree.column("port", width=60, anchor="center")
-        self.history_tree.column("mac", width=125, anchor="center")
-        self.history_tree.column("chip", width=75, anchor="center")
-        self.history_tree.column("status", width=50, anchor="center")
-        
-        history_scroll = ttk.Scrollbar(history_frame, orient="vertical", command=self.history_tree.yview)
-        self.history_tree.configure(yscrollcommand=history_scroll.set)
-        
-        self.history_tree.pack(side="left", fill="both", expand=True)
-        history_scroll.pack(side="right", fill="y")
-        
-        self.history_tree.tag_configure('success', foreground=COLORS['success'], font=('Microsoft YaHei UI', 9))
-        self.history_tree.tag_configure('fail', foreground=COLORS['danger'], font=('Microsoft YaHei UI', 9))
+        # 批次统计和记录列表在启动就绪后再创建（_build_lot_panel / _build_history_panel）
+        self.lot_container = ttk.Frame(history_frame)
+        self.lot_container.pack(fill="x")
+        self.history_frame = history_frame
+        self.history_tree = None
 
         # === 顶部区域 ===
         title_frame = ttk.Frame(main_frame)
@@ -627,6 +865,12 @@ class ESP32Flasher:
         self.flash_freq_cb.bind('<<ComboboxSelected>>', lambda e: self.save_config())
         self.flash_freq_cb.pack(side="left", padx=(0, 15))
         
+        ttk.Label(settings_frame, text="校验:").pack(side="left", padx=(0, 4))
+        self.verify_mode_cb = ttk.Combobox(settings_frame, width=9, values=list(MODE_LABELS.values()), state='readonly')
+        self.verify_mode_cb.set(MODE_LABELS[HASH])
+        self.verify_mode_cb.bind('<<ComboboxSelected>>', lambda e: self.on_verify_mode_changed())
+        self.verify_mode_cb.pack(side="left", padx=(0, 15))
+
         self.erase_flash = tk.BooleanVar(value=False)
         ttk.Checkbutton(settings_frame, text="烧录前擦除", variable=self.erase_flash, command=self.save_config).pack(side="left", padx=(0, 15))
         
@@ -651,6 +895,10 @@ class ESP32Flasher:
         self.log_status.pack(side="left")
         
         ttk.Button(log_toolbar, text="清空日志", command=self.clear_log, width=10).pack(side="right")
+        self.trace_button = ttk.Button(log_toolbar, text="记录时间线", command=self.toggle_trace, width=12)
+        self.trace_button.pack(side="right", padx=(0, 6))
+        self.profile_button = ttk.Button(log_toolbar, text="性能分析", command=self.toggle_profile, width=10)
+        self.profile_button.pack(side="right", padx=(0, 6))
         
         log_text_frame = ttk.Frame(self.log_frame)
         log_text_frame.pack(fill="both", expand=True)
@@ -698,55 +946,27 @@ class ESP32Flasher:
         # 创建或获取日志窗口
         if port not in self.log_windows:
             self.log_windows[port] = LogWindow(port)
-        log_window = self.log_windows[port]
-        log_window.log(f"开始擦除 {port} 的Flash...")
+        self.log_windows[port].log(f"开始擦除 {port} 的Flash...")
+        log_window = self.ui.port_logger(port)
 
         # 在新线程中执行擦除
         thread = threading.Thread(
             target=self._erase_flash_thread,
-            args=(port, log_window),
+            args=(port, self.baud_combobox.get(), log_window),
             daemon=True
         )
         thread.start()
 
-    def _erase_flash_thread(self, port, log_window):
+    def _erase_flash_thread(self, port, baud, log_window):
         """擦除Flash的线程函数"""
+        threading.current_thread().name = f"擦除 {port}"
         try:
-            erase_cmd = [
-                "python", "-m", "esptool",
-                "--port", port,
-                "--baud", self.baud_combobox.get(),
-                "erase-flash"
-            ]
-
-            log_window.log(f"执行命令: {' '.join(erase_cmd)}")
-
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
-            erase_process = subprocess.Popen(
-                " ".join(erase_cmd),
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                startupinfo=startupinfo,
-                shell=True
-            )
-
-            for line in erase_process.stdout:
-                log_window.log(line.strip())
-            erase_process.wait()
-
-            if erase_process.returncode != 0:
-                log_window.log(f"❌ 擦除Flash失败，返回码: {erase_process.returncode}")
-                self.root.after(0, lambda: messagebox.showerror("错误", f"端口 {port} 擦除Flash失败"))
-            else:
-                log_window.log("✅ Flash擦除完成!")
-                self.root.after(0, lambda: self.log(f"✅ 端口 {port} Flash擦除完成"))
-
+            self.engine.erase(port, baud, log_window.log)
+            log_window.log("✅ Flash擦除完成!")
+            self.log(f"✅ 端口 {port} Flash擦除完成")
         except Exception as e:
-            log_window.log(f"❌ 擦除异常: {str(e)}")
-            self.root.after(0, lambda: messagebox.showerror("错误", f"擦除失败: {str(e)}"))
+            log_window.log(f"❌ 擦除Flash失败: {describe_error(e)}")
+            self.ui.call(messagebox.showerror, "错误", f"端口 {port} 擦除Flash失败")
 
     def refresh_ports(self):
         ports = [port.device for port in list_ports.comports()]
@@ -805,6 +1025,11 @@ class ESP32Flasher:
                         self.flash_mode_cb.set(self.config['flash_mode'])
                     if 'flash_freq' in self.config:
                         self.flash_freq_cb.set(self.config['flash_freq'])
+                    # 冷却、重新枚举、看门狗、重试和校验设置
+                    self.engine.configure(self.config)
+                    self.verify_mode_cb.set(MODE_LABELS[self.engine.verify_policy.mode])
+                    self.lot = LotTracker(self.config.get('lot_target', 0),
+                                          self.config.get('lot_uph_windows', DEFAULT_WINDOWS))
             else:
                 self.config = {
                     'firmware_paths': [''] * 8,
@@ -815,7 +1040,10 @@ class ESP32Flasher:
                     'baudrate': 921600,
                     'erase_flash': False,
                     'flash_mode': 'keep',
-                    'flash_freq': 'keep'
+                    'flash_freq': 'keep',
+                    'recent_cooldown': 60,
+                    'recent_action': 'skip',
+                    'reattach_timeout': 5
                 }
         except Exception as e:
             self.log(f"加载配置失败: {str(e)}")
@@ -828,7 +1056,10 @@ class ESP32Flasher:
                 'baudrate': 921600,
                 'erase_flash': False,
                 'flash_mode': 'keep',
-                'flash_freq': 'keep'
+                'flash_freq': 'keep',
+                'recent_cooldown': 60,
+                'recent_action': 'skip',
+                'reattach_timeout': 5
             }
 
     def save_config(self):
@@ -840,6 +1071,7 @@ class ESP32Flasher:
             self.config['auto_flash'] = self.auto_flash.get()
             self.config['baudrate'] = int(self.baud_combobox.get())
             self.config['erase_flash'] = self.erase_flash.get()
+            self.config['verify_mode'] = mode_from_label(self.verify_mode_cb.get())
             self.config['flash_mode'] = self.flash_mode_cb.get()
             self.config['flash_freq'] = self.flash_freq_cb.get()
             with open(self.config_file, 'w', encoding='utf-8') as f:
@@ -858,19 +1090,43 @@ class ESP32Flasher:
             # 使用延迟确保在文本更新后滚动到尾部
             self.root.after(50, lambda: self.firmware_entries[index].xview_moveto(1.0))
             self.save_config()
+            self._inspect_slots([index])
 
-    def start_flash(self):
-        # 获取启用的串口
+    def _inspect_slots(self, indices):
+        """后台解析固件槽位的镜像头并在日志中给出结果（任务开始时还会对照芯片再检查）"""
+        if not self.engine.image_check:
+            return
+        slots = [(i, self.firmware_paths[i].get(), self.firmware_addresses[i].get()) for i in indices]
+        slots = [(i, path, address) for i, path, address in slots if path and os.path.exists(path)]
+        if not slots:
+            return
+
+        def inspect():
+            for i, path, address in slots:
+                try:
+                    firmware = self.engine.images.inspect(path)
+                except OSError as e:
+                    self.log(f"固件 {i + 1}: 无法读取 {path} ({e.strerror or e})")
+                    continue
+                problems = self.engine.inspect_firmwares([(path, address)])
+                if problems:
+                    for problem in problems:
+                        self.log(f"固件 {i + 1}: 镜像检查未通过 - {problem}")
+                else:
+                    self.log(f"固件 {i + 1}: {os.path.basename(path)} @ {address}（{firmware.describe()}）")
+
+        threading.Thread(target=inspect, name="检查固件镜像", daemon=True).start()
+
+    def _selected_ports(self):
+        """界面中已选择并启用的串口"""
         selected_ports = []
         for i, cb in enumerate(self.port_comboboxes):
             if cb.get() and self.port_enables[i].get():  # 只选择启用的串口
                 selected_ports.append(cb.get())
-        
-        if not selected_ports:
-            self.log("错误: 请选择并启用至少一个串口")
-            return
-        
-        # 获取选中的固件和地址
+        return selected_ports
+
+    def _selected_firmwares(self):
+        """界面中已启用且文件存在的固件 [(路径, 地址)]"""
         selected_firmwares = []
         for i in range(8):  # 修改为8个
             if self.firmware_enables[i].get():
@@ -878,214 +1134,93 @@ class ESP32Flasher:
                 address = self.firmware_addresses[i].get()
                 if firmware and os.path.exists(firmware):
                     selected_firmwares.append((firmware, address))
+        return selected_firmwares
+
+    def start_flash(self):
+        # 获取启用的串口
+        selected_ports = self._selected_ports()
+        if not selected_ports:
+            self.log("错误: 请选择并启用至少一个串口")
+            return
         
-        if not selected_firmwares:
+        # 获取选中的固件和地址
+        selected_firmwares = self._selected_firmwares()
+        if not selected_firmwares and not self.engine.profiles.profiles:
             self.log("错误: 请选择至少一个固件")
             return
         
-        # 为每个选中的端口创建烧录线程
-        for port in selected_ports:
-            thread = threading.Thread(
-                target=self.flash_process_multi,
-                args=(port, selected_firmwares),
-                daemon=True
-            )
-            thread.start()
-
-    def _run_esptool(self, args, log_window, port=None, cancel_event=None):
-        captured_lines = []
-
-        cmd = [sys.executable, "-m", "esptool"] + list(args)
-        creationflags = 0
-        if os.name == "nt":
-            try:
-                creationflags = subprocess.CREATE_NO_WINDOW
-            except Exception:
-                creationflags = 0
-
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            creationflags=creationflags
-        )
-
-        if port:
-            self.flash_processes[port] = proc
-
-        try:
-            while True:
-                if cancel_event is not None and cancel_event.is_set():
-                    raise RuntimeError("cancelled")
-
-                line = proc.stdout.readline() if proc.stdout else ""
-                if not line:
-                    if proc.poll() is not None:
-                        break
-                    time.sleep(0.01)
-                    continue
-
-                text_line = line.rstrip("\r\n")
-                captured_lines.append(text_line)
-                try:
-                    log_window.window.after(0, lambda t=text_line: log_window.log(t))
-                except Exception:
-                    pass
-
-            rc = proc.wait()
-            if rc != 0:
-                raise RuntimeError(f"esptool exited with code {rc}")
-        finally:
-            if port:
-                try:
-                    if self.flash_processes.get(port) is proc:
-                        del self.flash_processes[port]
-                except Exception:
-                    pass
-            try:
-                if proc.stdout:
-                    proc.stdout.close()
-            except Exception:
-                pass
-
-        return "\n".join(captured_lines)
-
-    def _release_port(self, port):
-        try:
-            s = serial.Serial(port=port, baudrate=115200, timeout=0)
-            try:
-                s.dtr = False
-                s.rts = False
-            except Exception:
-                pass
-            s.close()
-        except Exception:
-            pass
-
-    def flash_process_multi(self, port, firmwares):
-        cancel_event = threading.Event()
-        self.flash_cancel_events[port] = cancel_event
-        log_window = LogWindow(port, on_close=lambda p=port: self.stop_flash(p))
-        self.log_windows[port] = log_window
+        self.start_flash_ports(selected_ports, selected_firmwares)
+
+    def start_flash_ports(self, ports, firmwares, auto=False):
+        """为每个端口提交烧录任务（按钮、自动烧录和控制接口共用，主线程中调用）"""
+        options = self._flash_options()
+        return [self.engine.submit(port, firmwares, options, auto) for port in ports]
+
+    def on_verify_mode_changed(self):
+        """切换校验方式，重新开始计数（下一台为首件）"""
+        self.engine.verify_policy.mode = mode_from_label(self.verify_mode_cb.get())
+        self.engine.verify_policy.reset()
+        self.log(f"校验方式: {MODE_LABELS[self.engine.verify_policy.mode]}")
+        self.save_config()
+
+    def _flash_options(self):
+        """界面当前的烧录参数（主线程中读取，任务运行中不再访问控件）"""
+        return FlashOptions(self.baud_combobox.get(), self.erase_flash.get(),
+                            self.flash_mode_cb.get(), self.flash_freq_cb.get())
+
+    # ---- 烧录引擎回调（在工作线程中调用） ----
+    def _on_job_started(self, job):
+        session = job.session
+        detected_at = self._port_detected_at.pop(job.port, None)
+        if detected_at is not None:
+            # 从主线程发现端口到烧录线程启动（含 handle_port_changes 的固定延时）
+            self.tracer.complete("排队", session.key, detected_at, job.started, CAT_WAIT)
+        self.events.publish('job_started', port=job.port, key=session.key, auto=job.auto)
+        # 日志窗口由主线程创建，本线程只通过事件队列写日志
+        self.ui.call(self._open_flash_log_window, session.key, job.port)
+
+    def _on_job_log(self, job, line):
+        self.ui.port_log(job.key, line)
+
+    def _on_job_phase(self, job, phase):
+        self.events.publish('phase', port=job.current_port, key=job.key, phase=phase)
+
+    def _on_job_record(self, job):
+        self.add_flash_record(job.current_port, job.chip or "Unknown", job.mac, job.success, job.note,
+                              verify=job.verify, cycle_time=job.cycle_time, retries=job.retries,
+                              verify_only=job.verify_only)
+
+    def _on_job_reattached(self, key, port):
+        self.ui.call(self._retitle_log_window, key, port)
+
+    def _on_job_finished(self, job):
+        if job.result in (SUCCESS, VERIFIED):
+            self.ui.port_log(job.key, "\n✅ 烧录成功！为方便操作，此弹窗将在 3 秒后自动优雅关闭...")
+        if job.result in (SUCCESS, VERIFIED, SKIPPED):
+            self.ui.call_later(3000, self.close_log_window, job.key)
+        self.events.publish('job_finished', port=job.current_port, key=job.key, result=job.result,
+                            chip=job.chip, mac=job.mac,
+                            seconds=round(time.monotonic() - job.started, 2))
+
+    def _open_flash_log_window(self, key, port):
+        """在主线程中创建烧录日志窗口（按设备标识索引）"""
+        self.close_log_window(key)
+        log_window = LogWindow(port, on_close=lambda k=key: self.stop_flash(k))
+        self.log_windows[key] = log_window
         log_window.window.lift()
         log_window.window.focus_force()
 
-        log_window.log(f"开始为端口 {port} 烧录固件...")
-        self.log(f"开始为端口 {port} 烧录固件...")
-
-        chip_type = None
-        mac_address = "Unknown"
-
-        try:
-            import re
-
-            if cancel_event.is_set():
-                raise Exception("cancelled")
-
-            log_window.log("检测芯片类型...")
-            output = self._run_esptool(["--port", port, "read-mac"], log_window, port=port, cancel_event=cancel_event)
-
-            output_upper = output.upper()
-            if "ESP32-S3" in output_upper or "ESP32S3" in output_upper:
-                chip_type = "ESP32-S3"
-            elif "ESP32-S2" in output_upper or "ESP32S2" in output_upper:
-                chip_type = "ESP32-S2"
-            elif "ESP32-C3" in output_upper or "ESP32C3" in output_upper:
-                chip_type = "ESP32-C3"
-            elif "ESP32-C6" in output_upper or "ESP32C6" in output_upper:
-                chip_type = "ESP32-C6"
-            elif "ESP32-H2" in output_upper or "ESP32H2" in output_upper:
-                chip_type = "ESP32-H2"
-            elif "ESP32-P4" in output_upper or "ESP32P4" in output_upper:
-                chip_type = "ESP32-P4"
-            elif "ESP32-C2" in output_upper or "ESP32C2" in output_upper:
-                chip_type = "ESP32-C2"
-            elif "ESP32" in output_upper:
-                chip_type = "ESP32"
-
-            if not chip_type:
-                log_window.log("警告: 未能自动识别芯片类型，将使用通用参数")
-                chip_type = "ESP32"
-
-            log_window.log(f"检测到芯片类型: {chip_type}")
-
-            mac_match = re.search(
-                r'MAC:\s*([0-9a-fA-F]{2}:[0-9a-fA-F]{2}:[0-9a-fA-F]{2}:[0-9a-fA-F]{2}:[0-9a-fA-F]{2}:[0-9a-fA-F]{2})',
-                output
-            )
-            if mac_match:
-                mac_address = mac_match.group(1)
-                log_window.log(f"MAC地址: {mac_address}")
-
-            chip_param = self.get_chip_param(chip_type)
-            if not chip_param:
-                log_window.log(f"不支持的芯片类型: {chip_type}")
-                self.add_flash_record(port, chip_type, mac_address, False, "不支持的芯片类型")
-                return
+    def _retitle_log_window(self, key, port):
+        """设备重新枚举到新端口后更新日志窗口标题"""
+        log_window = self.log_windows.get(key)
+        if log_window:
+            log_window.set_port(port)
 
-            if self.erase_flash.get():
-                log_window.log("正在擦除Flash...")
-                self._run_esptool([
-                    "--port", port,
-                    "--baud", self.baud_combobox.get(),
-                    "erase_flash"
-                ], log_window, port=port, cancel_event=cancel_event)
-                log_window.log("Flash擦除完成!")
-
-            for firmware, address in firmwares:
-                if cancel_event.is_set():
-                    raise Exception("cancelled")
-                flash_args = [
-                    "--port", port,
-                    "--baud", self.baud_combobox.get(),
-                    "--before", "default_reset",
-                    "--after", "hard_reset"
-                ]
-                if self.flash_mode_cb.get() != 'keep':
-                    flash_args.extend(["--flash_mode", self.flash_mode_cb.get()])
-                if self.flash_freq_cb.get() != 'keep':
-                    flash_args.extend(["--flash_freq", self.flash_freq_cb.get()])
-                
-                flash_args.extend(["write_flash", address, firmware])
-
-                log_window.log(f"执行命令: esptool {' '.join(flash_args)}")
-                self._run_esptool(flash_args, log_window, port=port, cancel_event=cancel_event)
-                log_window.log(f"端口 {port} 固件 {firmware} 烧录完成!")
-
-            log_window.log(f"端口 {port} 所有固件烧录完成!")
-            self.add_flash_record(port, chip_type, mac_address, True, "")
-            
-            log_window.log("\n✅ 烧录成功！为方便操作，此弹窗将在 3 秒后自动优雅关闭...")
-            self.root.after(3000, lambda p=port: self.close_log_window(p))
-
-        except Exception as e:
-            error_msg = str(e)
-            if "cancelled" in error_msg.lower() or error_msg == "cancelled":
-                try:
-                    log_window.log(f"端口 {port} 已停止烧录")
-                except Exception:
-                    pass
-                self.log(f"端口 {port} 已停止烧录")
-                self._release_port(port)
-            else:
-                log_window.log(f"端口 {port} 烧录错误: {error_msg}")
-                self.log(f"错误: {error_msg}")
-                self.add_flash_record(port, chip_type if chip_type else "Unknown", mac_address, False, error_msg)
-
-        finally:
-            # 清理取消标志
-            try:
-                if port in self.flash_cancel_events:
-                    del self.flash_cancel_events[port]
-            except Exception:
-                pass
-            try:
-                if port in self.flash_processes:
-                    del self.flash_processes[port]
-            except Exception:
-                pass
+    def _append_port_log_lines(self, port, lines):
+        """事件队列回调：批量写入端口日志窗口"""
+        log_window = self.log_windows.get(port)
+        if log_window:
+            log_window.log("\n".join(lines))
 
     def close_log_window(self, port):
         """安全地关闭日志窗口"""
@@ -1097,53 +1232,89 @@ class ESP32Flasher:
                 self.log(f"关闭日志窗口失败: {str(e)}")
 
     def stop_flash(self, port=None):
-        """停止烧录（port=None 表示停止所有端口）"""
-        if port is None:
-            for p in list(self.flash_cancel_events.keys()):
-                try:
-                    self.flash_cancel_events[p].set()
-                except Exception:
-                    pass
-                try:
-                    proc = self.flash_processes.get(p)
-                    if proc and proc.poll() is None:
-                        if os.name == "nt":
-                            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                        else:
-                            proc.terminate()
-                except Exception:
-                    pass
-                try:
-                    self._release_port(p)
-                except Exception:
-                    pass
+        """停止烧录（port 可以是端口名或设备标识，None 表示停止所有端口）"""
+        self.engine.stop(port)
+
+    def toggle_trace(self):
+        """开始记录时间线；再次点击时停止并导出为 Chrome trace JSON"""
+        if not self.tracer.enabled:
+            self.tracer.start()
+            self._port_detected_at.clear()
+            self.trace_button.config(text="导出时间线")
+            self.log("开始记录时间线，再次点击按钮停止并导出")
+            return
+
+        self.tracer.stop()
+        self.trace_button.config(text="记录时间线")
+        try:
+            import datetime
+            from tkinter import filedialog
+
+            default_filename = f"时间线_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+            filename = filedialog.asksaveasfilename(
+                defaultextension=".json",
+                initialfile=default_filename,
+                filetypes=[("Chrome trace", "*.json"), ("所有文件", "*.*")]
+            )
+            if not filename:
+                return
+            count = self.tracer.export(filename)
+            self.log(f"时间线已导出: {filename} ({count} 个事件)，可在 chrome://tracing 或 ui.perfetto.dev 中打开")
+        except Exception as e:
+            self.log(f"导出时间线失败: {str(e)}")
+
+    def toggle_profile(self, duration=None):
+        """开始性能分析；再次点击或到达 duration 秒后停止并保存报告"""
+        if not self.profiler.running:
+            try:
+                self.profiler.start(duration, on_finish=lambda path: self.ui.call(self._profile_finished, path))
+            except Exception as e:
+                self.log(f"启动性能分析失败: {str(e)}")
+                return
+            self.profile_button.config(text="停止分析")
+            if duration:
+                self.log(f"开始性能分析，{duration:g} 秒后自动保存报告（分析期间程序会变慢）")
+            else:
+                self.log("开始性能分析，再次点击按钮停止并保存报告（分析期间程序会变慢）")
             return
 
         try:
-            if port in self.flash_cancel_events:
-                self.flash_cancel_events[port].set()
+            path = self.profiler.stop()
+        except Exception as e:
+            self.profile_button.config(text="性能分析")
+            self.log(f"保存性能分析报告失败: {str(e)}")
+            return
+        self._profile_finished(path)
+
+    def _profile_finished(self, path):
+        self.profile_button.config(text="性能分析")
+        if path:
+            self.log(f"性能分析报告已保存: {os.path.abspath(path)}")
+
+    def on_main_close(self):
+        """主窗口关闭：停止所有烧录并关闭所有日志窗口"""
+        try:
+            self.stop_flash(None)
         except Exception:
             pass
 
         try:
-            proc = self.flash_processes.get(port)
-            if proc and proc.poll() is None:
-                if os.name == "nt":
-                    subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                else:
-                    proc.terminate()
+            self.metrics.shutdown()
+            if self.control_server is not None:
+                self.control_server.shutdown()
         except Exception:
             pass
 
         try:
-            self._release_port(port)
+            self.engine.link_quality.save()
+            self.engine.reset_strategies.save()
         except Exception:
             pass
 
-    def on_main_close(self):
-        """主窗口关闭：停止所有烧录并关闭所有日志窗口"""
+        # 关闭时仍在分析则保存已采集的部分
         try:
-            self.stop_flash(None)
+            if self.profiler.running:
+                self.profiler.stop()
         except Exception:
             pass
 
@@ -1153,6 +1324,7 @@ class ESP32Flasher:
             except Exception:
                 pass
 
+        self.ui.stop()
         try:
             self.root.destroy()
         except Exception:
@@ -1160,109 +1332,304 @@ class ESP32Flasher:
 
     def log(self, message):
         """线程安全的日志记录方法，支持彩色日志"""
-        def _log():
-            try:
-                # 配置日志标签颜色
-                if not hasattr(self, '_log_tags_configured'):
-                    self.log_text.tag_config("info", foreground="#e2e8f0")
-                    self.log_text.tag_config("success", foreground="#34d399", font=('Consolas', 10, 'bold'))
-                    self.log_text.tag_config("error", foreground="#f87171", font=('Consolas', 10, 'bold'))
-                    self.log_text.tag_config("warning", foreground="#fbbf24")
-                    self._log_tags_configured = True
-                
-                # 添加时间戳
-                timestamp = time.strftime("%H:%M:%S")
-                formatted_msg = f"[{timestamp}] {message}\n"
-                
-                # 根据消息内容选择标签
-                tag = "info"
-                if "错误" in message or "失败" in message or "Error" in message:
-                    tag = "error"
-                    self.update_status("错误")
-                elif "警告" in message or "Warning" in message:
-                    tag = "warning"
-                elif "成功" in message or "完成" in message:
-                    tag = "success"
-                    self.update_status("完成")
-                elif "开始" in message:
-                    self.update_status("烧录中...")
-                
-                self.log_text.insert("end", formatted_msg, tag)
-                self.log_text.see("end")
-            except Exception:
-                pass
-        
-        # 检查是否在主线程
+        # 时间戳在投递时生成，渲染由主线程批量完成
+        timestamp = time.strftime("%H:%M:%S")
+        self.ui.log(f"[{timestamp}] {message}")
+
+    def _append_log_lines(self, port, lines):
+        """事件队列回调：批量写入主日志"""
         try:
-            self.root.after(0, _log)
+            # 配置日志标签颜色
+            if not hasattr(self, '_log_tags_configured'):
+                self.log_text.tag_config("info", foreground="#e2e8f0")
+                self.log_text.tag_config("success", foreground="#34d399", font=('Consolas', 10, 'bold'))
+                self.log_text.tag_config("error", foreground="#f87171", font=('Consolas', 10, 'bold'))
+                self.log_text.tag_config("warning", foreground="#fbbf24")
+                self._log_tags_configured = True
+
+            chunks = []
+            status = None
+            for message in lines:
+                # 根据消息内容选择标签
+                tag, line_status = classify_log_line(message)
+                if line_status:
+                    status = line_status
+                chunks.extend((message + "\n", tag))
+
+            self.log_text.insert("end", *chunks)
+            self.log_text.see("end")
+            if status:
+                self.update_status(status)
         except Exception:
-            # 如果after失败，直接调用（可能在主线程中）
-            _log()
+            pass
     
     def update_status(self, message):
-        """更新状态栏信息"""
-        def _update():
-            try:
-                if hasattr(self, 'status_label'):
-                    self.status_label.config(text=f"版本: v1.0 | {message}")
-                if hasattr(self, 'log_status'):
-                    self.log_status.config(text=message)
-            except:
-                pass
-        
+        """更新状态栏信息（主线程）"""
         try:
-            self.root.after(0, _update)
+            if hasattr(self, 'status_label'):
+                self.status_label.config(text=f"版本: v1.0 | {message}")
+            if hasattr(self, 'log_status'):
+                self.log_status.config(text=message)
         except:
-            _update()
+            pass
 
     def clear_log(self):
         """清除日志内容"""
         self.log_text.delete(1.0, tk.END)
         self.update_status("就绪")
 
-    def get_chip_param(self, chip_type):
-        """将检测到的芯片类型转换为对应的参数"""
-        chip_map = {
-            'ESP32': 'esp32',
-            'ESP32-S2': 'esp32s2',
-            'ESP32-S3': 'esp32s3',
-            'ESP32-C2': 'esp32c2',
-            'ESP32-C3': 'esp32c3',
-            'ESP32-C6': 'esp32c6',
-            'ESP32-H2': 'esp32h2',
-            'ESP32-P4': 'esp32p4'
-        }
-        return chip_map.get(chip_type, 'esp32')  # 默认返回 esp32
-    
-    def add_flash_record(self, port, chip_type, mac_address, success, error_msg=""):
-        """添加烧录记录"""
+    def add_flash_record(self, port, chip_type, mac_address, success, error_msg="", verify=None,
+                         cycle_time=None, retries=0, verify_only=False):
+        """添加烧录记录（可在工作线程中调用）
+
+        verify 为 (校验方式, 校验耗时秒数)，未执行校验时为 None；
+        cycle_time 为任务开始到结束的秒数，retries 为自动重试次数，仅校验的记录不计入批次。
+        """
         import datetime
-        time_full = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        time_short = datetime.datetime.now().strftime('%H:%M:%S')
+        now = datetime.datetime.now()
         record = {
-            'time': time_full,
+            'time': now.strftime('%Y-%m-%d %H:%M:%S'),
             'port': port,
             'chip_type': chip_type,
             'mac_address': mac_address,
             'success': success,
-            'error_msg': error_msg
+            'error_msg': error_msg,
+            'verify_mode': verify[0] if verify else '',
+            'verify_time': round(verify[1], 2) if verify else '',
+            'cycle_time': round(cycle_time, 2) if cycle_time is not None else None,
+            'retries': retries,
+            'verify_only': verify_only
         }
-        self.flash_records.append(record)
+        self.ui.call(self._apply_flash_record, record)
+
+        # 记录到日志
+        status = "成功" if success else "失败"
+        self.log(f"记录: {port} {chip_type} {mac_address} - {status}")
+
+    def _build_history_panel(self):
+        """创建右侧烧录记录列表（启动就绪后由主循环空闲时调用，不占用启动时间）"""
+        if self.history_tree is not None:
+            return
+        columns = ("time", "port", "mac", "chip", "status")
+        self.history_tree = ttk.Treeview(self.history_frame, columns=columns, show="headings", height=20)
+        self.history_tree.heading("time", text="时间")
+        self.history_tree.heading("port", text="端口")
+        self.history_tree.heading("mac", text="MAC地址")
+        self.history_tree.heading("chip", text="芯片")
+        self.history_tree.heading("status", text="状态")
         
-        # 更新右侧历史列表
-        status_text = "成功" if success else "失败"
-        tag = 'success' if success else 'fail'
+        self.history_tree.column("time", width=70, anchor="center")
+        self.history_tree.column("port", width=60, anchor="center")
+        self.history_tree.column("mac", width=125, anchor="center")
+        self.history_tree.column("chip", width=75, anchor="center")
+        self.history_tree.column("status", width=50, anchor="center")
         
-        def _update_tree():
-            try:
-                self.history_tree.insert("", 0, values=(time_short, port, mac_address, chip_type, status_text), tags=(tag,))
-            except Exception:
-                pass
-                
+        history_scroll = ttk.Scrollbar(self.history_frame, orient="vertical", command=self.history_tree.yview)
+        self.history_tree.configure(yscrollcommand=history_scroll.set)
+        
+        self.history_tree.pack(side="left", fill="both", expand=True)
+        history_scroll.pack(side="right", fill="y")
+        
+        self.history_tree.tag_configure('success', foreground=COLORS['success'], font=('Microsoft YaHei UI', 9))
+        self.history_tree.tag_configure('fail', foreground=COLORS['danger'], font=('Microsoft YaHei UI', 9))
+
+        # 启动期间已有的记录
+        for record in self.flash_records:
+            self._insert_history_row(record)
+
+    def _build_lot_panel(self):
+        """创建批次统计面板（启动就绪后由主循环空闲时调用）"""
+        if self.lot_frame is not None:
+            return
+        self.lot_frame = ttk.Frame(self.lot_container)
+        self.lot_frame.pack(fill="x", pady=(0, 12))
+
+        target_row = ttk.Frame(self.lot_frame)
+        target_row.pack(fill="x")
+        ttk.Label(target_row, text="批次目标:").pack(side="left")
+        self.lot_target_entry = ttk.Entry(target_row, width=8)
+        self.lot_target_entry.insert(0, str(self.lot.target or ''))
+        self.lot_target_entry.pack(side="left", padx=(4, 8))
+        ttk.Button(target_row, text="新批次", width=8, command=self.start_new_lot).pack(side="left")
+
+        self.lot_output_label = ttk.Label(self.lot_frame, font=('Microsoft YaHei UI', 10, 'bold'),
+                                          foreground=COLORS['text_primary'])
+        self.lot_output_label.pack(anchor="w", pady=(8, 2))
+        self.lot_rate_label = ttk.Label(self.lot_frame, foreground=COLORS['text_secondary'])
+        self.lot_rate_label.pack(anchor="w")
+
+        columns = ("group", "count", "mean", "p95")
+        self.lot_tree = ttk.Treeview(self.lot_frame, columns=columns, show="headings", height=5)
+        for column, text, width in (("group", "单台周期", 130), ("count", "台数", 50),
+                                    ("mean", "平均(秒)", 70), ("p95", "P95(秒)", 70)):
+            self.lot_tree.heading(column, text=text)
+            self.lot_tree.column(column, width=width, anchor="center")
+        self.lot_tree.pack(fill="x", pady=(6, 0))
+
+        self._lot_rows = {}
+        for port in self.lot.by_port:
+            self._update_lot_row('端口', port, self.lot.by_port[port])
+        for chip in self.lot.by_chip:
+            self._update_lot_row('芯片', chip, self.lot.by_chip[chip])
+        self._refresh_lot_summary()
+        self._tick_lot()
+
+    def start_new_lot(self):
+        """按输入的目标数量开始新批次（清零批次统计，首件重新全量回读）"""
+        text = self.lot_target_entry.get().strip()
+        try:
+            target = int(text) if text else 0
+            if target < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showwarning("警告", "批次目标应为非负整数（0 表示不设目标）")
+            return
+        self.lot.start(target)
+        self.engine.verify_policy.reset()
+        for item in self.lot_tree.get_children():
+            self.lot_tree.delete(item)
+        self._lot_rows = {}
+        self._refresh_lot_summary()
+        self.config['lot_target'] = target
+        self.save_config()
+        self.log(f"开始新批次，目标 {target} 台" if target else "开始新批次（不设目标）")
+
+    def _update_lot(self, changed):
+        """计入一条记录后刷新批次面板：只更新受影响的端口和芯片行"""
+        if self.lot_frame is None:
+            return
+        if changed:
+            port, chip = changed
+            self._update_lot_row('端口', port, self.lot.by_port[port])
+            self._update_lot_row('芯片', chip, self.lot.by_chip[chip])
+        self._refresh_lot_summary()
+        if self.lot.complete and self.lot.passed == self.lot.target:
+            self.log(f"批次已完成: {self.lot.passed}/{self.lot.target} 台")
+
+    def _update_lot_row(self, kind, name, stats):
+        values = (f"{kind} {name}", stats.count, f"{stats.mean:.1f}", f"{stats.percentile(95):.1f}")
+        item = self._lot_rows.get((kind, name))
+        if item is None:
+            self._lot_rows[(kind, name)] = self.lot_tree.insert("", "end", values=values)
+        else:
+            self.lot_tree.item(item, values=values)
+
+    def _refresh_lot_summary(self):
+        lot = self.lot
+        output = f"合格 {lot.passed}/{lot.target}" if lot.target else f"合格 {lot.passed}"
+        fpy = lot.first_pass_yield
+        output += f"    首次通过率 {fpy * 100:.1f}%" if fpy is not None else "    首次通过率 -"
+        if lot.target:
+            output += "    已完成" if lot.complete else f"    预计剩余 {format_duration(lot.eta())}"
+        rates = "  ".join(f"{window}分钟 {lot.units_per_hour(window):.0f}" for window in lot.windows)
+        self.lot_output_label.config(text=output)
+        self.lot_rate_label.config(text=f"台/小时  {rates}    失败任务 {lot.failed_jobs}")
+
+    def _tick_lot(self):
+        """定时刷新随时间变化的台/小时和ETA"""
+        try:
+            self._refresh_lot_summary()
+            self.root.after(5000, self._tick_lot)
+        except Exception:
+            pass
+
+    def _build_hub_panel(self):
+        """创建USB集线器面板：各集线器的任务数/并发上限、排队数和写入速率"""
+        if self.hub_frame is not None:
+            return
+        self.hub_frame = ttk.Frame(self.lot_container)
+        self.hub_frame.pack(fill="x", pady=(0, 12))
+        ttk.Label(self.hub_frame, text="USB集线器并发", foreground=COLORS['text_secondary']).pack(anchor="w")
+
+        columns = ("hub", "jobs", "waiting", "kbps", "levels")
+        self.hub_tree = ttk.Treeview(self.hub_frame, columns=columns, show="headings", height=3)
+        for column, text, width, anchor in (("hub", "集线器", 70, "center"), ("jobs", "任务/上限", 70, "center"),
+                                            ("waiting", "排队", 45, "center"), ("kbps", "kbit/s", 65, "center"),
+                                            ("levels", "并发:总吞吐", 180, "w")):
+            self.hub_tree.heading(column, text=text)
+            self.hub_tree.column(column, width=width, anchor=anchor)
+        self.hub_tree.pack(fill="x", pady=(4, 0))
+        self._hub_rows = {}
+        self._tick_hubs()
+
+    def _tick_hubs(self):
+        """定时刷新集线器面板（上限由调度器在写入完成时自动调整）"""
+        try:
+            for hub in self.engine.scheduler.snapshot():
+                if hub['limit'] is None:
+                    jobs = f"{hub['active']}/不限"
+                else:
+                    jobs = f"{hub['active']}/{hub['limit']}" + ("" if hub['auto'] else " 固定")
+                levels = "  ".join(f"{n}:{value:.0f}" for n, value in hub['levels'].items())
+                values = (hub['hub'], jobs, hub['waiting'], f"{hub['kbps']:.0f}", levels or "-")
+                item = self._hub_rows.get(hub['hub'])
+                if item is None:
+                    self._hub_rows[hub['hub']] = self.hub_tree.insert("", "end", values=values)
+                else:
+                    self.hub_tree.item(item, values=values)
+            self.root.after(2000, self._tick_hubs)
+        except Exception:
+            pass
+
+    def _build_link_panel(self):
+        """创建链路质量面板：各端口位置最近的写入速率、重试和同步次数，降速的位置标红"""
+        if self.link_frame is not None:
+            return
+        self.link_frame = ttk.Frame(self.lot_container)
+        self.link_frame.pack(fill="x", pady=(0, 12))
+        ttk.Label(self.link_frame, text="端口链路质量", foreground=COLORS['text_secondary']).pack(anchor="w")
+
+        columns = ("location", "port", "kbps", "reference", "retries", "sync", "trend", "status")
+        self.link_tree = ttk.Treeview(self.link_frame, columns=columns, show="headings", height=4)
+        for column, text, width, anchor in (("location", "位置", 70, "center"), ("port", "端口", 70, "center"),
+                                            ("kbps", "kbit/s", 55, "center"), ("reference", "参考", 55, "center"),
+                                            ("retries", "重试/台", 55, "center"), ("sync", "同步/台", 55, "center"),
+                                            ("trend", "近7天", 150, "w"), ("status", "状态", 200, "w")):
+            self.link_tree.heading(column, text=text)
+            self.link_tree.column(column, width=width, anchor=anchor)
+        self.link_tree.tag_configure('degraded', foreground=COLORS['danger'])
+        self.link_tree.pack(fill="x", pady=(4, 0))
+        self._link_rows = {}
+        self._tick_links()
+
+    def _tick_links(self):
+        """定时刷新链路质量面板"""
         try:
-            self.root.after(0, _update_tree)
+            for link in self.engine.link_quality.summary():
+                trend = " ".join(f"{rate:.0f}" if rate is not None else "-" for _, rate in link['trend'])
+                values = (link['location'], link['port'],
+                          f"{link['kbps']:.0f}" if link['kbps'] is not None else "-",
+                          f"{link['reference']:.0f}" if link['reference'] is not None else "-",
+                          f"{link['retries']:.1f}", f"{link['sync_attempts']:.1f}", trend or "-",
+                          "；".join(link['issues']) or "正常")
+                tags = ('degraded',) if link['issues'] else ()
+                item = self._link_rows.get(link['location'])
+                if item is None:
+                    self._link_rows[link['location']] = self.link_tree.insert("", "end", values=values, tags=tags)
+                else:
+                    self.link_tree.item(item, values=values, tags=tags)
+            self.root.after(5000, self._tick_links)
         except Exception:
-            _update_tree()
+            pass
+
+    def _insert_history_row(self, record):
+        status_text = "成功" if record['success'] else "失败"
+        tag = 'success' if record['success'] else 'fail'
+        self.history_tree.insert("", 0, values=(record['time'][-8:], record['port'], record['mac_address'],
+                                                record['chip_type'], status_text), tags=(tag,))
+
+    def _apply_flash_record(self, record):
+        """在主线程中保存记录并刷新历史列表和统计"""
+        self.flash_records.append(record)
+        self.events.publish('record', index=len(self.flash_records) - 1, record=record)
+        
+        # 更新右侧历史列表（列表尚未创建时，创建后会补上）
+        success = record['success']
+        try:
+            if self.history_tree is not None:
+                self._insert_history_row(record)
+        except Exception:
+            pass
             
         # 更新统计
         self.flash_total_count += 1
@@ -1273,25 +1640,16 @@ class ESP32Flasher:
         
         # 更新显示
         self.update_stats()
-        
-        # 记录到日志
-        status = "成功" if success else "失败"
-        self.log(f"记录: {port} {chip_type} {mac_address} - {status}")
+        self._update_lot(self.lot.add(record))
     
     def update_stats(self):
-        """更新统计显示"""
-        def _update():
-            try:
-                self.success_label.config(text=str(self.flash_success_count))
-                self.fail_label.config(text=str(self.flash_fail_count))
-                self.total_label.config(text=str(self.flash_total_count))
-            except:
-                pass
-        
+        """更新统计显示（主线程）"""
         try:
-            self.root.after(0, _update)
+            self.success_label.config(text=str(self.flash_success_count))
+            self.fail_label.config(text=str(self.flash_fail_count))
+            self.total_label.config(text=str(self.flash_total_count))
         except:
-            _update()
+            pass
     
     def export_records(self):
         """导出烧录记录到CSV文件"""
@@ -1321,7 +1679,8 @@ class ESP32Flasher:
             with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
                 writer = csv.writer(f)
                 # 写入表头
-                writer.writerow(['烧录时间', '端口', '芯片型号', 'MAC地址', '状态', '错误信息'])
+                writer.writerow(['烧录时间', '端口', '芯片型号', 'MAC地址', '状态', '错误信息', '校验方式', '校验耗时(秒)',
+                                 '周期(秒)'])
                 # 写入数据
                 for record in self.flash_records:
                     status = "成功" if record['success'] else "失败"
@@ -1331,7 +1690,10 @@ class ESP32Flasher:
                         record['chip_type'],
                         record['mac_address'],
                         status,
-                        record.get('error_msg', '')
+                        record.get('error_msg', ''),
+                        record.get('verify_mode', ''),
+                        record.get('verify_time', ''),
+                        record.get('cycle_time', '')
                     ])
             
             self.log(f"记录已导出到: {filename}")
@@ -1355,22 +1717,37 @@ class ESP32Flasher:
             self.update_stats()
             
             # 清空历史列表
-            for item in self.history_tree.get_children():
-                self.history_tree.delete(item)
+            if self.history_tree is not None:
+                for item in self.history_tree.get_children():
+                    self.history_tree.delete(item)
                 
             self.log("已清空所有烧录记录")
 
     def check_dependencies(self):
         """检查必要的依赖"""
+        # esptool 导入较慢且本工具只在子进程中运行它，这里只确认能找到，不导入
+        import importlib.util
         try:
             import serial
-            import esptool
+            if importlib.util.find_spec("esptool") is None:
+                raise ImportError("No module named 'esptool'")
             return True
         except ImportError as e:
             messagebox.showerror("依赖错误", f"缺少必要的依赖: {str(e)}\n请安装所需的依赖后重试。")
             return False
 
-if __name__ == "__main__":
+def main():
+    startup_timing.mark("导入模块")
+    args = parse_tool_args()
     root = tk.Tk()
+    startup_timing.mark("创建主窗口")
     app = ESP32Flasher(root)
-    root.mainloop()
\ No newline at end of file
+    if args.profile:
+        app.toggle_profile(args.profile)
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    # 打包后的程序以 --esptool / --flash-md5 参数启动自身运行烧录子进程
+    run_passthrough()
+    main()
\ No newline at end of file
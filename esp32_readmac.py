@@ -1,3 +1,5 @@
+# 最先导入，启动耗时从这里开始计算
+import startup_timing
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import serial.tools.list_ports
@@ -7,13 +9,15 @@ import json
 import os
 import subprocess
 import datetime
-import sys
-import io
 
-try:
-    import esptool
-except ImportError:
-    esptool = None
+from ui_dispatch import UIDispatcher, EVENT_LOG, EVENT_PORT_LOG
+from esptool_output import EsptoolOutputParser
+from esptool_launcher import esptool_command, run_passthrough
+from flash_retry import fatal_message
+from sampling_profiler import SamplingProfiler, parse_tool_args
+from station_metrics import StationMetrics, hub_of
+from port_filter import PortFilter
+from port_lease import PortLeases, describe_holder
 
 font_size = 12
 
@@ -143,18 +147,34 @@ class ESP32MACReader:
         # 应用现代风格
         set_modern_style(root)
         
+        # 工作线程通过事件队列与UI交互，由主循环定时批量处理
+        self.ui = UIDispatcher(self.root)
+        self.ui.register(EVENT_LOG, self._append_log_lines)
+        self.ui.register(EVENT_PORT_LOG, self._append_port_log_lines)
+        self.ui.start()
+        # 性能分析（采样所有线程的 CPU 与内存分配，按需开启）
+        self.profiler = SamplingProfiler('readmac')
+        
         # 初始化基本变量
         self.log_windows = {}
         self.config = {}
         self.port_enables = []
         self.mac_addresses = {}  # 存储读取到的MAC地址
+        self._mac_lock = threading.Lock()  # 工作线程查重时保护 mac_addresses
+        self.port_info = {}  # 端口名 -> list_ports 信息，由监控线程刷新
+        self.port_filter = PortFilter()  # 自动读取只处理符合条件的端口
+        self.leases = PortLeases('readmac')  # 跨进程端口租约，其他工具实例正在处理的端口不读取
+        self._active_ports = {}  # 正在读取的端口 -> 所在USB集线器
+        # 监控指标（配置中 metrics_port 不为 0 时提供 HTTP 抓取）
+        self._setup_metrics()
         self.current_log_file = self.generate_log_filename()  # 生成当前日志文件名
         
         # 创建UI
         self.create_ui()
+        startup_timing.mark("构建界面")
         
-        # 延迟加载配置和启动监控
-        self.root.after(100, self.delayed_init)
+        # 窗口绘制完成后（主循环空闲时）再加载配置和启动监控
+        self.root.after_idle(self.delayed_init)
     
     def generate_log_filename(self):
         """生成带时间戳的日志文件名"""
@@ -163,9 +183,12 @@ class ESP32MACReader:
     
     def check_dependencies(self):
         """检查必要的依赖"""
+        # esptool 导入较慢，启动时只确认能找到，首次读取时再导入
+        import importlib.util
         try:
             import serial
-            import esptool
+            if importlib.util.find_spec("esptool") is None:
+                raise ImportError("No module named 'esptool'")
             return True
         except ImportError as e:
             messagebox.showerror("依赖错误", f"缺少必要的依赖: {str(e)}\n请安装所需的依赖后重试。")
@@ -173,15 +196,20 @@ class ESP32MACReader:
 
     def delayed_init(self):
         """延迟初始化，提高启动速度"""
+        startup_timing.mark("首次绘制")
         # 加载配置
         self.load_config()
+        startup_timing.mark("加载配置")
         
         # 初始化串口列表
         self.refresh_ports()
+        startup_timing.mark("扫描串口")
+        self._start_metrics_server()
         
         # 启动串口监控
         self.port_monitor_thread = threading.Thread(target=self.monitor_ports, daemon=True)
         self.port_monitor_thread.start()
+        self.log(startup_timing.summary())
         
         # 重定向标准输出到日志框
         import sys
@@ -196,11 +224,12 @@ class ESP32MACReader:
         old_ports = set()
         while True:
             try:
-                current_ports = set(port.device for port in serial.tools.list_ports.comports())
+                self.port_info = {port.device: port for port in serial.tools.list_ports.comports()}
+                current_ports = set(self.port_info)
                 
                 if current_ports != old_ports:
                     # 使用一个函数处理所有端口变化
-                    self.root.after(0, lambda: self.handle_port_changes(old_ports, current_ports))
+                    self.ui.call(self.handle_port_changes, old_ports, current_ports)
                     old_ports = current_ports
                 
                 # 增加睡眠时间，减少CPU使用
@@ -210,6 +239,34 @@ class ESP32MACReader:
                 time.sleep(1.5)
                 continue
 
+    def _setup_metrics(self):
+        self.metrics = StationMetrics('readmac')
+        self.m_jobs = self.metrics.counter('esp32_jobs_total', 'MAC read jobs by result', ('result',))
+        self.m_job_seconds = self.metrics.histogram(
+            'esp32_job_duration_seconds', 'MAC read duration from start to finish', ('result',))
+        self.metrics.gauge('esp32_ui_queue_depth', 'Pending UI events', self.ui.depth)
+        self.metrics.gauge('esp32_ui_queue_max_latency_seconds', 'Worst UI event latency since start',
+                           lambda: round(self.ui.max_latency, 4))
+        self.metrics.gauge('esp32_active_sessions', 'MAC reads in progress per USB hub',
+                           self._sessions_per_hub, ('hub',))
+
+    def _sessions_per_hub(self):
+        hubs = {}
+        for hub in list(self._active_ports.values()):
+            hubs[(hub,)] = hubs.get((hub,), 0) + 1
+        return hubs
+
+    def _start_metrics_server(self):
+        port = int(self.config.get('metrics_port', 0) or 0)
+        if not port or self.metrics.serving:
+            return
+        host = self.config.get('metrics_host', '127.0.0.1')
+        try:
+            self.metrics.serve(host, port)
+            self.log(f"监控指标: http://{host}:{port}/metrics")
+        except OSError as e:
+            self.log(f"监控指标端口 {host}:{port} 启动失败: {str(e)}")
+
     def handle_port_changes(self, old_ports, current_ports):
         """统一处理端口变化"""
         # 处理移除的端口
@@ -217,8 +274,10 @@ class ESP32MACReader:
             if port in self.log_windows:
                 self.close_log_window(port)
         
-        # 处理新增的端口
-        new_ports = current_ports - old_ports
+        # 处理新增的端口；扫码枪、调试器等非目标设备不进入自动读取
+        new_ports, ignored = self.port_filter.split(sorted(current_ports - old_ports), self.port_info)
+        for port, reason in ignored.items():
+            self.log(f"端口 {port} 不是目标设备，自动模式忽略（{reason}）")
         if new_ports:
             self.log(f"检测到新端口: {new_ports}")
             if self.auto_read.get():
@@ -250,11 +309,13 @@ class ESP32MACReader:
         
         self.log(f"开始为 {len(enabled_ports)} 个启用的端口读取MAC地址")
         
+        # 界面设置在主线程读取后交给工作线程
+        baudrate = self.baud_combobox.get()
         # 为每个启用的端口创建读取线程
         for port in enabled_ports:
             thread = threading.Thread(
                 target=self.read_mac_process,
-                args=(port,),
+                args=(port, baudrate),
                 daemon=True
             )
             thread.start()
@@ -448,6 +509,13 @@ class ESP32MACReader:
             style='Accent.TButton'
         )
         clear_button.pack(side="right")
+        self.profile_button = ttk.Button(
+            log_toolbar,
+            text="性能分析",
+            command=self.toggle_profile,
+            style='Accent.TButton'
+        )
+        self.profile_button.pack(side="right", padx=(0, 5))
         
         # 创建滚动条
         scrollbar = ttk.Scrollbar(self.log_frame)
@@ -498,6 +566,10 @@ class ESP32MACReader:
                     # 加载波特率设置
                     if 'baudrate' in self.config:
                         self.baud_combobox.set(str(self.config['baudrate']))
+                    self.port_filter = PortFilter.from_config(self.config.get('port_filter'))
+                    self.leases.enabled = bool(self.config.get('port_lease', True))
+                    if self.config.get('port_lease_dir'):
+                        self.leases.directory = self.config['port_lease_dir']
             else:
                 self.config = {
                     'port_enables': [True] * 8,
@@ -533,73 +605,72 @@ class ESP32MACReader:
             self.log("错误: 请选择并启用至少一个串口")
             return
         
+        # 界面设置在主线程读取后交给工作线程
+        baudrate = self.baud_combobox.get()
         # 为每个选中的端口创建读取线程
         for port in selected_ports:
             thread = threading.Thread(
                 target=self.read_mac_process,
-                args=(port,),
+                args=(port, baudrate),
                 daemon=True
             )
             thread.start()
 
     def _run_esptool(self, args, log_window):
-        """直接调用 esptool 模块，捕获输出到日志窗口，返回捕获的输出文本"""
-        captured = io.StringIO()
-        old_stdout = sys.stdout
-        old_stderr = sys.stderr
-
-        class DualOutput:
-            def __init__(self, string_io, log_win):
-                self._sio = string_io
-                self._log_win = log_win
-            def write(self, text):
-                if text and text.strip():
-                    self._sio.write(text)
-                    try:
-                        self._log_win.window.after(0, lambda t=text.strip(): self._log_win.log(t))
-                    except Exception:
-                        pass
-            def flush(self):
-                self._sio.flush()
-
-        redirect = DualOutput(captured, log_window)
-        sys.stdout = redirect
-        sys.stderr = redirect
+        """在子进程中运行 esptool（每个端口独立，输出不会串到其他端口），
+        输出写入日志窗口并逐行解析，返回 EsptoolOutputParser"""
+        parser = EsptoolOutputParser()
+        creationflags = 0
+        if os.name == "nt":
+            try:
+                creationflags = subprocess.CREATE_NO_WINDOW
+            except Exception:
+                creationflags = 0
+        proc = subprocess.Popen(
+            esptool_command() + list(args),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            creationflags=creationflags
+        )
         try:
-            esptool.main(args)
+            for line in proc.stdout:
+                text_line = line.rstrip("\r\n")
+                parser.feed(text_line)
+                if text_line.strip():
+                    log_window.log(text_line.strip())
+            rc = proc.wait()
         finally:
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
-        return captured.getvalue()
-
-    def read_mac_process(self, port):
-        log_window = LogWindow(port)
-        self.log_windows[port] = log_window
-        log_window.window.lift()
-        log_window.window.focus_force()
+            proc.stdout.close()
+            parser.close()
+        if rc != 0:
+            raise RuntimeError(fatal_message(parser.text()) or f"esptool 退出码 {rc}")
+        return parser
+
+    def read_mac_process(self, port, baudrate):
+        """工作线程：读取 port 上设备的MAC地址（baudrate 由主线程从界面读取）"""
+        # 线程以端口命名，性能分析报告按端口区分
+        threading.current_thread().name = f"读MAC {port}"
+        # 烧录工具等其他实例正在处理这个端口时跳过
+        if not self.leases.acquire(port):
+            self.log(f"端口 {port} 正被 {describe_holder(self.leases.holder(port))} 使用，跳过")
+            return
+        # 日志窗口由主线程创建，本线程只通过事件队列写日志
+        self.ui.call(self._open_log_window, port)
+        log_window = self.ui.port_logger(port)
 
         log_window.log(f"开始从端口 {port} 读取MAC地址...")
         self.log(f"开始从端口 {port} 读取MAC地址...")
+        started = time.monotonic()
+        outcome = 'fail'  # 任务结果（监控指标）
+        self._active_ports[port] = hub_of(getattr(self.port_info.get(port), 'location', None))
 
         try:
-            baudrate = self.baud_combobox.get()
-
             log_window.log(f"检测芯片类型 (波特率: {baudrate})...")
-            output = self._run_esptool(["--port", port, "--baud", baudrate, "chip_id"], log_window)
-
-            chip_type = None
-            if "Chip is ESP32-S3" in output:
-                chip_type = "ESP32-S3"
-            elif "Chip is ESP32-S2" in output:
-                chip_type = "ESP32-S2"
-            elif "Chip is ESP32-C3" in output:
-                chip_type = "ESP32-C3"
-            elif "Chip is ESP32-C6" in output:
-                chip_type = "ESP32-C6"
-            elif "Chip is ESP32-P4" in output:
-                chip_type = "ESP32-P4"
-            elif "Chip is ESP32" in output:
-                chip_type = "ESP32"
+            result = self._run_esptool(["--port", port, "--baud", baudrate, "chip_id"], log_window)
+
+            chip_type = result.chip
 
             if not chip_type:
                 log_window.log("未能识别芯片类型")
@@ -608,13 +679,7 @@ class ESP32MACReader:
             log_window.log(f"检测到芯片类型: {chip_type}")
 
             log_window.log("读取MAC地址...")
-            mac_output = self._run_esptool(["--port", port, "--baud", baudrate, "read_mac"], log_window)
-
-            mac_address = None
-            for line in mac_output.split('\n'):
-                if "MAC:" in line:
-                    mac_address = line.split("MAC:")[1].strip()
-                    break
+            mac_address = self._run_esptool(["--port", port, "--baud", baudrate, "read_mac"], log_window).mac
 
             if not mac_address:
                 log_window.log("未能读取MAC地址")
@@ -622,42 +687,47 @@ class ESP32MACReader:
 
             timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-            is_duplicate = False
-            for item_id in self.mac_list.get_children():
-                item_values = self.mac_list.item(item_id)['values']
-                if len(item_values) > 1 and item_values[1] == mac_address:
-                    is_duplicate = True
-                    break
+            # 查重并登记在同一把锁内完成，避免多个端口同时读到同一地址时重复记录
+            with self._mac_lock:
+                is_duplicate = mac_address in self.mac_addresses
+                if not is_duplicate:
+                    self.mac_addresses[mac_address] = {
+                        "port": port,
+                        "chip_type": chip_type,
+                        "timestamp": timestamp
+                    }
 
             if is_duplicate:
                 log_window.log(f"MAC地址 {mac_address} 已存在，跳过记录")
                 self.log(f"MAC地址 {mac_address} 已存在，跳过记录")
-                self.root.after(2000, lambda: self.close_log_window(port))
+                self.ui.call_later(2000, self.close_log_window, port)
+                outcome = 'duplicate'
                 return
 
-            self.root.after(0, lambda: self.update_mac_list(port, mac_address, chip_type, timestamp))
+            self.ui.call(self.update_mac_list, port, mac_address, chip_type, timestamp)
             self.save_mac_to_file(mac_address, chip_type, timestamp)
 
             log_window.log(f"成功读取MAC地址: {mac_address}")
             self.log(f"端口 {port} 成功读取MAC地址: {mac_address}")
-            self.root.after(2000, lambda: self.close_log_window(port))
+            self.ui.call_later(2000, self.close_log_window, port)
+            outcome = 'success'
 
         except Exception as e:
             error_msg = f"读取MAC地址失败: {str(e)}"
             log_window.log(error_msg)
             self.log(error_msg)
 
+        finally:
+            self.leases.release(port)
+            self._active_ports.pop(port, None)
+            self.m_jobs.inc(result=outcome)
+            self.m_job_seconds.observe(time.monotonic() - started, result=outcome)
+
     def update_mac_list(self, port, mac_address, chip_type, timestamp):
         """在主线程中更新MAC地址列表"""
         try:
-            # 将MAC地址添加到列表中
+            # 将MAC地址添加到列表中（内存记录已在工作线程中登记）
             self.mac_list.insert("", "end", values=(port, mac_address, chip_type, timestamp))
-            # 保存到内存中
-            self.mac_addresses[mac_address] = {
-                "port": port,
-                "chip_type": chip_type,
-                "timestamp": timestamp
-            }
             # 滚动到最后一行
             children = self.mac_list.get_children()
             if children:
@@ -746,7 +816,8 @@ class ESP32MACReader:
                     self.mac_list.delete(item)
                 
                 # 清空内存数据
-                self.mac_addresses.clear()
+                with self._mac_lock:
+                    self.mac_addresses.clear()
                 
                 self.log("MAC地址列表已清空")
                 messagebox.showinfo("完成", "MAC地址列表已清空！")
@@ -755,11 +826,58 @@ class ESP32MACReader:
             self.log(f"清空列表失败: {str(e)}")
 
     def log(self, message):
-        self.log_text.insert("end", message + "\n")
+        """线程安全的日志记录，实际写入由主线程批量完成"""
+        self.ui.log(message)
+
+    def _append_log_lines(self, port, lines):
+        """事件队列回调：批量写入主日志"""
+        self.log_text.insert("end", "\n".join(lines) + "\n")
         self.log_text.see("end")
+
+    def _append_port_log_lines(self, port, lines):
+        """事件队列回调：批量写入端口日志窗口"""
+        log_window = self.log_windows.get(port)
+        if log_window:
+            log_window.log("\n".join(lines))
         
     def clear_log(self):
         self.log_text.delete(1.0, tk.END)
+
+    def toggle_profile(self, duration=None):
+        """开始性能分析；再次点击或到达 duration 秒后停止并保存报告"""
+        if not self.profiler.running:
+            try:
+                self.profiler.start(duration, on_finish=lambda path: self.ui.call(self._profile_finished, path))
+            except Exception as e:
+                self.log(f"启动性能分析失败: {str(e)}")
+                return
+            self.profile_button.config(text="停止分析")
+            if duration:
+                self.log(f"开始性能分析，{duration:g} 秒后自动保存报告（分析期间程序会变慢）")
+            else:
+                self.log("开始性能分析，再次点击按钮停止并保存报告（分析期间程序会变慢）")
+            return
+
+        try:
+            path = self.profiler.stop()
+        except Exception as e:
+            self.profile_button.config(text="性能分析")
+            self.log(f"保存性能分析报告失败: {str(e)}")
+            return
+        self._profile_finished(path)
+
+    def _profile_finished(self, path):
+        self.profile_button.config(text="性能分析")
+        if path:
+            self.log(f"性能分析报告已保存: {os.path.abspath(path)}")
+
+    def _open_log_window(self, port):
+        """在主线程中创建端口日志窗口"""
+        self.close_log_window(port)
+        log_window = LogWindow(port)
+        self.log_windows[port] = log_window
+        log_window.window.lift()
+        log_window.window.focus_force()
         
     def close_log_window(self, port):
         if port in self.log_windows:
@@ -767,9 +885,16 @@ class ESP32MACReader:
             del self.log_windows[port]
 
 def main():
+    startup_timing.mark("导入模块")
+    args = parse_tool_args()
     root = tk.Tk()
+    startup_timing.mark("创建主窗口")
     app = ESP32MACReader(root)
+    if args.profile:
+        app.toggle_profile(args.profile)
     root.mainloop()
 
 if __name__ == "__main__":
+    # 打包后的程序以 --esptool 参数启动自身运行 esptool
+    run_passthrough()
     main()
\ No newline at end of file
@@ -1,3 +1,5 @@
+# 最先导入，启动耗时从这里开始计算
+import startup_timing
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
 import serial.tools.list_ports
@@ -9,6 +11,13 @@ import subprocess
 import datetime
 import sys
 
+from ui_dispatch import UIDispatcher, EVENT_LOG
+from flash_engine import FlashEngine, FlashOptions, SUCCESS
+from esptool_launcher import esptool_command, run_passthrough
+from port_lease import describe_holder
+from esptool_output import EsptoolOutputParser
+from sampling_profiler import SamplingProfiler, parse_tool_args
+
 font_size = 12
 
 # 添加自定义样式和主题
@@ -90,6 +99,13 @@ class ESP32UnifiedTool:
         # 应用现代风格
         set_modern_style(root)
         
+        # 工作线程通过事件队列与UI交互，由主循环定时批量处理
+        self.ui = UIDispatcher(self.root)
+        self.ui.register(EVENT_LOG, self._append_log_lines)
+        self.ui.start()
+        # 性能分析（采样所有线程的 CPU 与内存分配，按需开启）
+        self.profiler = SamplingProfiler('unified')
+        
         # 初始化基本变量
         self.config = {
             'firmware_paths': [''] * 8, 
@@ -98,28 +114,43 @@ class ESP32UnifiedTool:
             'port_enables': [True] * 8,
             'auto_mode': True,
             'auto_flash': True,
-            'auto_read_mac': True
+            'auto_read_mac': True,
+            'recent_cooldown': 60
         }
         self.mac_addresses = {}
+        self.port_processes = {}  # 端口上正在运行的 esptool 进程（检测芯片、读MAC）
+        # 刷固件由烧录引擎完成（重试、看门狗、重新枚举处理与烧录工具相同）
+        self.engine = FlashEngine(
+            on_log=self._on_job_log,
+            on_message=self.log
+        )
+        self.engine.leases.tool = 'unified'  # 其他实例显示端口被谁占用
+        # 刚刷完固件的设备复位后会重新枚举，冷却期内不再重复处理
+        self.recent_devices = self.engine.recent_devices
         self.current_log_file = self.generate_log_filename()
         
         # 创建UI
         self.create_ui()
+        startup_timing.mark("构建界面")
         
-        # 延迟加载配置和启动监控
-        self.root.after(100, self.delayed_init)
+        # 窗口绘制完成后（主循环空闲时）再加载配置和启动监控
+        self.root.after_idle(self.delayed_init)
 
     def delayed_init(self):
         """延迟初始化，提高启动速度"""
+        startup_timing.mark("首次绘制")
         # 加载配置
         self.load_config()
+        startup_timing.mark("加载配置")
         
         # 初始化串口列表
         self.refresh_ports()
+        startup_timing.mark("扫描串口")
         
         # 启动串口监控
         self.port_monitor_thread = threading.Thread(target=self.monitor_ports, daemon=True)
         self.port_monitor_thread.start()
+        self.log(startup_timing.summary())
         
         # 重定向标准输出到日志框
         sys.stdout = LogRedirector(self.log)
@@ -312,6 +343,8 @@ class ESP32UnifiedTool:
         log_toolbar.pack(fill="x", pady=5)
         
         ttk.Button(log_toolbar, text="清除日志", command=self.clear_log).pack(side="right", padx=5)
+        self.profile_button = ttk.Button(log_toolbar, text="性能分析", command=self.toggle_profile)
+        self.profile_button.pack(side="right")
         
         # 日志文本框
         log_text_frame = ttk.Frame(log_frame)
@@ -346,10 +379,10 @@ class ESP32UnifiedTool:
         old_ports = set()
         while True:
             try:
-                current_ports = set(port.device for port in serial.tools.list_ports.comports())
+                current_ports = self.engine.refresh_ports()
                 
                 if current_ports != old_ports:
-                    self.root.after(0, lambda: self.handle_port_changes(old_ports, current_ports))
+                    self.ui.call(self.handle_port_changes, old_ports, current_ports)
                     old_ports = current_ports
                 
                 time.sleep(1.5)
@@ -359,8 +392,24 @@ class ESP32UnifiedTool:
 
     def handle_port_changes(self, old_ports, current_ports):
         """处理串口变化"""
-        # 处理新增的端口
+        # 处理移除的端口：立即结束该端口上的 esptool，不等待超时
+        for port in (old_ports - current_ports):
+            self.engine.port_lost(port)
+            process = self.port_processes.get(port)
+            if process and process.poll() is None:
+                self.log(f"端口 {port} 已拔出，终止当前操作")
+                try:
+                    process.terminate()
+                except Exception:
+                    pass
+        
+        # 处理新增的端口；属于进行中任务的设备（重新枚举）直接交还给原任务
         new_ports = current_ports - old_ports
+        for port in list(new_ports):
+            if self.engine.port_appeared(port):
+                new_ports.discard(port)
+        # 扫码枪、调试器等非目标设备不进入自动处理
+        new_ports = self.engine.filter_new_ports(sorted(new_ports))
         if new_ports:
             self.log(f"检测到新端口: {', '.join(new_ports)}")
             if self.auto_mode.get():
@@ -374,167 +423,150 @@ class ESP32UnifiedTool:
         self.refresh_ports()
 
     def handle_new_ports(self, new_ports):
-        """处理新连接的端口"""
+        """处理新连接的端口（主线程，界面设置在这里读取后交给工作线程）"""
         enabled_ports = self.get_enabled_ports()
+        firmwares = self._selected_firmwares() if self.auto_flash.get() else None
+        read_mac = self.auto_read_mac.get()
         
         for port in new_ports:
             if port in enabled_ports:
+                # 延迟期间端口可能已被进行中的任务接管（设备重新枚举）
+                if self.engine.session_on_port(port) is not None:
+                    continue
+                if self.recent_devices.is_recent(usb_serial=self._usb_serial(port)):
+                    self.log(f"端口 {port} 是刚处理完成的设备（复位后重新枚举），跳过")
+                    continue
                 # 在新线程中处理设备
                 threading.Thread(
                     target=self.process_device_auto,
-                    args=(port,),
+                    args=(port, firmwares, read_mac),
+                    name=f"自动处理 {port}",
                     daemon=True
                 ).start()
 
-    def process_device_auto(self, port):
-        """自动处理设备"""
+    def process_device_auto(self, port, firmwares, read_mac):
+        """自动处理设备（firmwares 为 None 时不刷固件）"""
+        # 整个处理过程占用端口，其他工具实例不会同时操作
+        if not self._claim_port(port):
+            return
         try:
             self.log(f"正在处理端口 {port}...")
             
-            # 检测芯片类型
-            chip_type = self.detect_chip(port)
-            if not chip_type:
-                self.log(f"端口 {port}: 无法检测芯片类型")
-                return
-            
-            self.log(f"端口 {port}: 检测到芯片类型 {chip_type}")
-            
-            # 根据设置执行操作
-            if self.auto_flash.get():
-                self.flash_single_port(port, chip_type)
-            
-            if self.auto_read_mac.get():
-                self.read_mac_single_port(port, chip_type)
+            # 芯片型号、Flash 容量和USB描述符取自烧录引擎检测芯片的结果，不再单独连接检测
+            chip_type = None
+            mac_port = port
+            if firmwares is not None:
+                job = self.flash_single_port(port, firmwares)
+                if job is not None:
+                    mac_port = job.current_port  # 烧录中设备可能已重新枚举为其他端口
+                if job is not None and job.chip:
+                    chip_type = job.chip
+                    details = [f"Flash {job.flash_size}" if job.flash_size else None,
+                               f"USB {job.descriptor}" if job.descriptor else None]
+                    details = ", ".join(d for d in details if d)
+                    self.log(f"端口 {port}: 检测到芯片类型 {chip_type}" + (f" ({details})" if details else ""))
+                    # 烧录时已读取到 MAC，不再为读取 MAC 重新连接
+                    if read_mac and job.mac != "Unknown":
+                        self.record_mac(mac_port, chip_type, job.mac)
+                        return
+            
+            if read_mac:
+                self.read_mac_single_port(mac_port, chip_type)
                 
         except Exception as e:
             self.log(f"端口 {port} 处理失败: {str(e)}")
+        finally:
+            self.engine.leases.release(port)
 
-    def flash_single_port(self, port, chip_type=None):
-        """对单个端口刷固件"""
-        try:
-            if not chip_type:
-                chip_type = self.detect_chip(port)
-                
-            self.log(f"开始刷固件到端口 {port} (芯片: {chip_type})")
-            
-            # 获取启用的固件
-            firmwares = []
-            for i, enable_var in enumerate(self.firmware_vars):
-                if enable_var.get() and self.firmware_entries[i].get().strip():
-                    firmware_path = self.firmware_entries[i].get().strip()
-                    address = self.address_entries[i].get().strip()
-                    if os.path.exists(firmware_path):
-                        firmwares.append((address, firmware_path))
-            
-            if not firmwares:
-                self.log(f"端口 {port}: 没有可用的固件文件")
-                return
-            
-            # 构建esptool命令
-            cmd = ["python", "-m", "esptool", "--port", port]
-            
-            # 添加芯片参数
-            chip_params = self.get_chip_param(chip_type)
-            if chip_params:
-                cmd.extend(chip_params)
-            
-            cmd.extend(["--baud", "921600", "--before", "default_reset", "--after", "hard_reset", "write_flash"])
-            
-            for address, firmware_path in firmwares:
-                cmd.extend([address, firmware_path])
-            
-            # 执行命令
-            self.log(f"端口 {port}: 执行命令: {' '.join(cmd)}")
-            
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding='utf-8',
-                errors='ignore'
-            )
-            
-            for line in process.stdout:
-                if line.strip():
-                    self.log(f"[{port}] {line.strip()}")
-            
-            process.wait()
-            
-            if process.returncode == 0:
-                self.log(f"端口 {port}: 固件刷写成功!")
-            else:
-                self.log(f"端口 {port}: 固件刷写失败!")
-                
-        except Exception as e:
-            self.log(f"端口 {port} 刷固件时发生错误: {str(e)}")
+    def _claim_port(self, port):
+        """占用端口的跨进程租约（可重入），被其他工具实例占用时写日志并返回 False"""
+        if self.engine.leases.acquire(port):
+            return True
+        self.log(f"端口 {port} 正被 {describe_holder(self.engine.leases.holder(port))} 使用，跳过")
+        return False
+
+    def flash_single_port(self, port, firmwares, chip_type=None):
+        """对单个端口刷固件（在工作线程中运行），返回 FlashJob"""
+        self.log(f"开始刷固件到端口 {port}" + (f" (芯片: {chip_type})" if chip_type else ""))
+        if not firmwares and not self.engine.profiles.profiles:
+            self.log(f"端口 {port}: 没有可用的固件文件")
+            return None
+
+        job = self.engine.flash(port, firmwares, FlashOptions(baud=921600))
+        if job.result == SUCCESS:
+            self.log(f"端口 {job.current_port}: 固件刷写成功!")
+        else:
+            self.log(f"端口 {job.current_port}: 固件刷写失败! {job.note}".rstrip())
+        return job
+
+    def _on_job_log(self, job, line):
+        """烧录引擎回调：esptool 输出写入主日志"""
+        if line.strip():
+            self.log(f"[{job.current_port}] {line.strip()}")
+
+    def _selected_firmwares(self):
+        """已启用且文件存在的固件 [(路径, 地址)]（主线程中读取）"""
+        firmwares = []
+        for i, enable_var in enumerate(self.firmware_vars):
+            if enable_var.get() and self.firmware_entries[i].get().strip():
+                firmware_path = self.firmware_entries[i].get().strip()
+                address = self.address_entries[i].get().strip()
+                if os.path.exists(firmware_path):
+                    firmwares.append((firmware_path, address))
+        return firmwares
 
     def read_mac_single_port(self, port, chip_type=None):
         """读取单个端口的MAC地址"""
+        if not self._claim_port(port):
+            return
         try:
-            if not chip_type:
-                chip_type = self.detect_chip(port)
-                
-            self.log(f"开始读取端口 {port} 的MAC地址 (芯片: {chip_type})")
+            self.log(f"开始读取端口 {port} 的MAC地址" + (f" (芯片: {chip_type})" if chip_type else ""))
             
             # 构建命令
-            cmd = ["python", "-m", "esptool", "--port", port]
+            cmd = esptool_command() + ["--port", port]
             
-            # 添加芯片参数
-            chip_params = self.get_chip_param(chip_type)
-            if chip_params:
-                cmd.extend(chip_params)
+            # 添加芯片参数；芯片未知时由 esptool 在同一次连接中自动识别
+            if chip_type:
+                cmd.extend(self.get_chip_param(chip_type))
             
             cmd.extend(["read_mac"])
             
             # 执行命令
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding='utf-8',
-                errors='ignore'
-            )
+            process = self._start_esptool(port, cmd)
             
-            output = ""
+            parser = EsptoolOutputParser()
             for line in process.stdout:
-                output += line
+                parser.feed(line)
                 if line.strip():
                     self.log(f"[{port}] {line.strip()}")
             
-            process.wait()
+            self._wait_esptool(port, process)
             
-            # 解析MAC地址
-            mac_address = self.parse_mac_from_output(output)
+            mac_address = parser.mac
             
             if mac_address:
-                timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.log(f"端口 {port}: MAC地址读取成功: {mac_address}")
-                
-                # 更新MAC地址记录
-                self.update_mac_record(port, chip_type, mac_address, timestamp)
-                
-                # 保存到文件
-                self.save_mac_to_file(port, mac_address, chip_type, timestamp)
+                self.record_mac(port, chip_type or parser.chip or "ESP32", mac_address)
             else:
                 self.log(f"端口 {port}: 无法解析MAC地址")
                 
         except Exception as e:
             self.log(f"端口 {port} 读取MAC地址时发生错误: {str(e)}")
+        finally:
+            self.engine.leases.release(port)
 
-    def parse_mac_from_output(self, output):
-        """从esptool输出中解析MAC地址"""
-        import re
-        # 查找MAC地址模式
-        mac_pattern = r'MAC:\s*([0-9a-fA-F]{2}:[0-9a-fA-F]{2}:[0-9a-fA-F]{2}:[0-9a-fA-F]{2}:[0-9a-fA-F]{2}:[0-9a-fA-F]{2})'
-        match = re.search(mac_pattern, output)
-        if match:
-            return match.group(1)
-        return None
+    def record_mac(self, port, chip_type, mac_address):
+        """记录读取到的MAC地址：写日志、更新界面并保存到文件（工作线程）"""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.log(f"端口 {port}: MAC地址读取成功: {mac_address}")
+        
+        # 更新MAC地址记录
+        self.ui.call(self.update_mac_record, port, chip_type, mac_address, timestamp)
+        
+        # 保存到文件
+        self.save_mac_to_file(port, mac_address, chip_type, timestamp)
 
     def update_mac_record(self, port, chip_type, mac_address, timestamp):
-        """更新MAC地址记录到界面"""
+        """更新MAC地址记录到界面（主线程）"""
         # 在Treeview中添加记录
         self.mac_tree.insert('', 0, values=(timestamp, port, chip_type, mac_address))
 
@@ -546,40 +578,28 @@ class ESP32UnifiedTool:
         except Exception as e:
             self.log(f"保存MAC地址到文件失败: {str(e)}")
 
-    def detect_chip(self, port):
-        """检测芯片类型"""
-        try:
-            cmd = ["python", "-m", "esptool", "--port", port, "chip_id"]
-            
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding='utf-8',
-                errors='ignore'
-            )
-            
-            output = ""
-            for line in process.stdout:
-                output += line
-            
-            process.wait()
-            
-            # 解析芯片类型
-            if "ESP32-S3" in output:
-                return "ESP32-S3"
-            elif "ESP32-S2" in output:
-                return "ESP32-S2"
-            elif "ESP32-C3" in output:
-                return "ESP32-C3"
-            elif "ESP32" in output:
-                return "ESP32"
-            
-            return "ESP32"  # 默认
-            
-        except Exception:
-            return "ESP32"  # 默认
+    def _usb_serial(self, port):
+        """端口上乐鑫原生USB设备的序列号（USB转串口芯片返回None）"""
+        return self.engine.usb_serial(port)
+
+    def _start_esptool(self, port, cmd):
+        """启动 esptool 子进程并按端口登记，便于拔出设备时终止"""
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding='utf-8',
+            errors='ignore'
+        )
+        self.port_processes[port] = process
+        return process
+
+    def _wait_esptool(self, port, process):
+        """等待 esptool 结束并注销端口登记"""
+        process.wait()
+        if self.port_processes.get(port) is process:
+            del self.port_processes[port]
 
     def get_chip_param(self, chip_type):
         """获取芯片参数"""
@@ -599,10 +619,9 @@ class ESP32UnifiedTool:
             return
         
         # 检查是否有启用的固件
-        has_firmware = any(var.get() and entry.get().strip() 
-                          for var, entry in zip(self.firmware_vars, self.firmware_entries))
+        firmwares = self._selected_firmwares()
         
-        if not has_firmware:
+        if not firmwares and not self.engine.profiles.profiles:
             messagebox.showwarning("警告", "请先配置并启用至少一个固件")
             return
         
@@ -611,7 +630,8 @@ class ESP32UnifiedTool:
         for port in enabled_ports:
             threading.Thread(
                 target=self.flash_single_port,
-                args=(port,),
+                args=(port, firmwares),
+                name=f"烧录 {port}",
                 daemon=True
             ).start()
 
@@ -628,6 +648,7 @@ class ESP32UnifiedTool:
             threading.Thread(
                 target=self.read_mac_single_port,
                 args=(port,),
+                name=f"读MAC {port}",
                 daemon=True
             ).start()
 
@@ -690,6 +711,10 @@ class ESP32UnifiedTool:
         if filename:
             self.firmware_entries[index].delete(0, tk.END)
             self.firmware_entries[index].insert(0, filename)
+            # 选择后即解析镜像头，结构错误立即提示（任务开始时还会对照芯片再检查）
+            address = self.address_entries[index].get() or '0x0'
+            for problem in self.engine.inspect_firmwares([(filename, address)]):
+                self.log(f"固件 {index + 1}: 镜像检查未通过 - {problem}")
 
     def clear_mac_records(self):
         """清除MAC地址记录"""
@@ -729,6 +754,7 @@ class ESP32UnifiedTool:
                 self.auto_mode.set(self.config.get('auto_mode', True))
                 self.auto_flash.set(self.config.get('auto_flash', True))
                 self.auto_read_mac.set(self.config.get('auto_read_mac', True))
+                self.engine.configure(self.config)
                 
                 # 恢复固件配置
                 for i, (enable_var, path_entry, addr_entry) in enumerate(
@@ -771,29 +797,73 @@ class ESP32UnifiedTool:
             self.log(f"保存配置失败: {str(e)}")
 
     def log(self, message):
-        """添加日志消息"""
-        def _log():
-            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-            self.log_text.insert("end", f"[{timestamp}] {message}\n")
-            self.log_text.see("end")
-        
-        if threading.current_thread() is threading.main_thread():
-            _log()
-        else:
-            self.root.after(0, _log)
+        """添加日志消息（任意线程），实际写入由主线程批量完成"""
+        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+        self.ui.log(f"[{timestamp}] {message}")
+
+    def _append_log_lines(self, port, lines):
+        """事件队列回调：批量写入日志"""
+        self.log_text.insert("end", "\n".join(lines) + "\n")
+        self.log_text.see("end")
 
     def clear_log(self):
         """清除日志"""
         self.log_text.delete(1.0, tk.END)
 
+    def toggle_profile(self, duration=None):
+        """开始性能分析；再次点击或到达 duration 秒后停止并保存报告"""
+        if not self.profiler.running:
+            try:
+                self.profiler.start(duration, on_finish=lambda path: self.ui.call(self._profile_finished, path))
+            except Exception as e:
+                self.log(f"启动性能分析失败: {str(e)}")
+                return
+            self.profile_button.config(text="停止分析")
+            if duration:
+                self.log(f"开始性能分析，{duration:g} 秒后自动保存报告（分析期间程序会变慢）")
+            else:
+                self.log("开始性能分析，再次点击按钮停止并保存报告（分析期间程序会变慢）")
+            return
+
+        try:
+            path = self.profiler.stop()
+        except Exception as e:
+            self.profile_button.config(text="性能分析")
+            self.log(f"保存性能分析报告失败: {str(e)}")
+            return
+        self._profile_finished(path)
+
+    def _profile_finished(self, path):
+        self.profile_button.config(text="性能分析")
+        if path:
+            self.log(f"性能分析报告已保存: {os.path.abspath(path)}")
+
     def on_closing(self):
         """关闭时保存配置"""
         self.save_config()
+        # 关闭时仍在分析则保存已采集的部分
+        try:
+            if self.profiler.running:
+                self.profiler.stop()
+        except Exception:
+            pass
+        self.engine.stop()
+        try:
+            self.engine.link_quality.save()
+            self.engine.reset_strategies.save()
+        except Exception:
+            pass
+        self.ui.stop()
         self.root.destroy()
 
 def main():
+    startup_timing.mark("导入模块")
+    args = parse_tool_args()
     root = tk.Tk()
+    startup_timing.mark("创建主窗口")
     app = ESP32UnifiedTool(root)
+    if args.profile:
+        app.toggle_profile(args.profile)
     
     # 绑定关闭事件
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
@@ -801,4 +871,6 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    # 打包后的程序以 --esptool / --flash-md5 参数启动自身运行烧录子进程
+    run_passthrough()
+    main()
\ No newline at end of file
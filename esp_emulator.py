@@ -0,0 +1,429 @@
+"""ESP 下载模式模拟器（伪终端）
+
+在 Linux 上创建若干 pty 设备，每个设备模拟一块处于下载模式的 ESP 芯片，
+实现 esptool 使用的 SLIP 串口协议（ROM 与 stub 两种状态）：
+同步、读写寄存器（含 eFuse MAC 和 SPI Flash ID）、安全信息、内存下载与运行 stub、
+改波特率、Flash 写入（普通/压缩）、MD5、擦除、回读。
+
+芯片相关的寄存器地址取自 esptool 自带的芯片定义，可以模拟 esptool 支持的大多数芯片。
+链路速率和 Flash 写入/擦除速度可配置，用于在没有硬件的机器上测试烧录吞吐量和调度行为。
+
+用法:
+    python esp_emulator.py --count 4 --chip ESP32-S3 --flash-size 4MB --baud 921600
+    esptool --port /tmp/ttyESP0 --before no_reset write_flash 0x0 firmware.bin
+
+pty 无法传递 DTR/RTS，esptool 会提示 "Chip was NOT reset"，可以忽略；
+模拟设备在每次收到新的同步命令时视为一次复位，回到 ROM 下载模式。
+"""
+import argparse
+import hashlib
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import tty
+import zlib
+
+# 命令码
+SYNC = 0x08
+WRITE_REG = 0x09
+READ_REG = 0x0A
+FLASH_BEGIN = 0x02
+FLASH_DATA = 0x03
+FLASH_END = 0x04
+MEM_BEGIN = 0x05
+MEM_END = 0x06
+MEM_DATA = 0x07
+SPI_SET_PARAMS = 0x0B
+SPI_ATTACH = 0x0D
+CHANGE_BAUDRATE = 0x0F
+FLASH_DEFL_BEGIN = 0x10
+FLASH_DEFL_DATA = 0x11
+FLASH_DEFL_END = 0x12
+SPI_FLASH_MD5 = 0x13
+GET_SECURITY_INFO = 0x14
+ERASE_FLASH = 0xD0
+ERASE_REGION = 0xD1
+READ_FLASH = 0xD2
+RUN_USER_CODE = 0xD3
+
+CHIP_DETECT_MAGIC_REG_ADDR = 0x40001000
+ROM_INVALID_RECV_MSG = 0x05
+SECTOR_SIZE = 0x1000
+
+# SPI Flash ID 中的容量编码（GigaDevice 兼容）
+_FLASH_SIZE_CODES = {
+    '1MB': 0x14, '2MB': 0x15, '4MB': 0x16, '8MB': 0x17, '16MB': 0x18, '32MB': 0x19,
+}
+_FLASH_MANUFACTURER = 0xC8
+_FLASH_DEVICE = 0x40
+
+_SPI_CMD_USR = 1 << 18
+_SPI_FLASH_RDID = 0x9F
+
+
+def flash_size_bytes(flash_size):
+    """'4MB' -> 字节数"""
+    return int(flash_size.upper().rstrip('MB')) * 1024 * 1024
+
+
+def chip_class(chip):
+    """按芯片名（如 ESP32-S3）查找 esptool 的芯片定义"""
+    from esptool.targets import CHIP_DEFS
+    key = chip.lower().replace('-', '')
+    if key not in CHIP_DEFS:
+        raise ValueError(f"不支持的芯片类型: {chip}")
+    return CHIP_DEFS[key]
+
+
+def slip_encode(packet):
+    return b'\xc0' + packet.replace(b'\xdb', b'\xdb\xdd').replace(b'\xc0', b'\xdb\xdc') + b'\xc0'
+
+
+class SlipDecoder:
+    """增量 SLIP 解码，feed() 返回解出的完整帧"""
+
+    def __init__(self):
+        self._buffer = b''
+
+    def feed(self, data):
+        parts = (self._buffer + data).split(b'\xc0')
+        # 最后一段尚未遇到结束符，留到下次
+        self._buffer = parts.pop()
+        return [part.replace(b'\xdb\xdc', b'\xc0').replace(b'\xdb\xdd', b'\xdb')
+                for part in parts if part]
+
+
+class EmulatedChip:
+    """芯片状态：寄存器、Flash 内容和 ROM/stub 模式"""
+
+    def __init__(self, chip='ESP32', flash_size='4MB', mac=None,
+                 write_rate=400 * 1024, erase_rate=4 * 1024 * 1024):
+        self.cls = chip_class(chip)
+        self.chip = self.cls.CHIP_NAME
+        self.flash_size = flash_size.upper()
+        self.flash = bytearray(b'\xff' * flash_size_bytes(self.flash_size))
+        self.mac = mac or '24:0a:c4:00:00:01'
+        self.write_rate = write_rate  # Flash 写入速度（字节/秒），0 表示不模拟
+        self.erase_rate = erase_rate  # Flash 擦除速度（字节/秒），0 表示不模拟
+        self.registers = {}
+        self.stub = False
+        self.reset()
+
+    def reset(self):
+        """复位进入 ROM 下载模式"""
+        self.stub = False
+        self.registers = {CHIP_DETECT_MAGIC_REG_ADDR: getattr(self.cls, 'MAGIC_VALUE', 0) or 0}
+        mac = bytes(int(part, 16) for part in self.mac.split(':'))
+        if self.chip == 'ESP32':
+            base = self.cls.EFUSE_RD_REG_BASE
+            self.registers[base + 4] = struct.unpack('>I', mac[2:])[0]
+            self.registers[base + 8] = (mac[0] << 8) | mac[1]
+        elif getattr(self.cls, 'MAC_EFUSE_REG', None):
+            self.registers[self.cls.MAC_EFUSE_REG] = struct.unpack('>I', mac[2:])[0]
+            self.registers[self.cls.MAC_EFUSE_REG + 4] = (mac[0] << 8) | mac[1]
+
+    @property
+    def status_length(self):
+        # ROM 回复4字节状态，stub 回复2字节
+        return 2 if self.stub else 4
+
+    @property
+    def flash_id(self):
+        size_code = _FLASH_SIZE_CODES.get(self.flash_size, 0x16)
+        return _FLASH_MANUFACTURER | (_FLASH_DEVICE << 8) | (size_code << 16)
+
+    def read_reg(self, address, baud):
+        if address == self.cls.UART_CLKDIV_REG:
+            # esptool 用 波特率 × 分频值 估算晶振频率，按 40MHz 返回
+            return int(40e6 * self.cls.XTAL_CLK_DIVIDER / max(baud, 1))
+        return self.registers.get(address, 0)
+
+    def write_reg(self, address, value, mask=0xFFFFFFFF):
+        old = self.registers.get(address, 0)
+        self.registers[address] = (old & ~mask) | (value & mask)
+        spi_cmd = self.cls.SPI_REG_BASE
+        if address == spi_cmd and value & _SPI_CMD_USR:
+            self._run_spi_command()
+
+    def _run_spi_command(self):
+        """执行 esptool 通过 SPI 用户命令寄存器发出的 Flash 命令"""
+        base = self.cls.SPI_REG_BASE
+        command = self.registers.get(base + self.cls.SPI_USR2_OFFS, 0) & 0xFF
+        result = self.flash_id if command == _SPI_FLASH_RDID else 0
+        self.registers[base + self.cls.SPI_W0_OFFS] = result
+        self.registers[base] = 0
+
+    def write_flash(self, offset, data):
+        end = min(offset + len(data), len(self.flash))
+        self.flash[offset:end] = data[:end - offset]
+        if self.write_rate:
+            time.sleep(len(data) / self.write_rate)
+
+    def erase(self, offset, size):
+        end = min(offset + size, len(self.flash))
+        self.flash[offset:end] = b'\xff' * (end - offset)
+        if self.erase_rate:
+            time.sleep(size / self.erase_rate)
+
+
+class EmulatedDevice(threading.Thread):
+    """一个 pty 上的模拟设备
+
+    link_baud 为链路的最高速率（模拟USB转串口芯片的上限），实际传输速率取
+    esptool 设置的波特率与 link_baud 中较小者；0 表示不限速。
+    """
+
+    def __init__(self, chip, link_baud=0, link=None):
+        super().__init__(daemon=True)
+        self.chip = chip
+        self.link_baud = link_baud
+        self.baud = 115200
+        self.master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.device = os.ttyname(self._slave)
+        self.link = link
+        if link:
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(self.device, link)
+        self.port = link or self.device
+        self._stop = threading.Event()
+        self._decoder = SlipDecoder()
+        self._pending = []
+        self._write = None
+        self._inflate = None
+        self.stats = {'commands': 0, 'bytes_in': 0, 'bytes_out': 0, 'sessions': 0}
+
+    # ---- 传输 ----
+
+    def _throttle(self, size):
+        rate = min(self.baud, self.link_baud) if self.link_baud else 0
+        if rate:
+            time.sleep(size * 10 / rate)
+
+    def _send(self, packet):
+        frame = slip_encode(packet)
+        self._throttle(len(frame))
+        view = memoryview(frame)
+        while view:
+            written = os.write(self.master, view)
+            view = view[written:]
+        self.stats['bytes_out'] += len(frame)
+
+    def _recv_frame(self, timeout=3.0):
+        """读取下一帧（读 Flash 时等待主机确认）"""
+        deadline = time.monotonic() + timeout
+        while not self._pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                return None
+            self._fill(min(remaining, 0.2))
+        return self._pending.pop(0)
+
+    def _fill(self, timeout):
+        ready, _, _ = select.select([self.master], [], [], timeout)
+        if not ready:
+            return
+        try:
+            data = os.read(self.master, 65536)
+        except OSError:
+            time.sleep(timeout)
+            return
+        self.stats['bytes_in'] += len(data)
+        self._throttle(len(data))
+        self._pending.extend(self._decoder.feed(data))
+
+    def _respond(self, op, value=0, data=b'', error=0):
+        status = bytes([1 if error else 0, error]) + b'\x00' * (self.chip.status_length - 2)
+        body = data + status
+        self._send(struct.pack('<BBHI', 1, op, len(body), value) + body)
+
+    # ---- 主循环 ----
+
+    def run(self):
+        while not self._stop.is_set():
+            self._fill(0.2)
+            while self._pending:
+                packet = self._pending.pop(0)
+                if len(packet) < 8 or packet[0] != 0:
+                    continue
+                op, length, checksum = struct.unpack('<BHI', packet[1:8])
+                self.stats['commands'] += 1
+                try:
+                    self._handle(op, packet[8:8 + length])
+                except Exception as e:
+                    print(f"[{self.port}] 处理命令 0x{op:02x} 出错: {e}", file=sys.stderr)
+                    self._respond(op, error=0x07)
+
+    def stop(self):
+        self._stop.set()
+        if self.link and os.path.islink(self.link):
+            try:
+                os.remove(self.link)
+            except OSError:
+                pass
+        for fd in (self.master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _handle(self, op, data):
+        chip = self.chip
+        if op == SYNC:
+            # 新的连接：视为复位后进入下载模式，ROM 对同步命令回复8次
+            if chip.stub or self._write is not None:
+                chip.reset()
+                self.baud = 115200
+                self._write = None
+            self.stats['sessions'] += 1
+            for _ in range(8):
+                self._respond(op, value=0x20120707)
+        elif op == READ_REG:
+            address, = struct.unpack('<I', data[:4])
+            self._respond(op, value=chip.read_reg(address, self.baud))
+        elif op == WRITE_REG:
+            for index in range(0, len(data) - 15, 16):
+                address, value, mask, _delay = struct.unpack('<IIII', data[index:index + 16])
+                chip.write_reg(address, value, mask)
+            self._respond(op)
+        elif op == GET_SECURITY_INFO:
+            self._security_info(op)
+        elif op in (SPI_SET_PARAMS, SPI_ATTACH):
+            self._respond(op)
+        elif op == MEM_BEGIN or op == MEM_DATA:
+            self._respond(op)
+        elif op == MEM_END:
+            no_entry, entry = struct.unpack('<II', data[:8])
+            self._respond(op)
+            if not no_entry and entry:
+                # 运行 stub：stub 启动后先发送 "OHAI"
+                chip.stub = True
+                self._send(b'OHAI')
+        elif op == CHANGE_BAUDRATE:
+            baud, _old = struct.unpack('<II', data[:8])
+            self._respond(op)
+            self.baud = baud
+        elif op in (FLASH_BEGIN, FLASH_DEFL_BEGIN):
+            size, _blocks, block_size, offset = struct.unpack('<IIII', data[:16])
+            if not chip.stub:
+                # ROM 在开始时整块擦除
+                chip.erase(offset, size)
+            self._write = {'offset': offset, 'block_size': block_size, 'written': 0}
+            self._inflate = zlib.decompressobj() if op == FLASH_DEFL_BEGIN else None
+            self._respond(op)
+        elif op in (FLASH_DATA, FLASH_DEFL_DATA):
+            self._flash_data(op, data)
+        elif op in (FLASH_END, FLASH_DEFL_END):
+            self._write = None
+            self._inflate = None
+            self._respond(op)
+        elif op == SPI_FLASH_MD5:
+            address, size = struct.unpack('<II', data[:8])
+            digest = hashlib.md5(bytes(chip.flash[address:address + size]))
+            self._respond(op, data=digest.digest() if chip.stub else digest.hexdigest().encode())
+        elif op == ERASE_FLASH and chip.stub:
+            chip.erase(0, len(chip.flash))
+            self._respond(op)
+        elif op == ERASE_REGION and chip.stub:
+            offset, size = struct.unpack('<II', data[:8])
+            chip.erase(offset, size)
+            self._respond(op)
+        elif op == READ_FLASH and chip.stub:
+            self._read_flash(op, data)
+        elif op == RUN_USER_CODE and chip.stub:
+            chip.reset()
+        else:
+            self._respond(op, error=ROM_INVALID_RECV_MSG)
+
+    def _security_info(self, op):
+        cls = self.chip.cls
+        if self.chip.chip == 'ESP32':
+            self._respond(op, error=ROM_INVALID_RECV_MSG)
+        elif cls.USES_MAGIC_VALUE:
+            # ESP32-S2 的回复不含芯片ID
+            self._respond(op, data=struct.pack('<IBBBBBBBB', 0, 0, 0, 0, 0, 0, 0, 0, 0))
+        else:
+            self._respond(op, data=struct.pack('<IBBBBBBBBII', 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                                               cls.IMAGE_CHIP_ID, 0))
+
+    def _flash_data(self, op, data):
+        write = self._write
+        if write is None:
+            self._respond(op, error=0x06)
+            return
+        size, seq = struct.unpack('<II', data[:8])
+        payload = data[16:16 + size]
+        if self._inflate is not None:
+            payload = self._inflate.decompress(payload)
+            offset = write['offset'] + write['written']
+        else:
+            offset = write['offset'] + seq * write['block_size']
+        if self.chip.stub:
+            # stub 边写边擦除
+            self.chip.erase(offset, len(payload))
+        self.chip.write_flash(offset, payload)
+        write['written'] += len(payload)
+        self._respond(op)
+
+    def _read_flash(self, op, data):
+        offset, length, block_size, _max_inflight = struct.unpack('<IIII', data[:16])
+        self._respond(op)
+        content = bytes(self.chip.flash[offset:offset + length])
+        sent = 0
+        while sent < length:
+            block = content[sent:sent + block_size]
+            self._send(block)
+            sent += len(block)
+            # 逐块等待主机确认已收到的字节数
+            if self._recv_frame() is None:
+                return
+        self._send(hashlib.md5(content).digest())
+
+
+def start_devices(count=1, chip='ESP32', flash_size='4MB', link_baud=0, link_prefix=None,
+                  write_rate=400 * 1024, erase_rate=4 * 1024 * 1024, mac_base=0x240AC4000001):
+    """启动 count 个模拟设备，返回设备列表（MAC 地址依次递增）"""
+    devices = []
+    for index in range(count):
+        mac_value = mac_base + index
+        mac = ':'.join(f"{(mac_value >> shift) & 0xFF:02x}" for shift in range(40, -8, -8))
+        emulated = EmulatedChip(chip, flash_size, mac, write_rate, erase_rate)
+        link = f"{link_prefix}{index}" if link_prefix else None
+        device = EmulatedDevice(emulated, link_baud, link)
+        device.start()
+        devices.append(device)
+    return devices
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ESP 下载模式模拟器（伪终端）")
+    parser.add_argument('--count', type=int, default=1, help="模拟设备数量")
+    parser.add_argument('--chip', default='ESP32', help="芯片类型，如 ESP32、ESP32-S3、ESP32-C3")
+    parser.add_argument('--flash-size', default='4MB', help="Flash 容量，如 4MB、8MB、16MB")
+    parser.add_argument('--baud', type=int, default=0, help="链路最高速率，0 表示不限速")
+    parser.add_argument('--write-rate', type=int, default=400, help="Flash 写入速度 (KB/s)，0 表示不模拟")
+    parser.add_argument('--erase-rate', type=int, default=4096, help="Flash 擦除速度 (KB/s)，0 表示不模拟")
+    parser.add_argument('--link', default='/tmp/ttyESP', help="为每个设备创建的符号链接前缀，空字符串表示不创建")
+    args = parser.parse_args()
+
+    devices = start_devices(args.count, args.chip, args.flash_size, args.baud, args.link or None,
+                            args.write_rate * 1024, args.erase_rate * 1024)
+    for device in devices:
+        print(f"{device.port} -> {device.device}  {device.chip.chip} {device.chip.flash_size} MAC {device.chip.mac}")
+    print("按 Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for device in devices:
+            device.stop()
+
+
+if __name__ == '__main__':
+    main()
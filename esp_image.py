@@ -0,0 +1,263 @@
+"""固件镜像头校验
+
+ESP32 系列的引导程序和应用镜像以 0xE9 开头，镜像头记录了段数、Flash 模式/容量/频率、
+芯片ID、支持的芯片版本范围和是否附加 SHA-256。加载固件时解析一次（按文件修改时间缓存）：
+
+- 结构：魔数、段的布局（数量、长度不越界）、校验和字节、附加的 SHA-256
+- 与目标芯片对照（任务开始、写入之前）：芯片ID、芯片版本范围、引导程序的烧录地址，
+  以及引导程序头中的 Flash 容量不超过芯片实际容量（容量已知时）
+
+分区表（0xAA50 开头）和数据文件（SPIFFS、NVS 等）不是镜像，不做检查。合并镜像（merged.bin）
+检查其中的引导程序和 0x10000 处的应用。
+"""
+import hashlib
+import os
+import struct
+import threading
+
+IMAGE_MAGIC = 0xE9
+PARTITION_MAGIC = b'\xAA\x50'
+MAX_SEGMENTS = 16
+_HEADER = struct.Struct('<BBBBI')
+_EXTENDED = struct.Struct('<B3sHBHH4sB')
+_SEGMENT = struct.Struct('<II')
+_CHECKSUM_SEED = 0xEF
+# 最高芯片版本未设置（旧版本工具生成的镜像中该字段为保留的 0）
+_NO_MAX_REV = (0x0, 0xFFFF)
+
+# 镜像头中的芯片ID
+CHIP_IDS = {
+    0: 'ESP32',
+    2: 'ESP32-S2',
+    5: 'ESP32-C3',
+    9: 'ESP32-S3',
+    12: 'ESP32-C2',
+    13: 'ESP32-C6',
+    16: 'ESP32-H2',
+    18: 'ESP32-P4',
+    20: 'ESP32-C61',
+    23: 'ESP32-C5',
+}
+
+# 引导程序的烧录地址（未列出的芯片为 0x0）
+BOOTLOADER_OFFSETS = {
+    'ESP32': 0x1000,
+    'ESP32-S2': 0x1000,
+    'ESP32-P4': 0x2000,
+    'ESP32-C5': 0x2000,
+}
+_BOOTLOADER_CANDIDATES = (0x0, 0x1000, 0x2000)
+_APP_OFFSET = 0x10000
+
+FLASH_SIZES = {0: '1MB', 1: '2MB', 2: '4MB', 3: '8MB', 4: '16MB', 5: '32MB', 6: '64MB', 7: '128MB'}
+
+
+def _mb(size):
+    return int(size[:-2]) if size and size.upper().endswith('MB') else None
+
+
+def _xor_bytes(data):
+    """所有字节的异或（折叠大整数，避免逐字节的 Python 循环）"""
+    value = int.from_bytes(data, 'little')
+    width = len(data)
+    while width > 1:
+        half = (width + 1) // 2
+        value = (value & ((1 << (half * 8)) - 1)) ^ (value >> (half * 8))
+        width = half
+    return value & 0xFF
+
+
+class ImageInfo:
+    """文件中一个镜像的解析结果；errors 为结构错误"""
+
+    def __init__(self, offset):
+        self.offset = offset  # 在文件中的偏移
+        self.chip_id = None
+        self.flash_size = None
+        self.segments = []  # [(加载地址, 长度)]
+        self.min_rev = 0  # 最低芯片版本（主版本 * 100 + 次版本）
+        self.max_rev = 0xFFFF
+        self.hash_appended = False
+        self.sha256 = None  # 附加的 SHA-256（十六进制）
+        self.errors = []
+
+    @property
+    def chip(self):
+        return CHIP_IDS.get(self.chip_id)
+
+    def describe(self):
+        parts = [self.chip or f"芯片ID {self.chip_id}", f"{len(self.segments)} 段"]
+        if self.flash_size:
+            parts.append(f"Flash {self.flash_size}")
+        if self.hash_appended:
+            parts.append("SHA-256")
+        return " ".join(parts)
+
+
+def parse_image(data, offset=0):
+    """解析 data 中 offset 处的镜像"""
+    info = ImageInfo(offset)
+    end = len(data)
+    if end - offset < _HEADER.size + _EXTENDED.size:
+        info.errors.append("镜像头不完整")
+        return info
+    magic, count, _, size_freq, _ = _HEADER.unpack_from(data, offset)
+    if magic != IMAGE_MAGIC:
+        info.errors.append(f"魔数错误: 0x{magic:02X}（应为 0xE9）")
+        return info
+    info.flash_size = FLASH_SIZES.get(size_freq >> 4)
+    (_, _, info.chip_id, _, info.min_rev, info.max_rev, _,
+     hash_appended) = _EXTENDED.unpack_from(data, offset + _HEADER.size)
+    info.hash_appended = hash_appended == 1
+    if info.chip_id not in CHIP_IDS:
+        info.errors.append(f"未知的芯片ID {info.chip_id}")
+    if count == 0 or count > MAX_SEGMENTS:
+        info.errors.append(f"段数异常: {count}")
+        return info
+
+    position = offset + _HEADER.size + _EXTENDED.size
+    checksum = _CHECKSUM_SEED
+    for index in range(count):
+        if position + _SEGMENT.size > end:
+            info.errors.append(f"第 {index + 1} 段的段头超出文件末尾")
+            return info
+        load_address, length = _SEGMENT.unpack_from(data, position)
+        position += _SEGMENT.size
+        if position + length > end:
+            info.errors.append(f"第 {index + 1} 段（0x{load_address:08X}，{length} 字节）超出文件末尾")
+            return info
+        info.segments.append((load_address, length))
+        checksum ^= _xor_bytes(data[position:position + length])
+        position += length
+
+    # 校验和字节位于 16 字节对齐边界的最后一个字节
+    position += 15 - ((position - offset) % 16)
+    if position >= end:
+        info.errors.append("缺少校验和")
+        return info
+    if data[position] != checksum:
+        info.errors.append(f"校验和不一致: 0x{data[position]:02X}（计算值 0x{checksum:02X}）")
+    position += 1
+    if info.hash_appended:
+        if position + 32 > end:
+            info.errors.append("缺少附加的 SHA-256")
+            return info
+        info.sha256 = data[position:position + 32].hex()
+        if hashlib.sha256(data[offset:position]).hexdigest() != info.sha256:
+            info.errors.append("附加的 SHA-256 与镜像内容不一致")
+    return info
+
+
+class FirmwareImage:
+    """一个固件文件的检查结果"""
+
+    def __init__(self, path, kind, images, errors=None):
+        self.path = path
+        self.kind = kind  # 'image' 镜像 / 'merged' 合并镜像 / 'partition_table' 分区表 / 'data' 其他数据
+        self.images = images  # [ImageInfo]
+        self.errors = list(errors or [])
+        for image in images:
+            self.errors.extend(image.errors)
+
+    def describe(self):
+        if self.kind == 'partition_table':
+            return "分区表"
+        if self.kind == 'data':
+            return "数据文件（非镜像，不检查）"
+        return "；".join(image.describe() for image in self.images)
+
+
+def inspect_data(path, data):
+    if data[:2] == PARTITION_MAGIC:
+        return FirmwareImage(path, 'partition_table', [])
+    if data[:1] == bytes([IMAGE_MAGIC]):
+        images = [parse_image(data, 0)]
+        kind = 'image'
+    elif data[:1] == b'\xff':
+        # 合并镜像：ESP32/S2 的引导程序在 0x1000，P4/C5 在 0x2000，前面以 0xFF 填充
+        images = [parse_image(data, offset) for offset in _BOOTLOADER_CANDIDATES[1:]
+                  if len(data) > offset and data[offset] == IMAGE_MAGIC][:1]
+        kind = 'merged' if images else 'data'
+    else:
+        return FirmwareImage(path, 'data', [])
+    if images and len(data) > _APP_OFFSET and data[_APP_OFFSET] == IMAGE_MAGIC and images[0].offset < _APP_OFFSET:
+        images.append(parse_image(data, _APP_OFFSET))
+        kind = 'merged'
+    return FirmwareImage(path, kind, images)
+
+
+def _revision(revision):
+    """芯片版本 "v3.1" -> 301（无法解析时返回 None）"""
+    try:
+        major, _, minor = str(revision).lstrip('vV').partition('.')
+        return int(major) * 100 + int(minor or 0)
+    except ValueError:
+        return None
+
+
+def check_target(firmware, address, chip, revision=None, flash_size=None):
+    """对照目标芯片检查固件，返回问题列表（空列表表示通过）"""
+    problems = list(firmware.errors)
+    try:
+        base = int(str(address), 0)
+    except ValueError:
+        base = None
+    chip_revision = _revision(revision) if revision else None
+    for image in firmware.images:
+        if image.errors:
+            continue
+        where = f"0x{base + image.offset:X}" if base is not None else f"偏移 0x{image.offset:X}"
+        if chip and image.chip and image.chip != chip:
+            problems.append(f"{where} 处的镜像是 {image.chip} 的，目标芯片是 {chip}")
+            continue
+        if chip_revision is not None:
+            if chip_revision < image.min_rev:
+                problems.append(f"{where} 处的镜像要求芯片版本不低于 v{image.min_rev // 100}.{image.min_rev % 100}，"
+                                f"芯片为 v{chip_revision // 100}.{chip_revision % 100}")
+            elif image.max_rev not in _NO_MAX_REV and chip_revision > image.max_rev:
+                problems.append(f"{where} 处的镜像支持的芯片版本最高为 v{image.max_rev // 100}.{image.max_rev % 100}，"
+                                f"芯片为 v{chip_revision // 100}.{chip_revision % 100}")
+        if base is None or base + image.offset not in _BOOTLOADER_CANDIDATES:
+            continue
+        # 引导程序：烧录地址和镜像头中的 Flash 容量
+        expected = BOOTLOADER_OFFSETS.get(chip, 0x0)
+        if chip and base + image.offset != expected:
+            problems.append(f"引导程序烧录在 {where}，{chip} 的引导程序地址应为 0x{expected:X}")
+        if flash_size and image.flash_size and (_mb(image.flash_size) or 0) > (_mb(flash_size) or 0):
+            problems.append(f"引导程序头中的 Flash 容量为 {image.flash_size}，芯片实际只有 {flash_size}")
+    return problems
+
+
+class ImageCache:
+    """固件文件的检查结果缓存，文件修改后重新解析；可在任意线程中使用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # 路径 -> ((修改时间, 大小), FirmwareImage)
+
+    def inspect(self, path):
+        """检查固件文件（读取失败时抛出 OSError）"""
+        stat = os.stat(path)
+        key = (stat.st_mtime, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        with open(path, 'rb') as f:
+            data = f.read()
+        firmware = inspect_data(path, data)
+        with self._lock:
+            self._entries[path] = (key, firmware)
+        return firmware
+
+    def has_bootloader(self, firmwares):
+        """固件中是否有引导程序（需要对照芯片的 Flash 容量）"""
+        for path, address in firmwares:
+            try:
+                firmware = self.inspect(path)
+                base = int(str(address), 0)
+            except (OSError, ValueError):
+                continue
+            if any(base + image.offset in _BOOTLOADER_CANDIDATES for image in firmware.images):
+                return True
+        return False
@@ -0,0 +1,62 @@
+"""esptool 子进程的启动命令（兼容 PyInstaller 打包）
+
+烧录引擎和 MAC读取工具以子进程方式运行 esptool（以及输出格式相同的 flash_md5）。源码运行时
+用 python -m esptool；build.bat 以 --onefile 打包后 sys.executable 是工具自身，没有独立的
+Python 解释器，也没有 flash_md5.py 文件，这时改为带 --esptool / --flash-md5 参数重新启动工具
+自身。各工具入口处先调用 run_passthrough()：带这两个参数时直接运行对应功能后退出，不创建界面。
+"""
+import locale
+import os
+import sys
+
+ESPTOOL_FLAG = '--esptool'
+FLASH_MD5_FLAG = '--flash-md5'
+
+
+def frozen():
+    """是否为 PyInstaller 打包后的程序"""
+    return bool(getattr(sys, 'frozen', False))
+
+
+def esptool_command():
+    """运行 esptool 的命令前缀"""
+    if frozen():
+        return [sys.executable, ESPTOOL_FLAG]
+    return [sys.executable, "-m", "esptool"]
+
+
+def flash_md5_command():
+    """运行设备端 MD5 校验（flash_md5）的命令前缀"""
+    if frozen():
+        return [sys.executable, FLASH_MD5_FLAG]
+    import flash_md5
+    # 按文件路径运行：子进程的工作目录不一定是工具所在目录
+    return [sys.executable, os.path.abspath(flash_md5.__file__)]
+
+
+def _reopen_std_streams():
+    """--windowed 打包的程序没有控制台，sys.stdout/stderr 为 None；输出重定向到管道时按文件描述符重新打开"""
+    encoding = locale.getpreferredencoding(False)
+    for name, fd in (('stdout', 1), ('stderr', 2)):
+        if getattr(sys, name) is None:
+            try:
+                stream = open(fd, 'w', encoding=encoding, errors='replace', buffering=1, closefd=False)
+            except OSError:
+                stream = open(os.devnull, 'w')
+            setattr(sys, name, stream)
+
+
+def run_passthrough(argv=None):
+    """命令行以 --esptool / --flash-md5 开头时运行对应功能并退出进程，否则直接返回"""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in (ESPTOOL_FLAG, FLASH_MD5_FLAG):
+        return
+    _reopen_std_streams()
+    if argv[0] == FLASH_MD5_FLAG:
+        import flash_md5
+        sys.exit(flash_md5.main(argv[1:]))
+    import esptool
+    # 与 python -m esptool 相同：_main() 读取 sys.argv，出错时打印 "A fatal error occurred" 并以退出码 2 结束
+    sys.argv = ['esptool'] + argv[1:]
+    esptool._main()
+    sys.exit(0)
@@ -0,0 +1,413 @@
+"""esptool 输出的流式解析
+
+逐行喂入 esptool 的输出（兼容 v4 和 v5 的输出格式），边读边解析出带类型的结果：
+芯片系列/型号/版本/特性/晶振、MAC、Flash ID/容量、写入/回读进度、传输速率、校验结果和错误。
+解析器只保留解析结果和最近若干行原文（用于错误分类），内存占用与输出长度无关。
+
+三个工具共用：
+    parser = EsptoolOutputParser()
+    for line in proc.stdout:
+        for fact in parser.feed(line):
+            ...
+    parser.chip, parser.mac, parser.fatal ...
+"""
+import re
+from collections import deque, namedtuple
+
+# 结果类型
+CHIP = 'chip'               # 芯片系列，如 'ESP32-S3'
+REVISION = 'revision'       # 芯片版本，如 'v0.2'
+FEATURES = 'features'       # 特性元组，如 ('Wi-Fi', 'BT 5 (LE)')
+CRYSTAL = 'crystal'         # 晶振频率，如 '40MHz'
+MAC = 'mac'                 # MAC地址字符串
+FLASH_ID = 'flash_id'       # (厂商ID, 器件ID)，十六进制字符串
+FLASH_SIZE = 'flash_size'   # Flash 容量，如 '4MB'
+PROGRESS = 'progress'       # Progress
+WROTE = 'wrote'             # Transfer，一段写入完成
+READ = 'read'               # Transfer，一段回读完成
+ERASED = 'erased'           # 整片擦除完成，值为耗时（秒）
+VERIFIED = 'verified'       # 校验结果 True/False
+ERROR = 'error'             # 致命错误说明
+
+# 解析阶段
+STAGE_CONNECT = 'connect'
+STAGE_IDENTIFY = 'identify'
+STAGE_STUB = 'stub'
+STAGE_ERASE = 'erase'
+STAGE_WRITE = 'write'
+STAGE_VERIFY = 'verify'
+STAGE_READ = 'read'
+STAGE_RESET = 'reset'
+STAGE_FAILED = 'failed'
+
+Fact = namedtuple('Fact', ['kind', 'value'])
+# operation 为 'write' 或 'read'；address 为设备上的地址（v4 回读进度没有地址，为 None）
+Progress = namedtuple('Progress', ['operation', 'address', 'percent'])
+# compressed 仅压缩写入时有值
+Transfer = namedtuple('Transfer', ['size', 'compressed', 'address', 'seconds', 'kbps'])
+
+_NO_FACTS = ()
+
+_CHIP_FAMILY = re.compile(r'(ESP8266|ESP32(?:-?([SCHP]\d+))?)', re.IGNORECASE)
+_REVISION = re.compile(r'\(revision (v?[\d.]+)\)')
+_MAC = re.compile(r'[0-9a-fA-F]{2}(?::[0-9a-fA-F]{2}){5}')
+_PROGRESS = re.compile(r'(0x[0-9a-fA-F]+)(?:[^\d%]*(\d+(?:\.\d+)?) ?%)?')
+_V4_READ_PROGRESS = re.compile(r'\d+ \((\d+) %\)')
+_WROTE = re.compile(r'Wrote (\d+) bytes(?: \((\d+) compressed\))? at (0x[0-9a-fA-F]+) '
+                    r'in ([\d.]+) seconds \((?:effective )?([\d.]+) kbit/s\)')
+_READ = re.compile(r'Read (\d+) bytes (?:at|from) (0x[0-9a-fA-F]+) in ([\d.]+) seconds \(([\d.]+) kbit/s\)')
+_SECONDS = re.compile(r'in ([\d.]+) ?s')
+# "Connecting...." 后的点和下划线，同一行后面可能紧跟 NOTE 等其他输出
+_CONNECT_DOTS = re.compile(r'Connecting([._]*)')
+_FLASH_SIZE = re.compile(r'flash size:\s*(\d+MB)', re.IGNORECASE)
+
+_FATAL_MARK = 'A fatal error occurred:'
+# 行分隔：换行（含 \r\n、\r）和 v4 回读进度用来覆盖同一行的退格
+_SEPARATORS = re.compile(r'\r\n|\n|\r|\x08+')
+
+
+def chip_family(name):
+    """芯片型号归一化为系列名：'ESP32-D0WDQ6' -> 'ESP32'，'esp32s3' -> 'ESP32-S3'"""
+    match = _CHIP_FAMILY.search(name or '')
+    if not match:
+        return None
+    if match.group(2):
+        return f"ESP32-{match.group(2).upper()}"
+    return match.group(1).upper()
+
+
+class OutputSplitter:
+    """把任意切分的输出文本切成行
+
+    v4 的回读进度 "4096 (12 %)" 不换行，用退格覆盖后接着打印下一条，按行读取时要等回读结束
+    才能拿到。这里在退格处也切分，这样的片段标记为不完整的行（用于看门狗和解析，不必写日志）。
+    feed(text) 返回 [(文本, 是否为完整的行)]，close() 返回缓冲中剩余的部分。
+    """
+
+    def __init__(self):
+        self._pending = ''
+
+    def feed(self, text):
+        data = self._pending + text
+        pieces = []
+        start = 0
+        for match in _SEPARATORS.finditer(data):
+            if match.group() == '\r' and match.end() == len(data):
+                # 可能是被切开的 \r\n，等下一块
+                break
+            pieces.append((data[start:match.start()], match.group()[0] != '\x08'))
+            start = match.end()
+        self._pending = data[start:]
+        return pieces
+
+    def close(self):
+        pending, self._pending = self._pending.rstrip('\r'), ''
+        return [(pending, True)] if pending else []
+
+
+class EsptoolOutputParser:
+    """esptool 输出的增量解析器（状态机）
+
+    feed(line) 解析一行并返回本行产生的结果（Fact 元组，通常为空）；
+    feed_text(text) 接收任意切分的文本块（例如重定向 stdout 得到的 write 调用）。
+    解析结果同时保存在属性中，text() 返回最近 tail_lines 行原文。
+    """
+
+    def __init__(self, tail_lines=64, max_errors=8):
+        self.stage = STAGE_CONNECT
+        self.chip = None
+        self.description = None
+        self.revision = None
+        self.features = ()
+        self.crystal = None
+        self.mac = None
+        self.flash_manufacturer = None
+        self.flash_device = None
+        self.flash_size = None
+        self.stub = False
+        self.sync_attempts = 0
+        self.progress = None
+        # 最后一条写入进度中的地址（写入中断后据此续写）
+        self.write_address = None
+        self.transfers = deque(maxlen=32)
+        self.erase_seconds = None
+        self.verified = None
+        self.errors = deque(maxlen=max_errors)
+        self.fatal = None
+        self.line_count = 0
+        self._tail = deque(maxlen=tail_lines)
+        self._partial = ''
+
+    def text(self):
+        """最近若干行原文"""
+        return "\n".join(self._tail)
+
+    def feed_text(self, text):
+        """接收任意切分的文本，按行解析；返回产生的结果列表"""
+        if not text:
+            return []
+        data = self._partial + text
+        lines = data.replace('\r', '\n').split('\n')
+        self._partial = lines.pop()
+        if len(self._partial) > 4096:
+            # 异常的超长行，不再等待换行
+            lines.append(self._partial)
+            self._partial = ''
+        facts = []
+        for line in lines:
+            if line:
+                facts.extend(self.feed(line))
+        return facts
+
+    def close(self):
+        """输出结束：解析缓冲中未换行的最后一段"""
+        if self._partial:
+            line, self._partial = self._partial, ''
+            return self.feed(line)
+        return _NO_FACTS
+
+    def feed(self, line):
+        """解析一行输出"""
+        line = line.strip()
+        if not line:
+            return _NO_FACTS
+        self.line_count += 1
+        self._tail.append(line)
+
+        # 按行首单词分派，每行只做一次字典查找
+        space = line.find(' ')
+        handler = _HANDLERS.get(line if space < 0 else line[:space])
+        if handler is not None:
+            return handler(self, line)
+
+        first = line[0]
+        if first.isdigit() and '%)' in line:
+            # v4 回读进度 "4096 (12 %)8192 (25 %)..."
+            matches = _V4_READ_PROGRESS.findall(line)
+            if matches:
+                self.stage = STAGE_READ
+                self.progress = Progress('read', None, float(matches[-1]))
+                return (Fact(PROGRESS, self.progress),)
+        elif first in '._' and not line.strip('._'):
+            # 同步失败时每次尝试打印一个 '.'（复位方式切换时为 '_'）
+            self.sync_attempts += len(line)
+        elif line.startswith('Connecting'):
+            self.sync_attempts += max(0, len(_CONNECT_DOTS.match(line).group(1)) - len('...'))
+        elif _FATAL_MARK in line:
+            return self._fatal(line)
+        return _NO_FACTS
+
+    def _fatal(self, line):
+        if _FATAL_MARK not in line:
+            return _NO_FACTS
+        message = line.split(_FATAL_MARK, 1)[1].strip()
+        self.fatal = message
+        self.errors.append(message)
+        self.stage = STAGE_FAILED
+        return (Fact(ERROR, message),)
+
+    def _set_chip(self, name):
+        family = chip_family(name)
+        if family and family != self.chip:
+            self.chip = family
+            return [Fact(CHIP, family)]
+        return []
+
+    def _writing(self, line):
+        if not line.startswith('Writing at 0x'):
+            return _NO_FACTS
+        return self._progress('write', line[11:])
+
+    def _reading(self, line):
+        if not line.startswith('Reading from 0x'):
+            return _NO_FACTS
+        return self._progress('read', line[13:])
+
+    def _progress(self, operation, rest):
+        match = _PROGRESS.match(rest)
+        if not match:
+            return _NO_FACTS
+        address = int(match.group(1), 16)
+        percent = float(match.group(2)) if match.group(2) else None
+        if operation == 'write':
+            self.stage = STAGE_WRITE
+            self.write_address = address
+        else:
+            self.stage = STAGE_READ
+        self.progress = Progress(operation, address, percent)
+        return (Fact(PROGRESS, self.progress),)
+
+    def _detecting(self, line):
+        if not line.startswith('Detecting chip type...'):
+            return _NO_FACTS
+        self.stage = STAGE_IDENTIFY
+        name = line[len('Detecting chip type...'):].strip()
+        if name.startswith('Unsupported'):
+            return _NO_FACTS
+        return tuple(self._set_chip(name))
+
+    def _connected(self, line):
+        if not line.startswith('Connected to '):
+            return _NO_FACTS
+        return tuple(self._set_chip(line[len('Connected to '):].split(' on ')[0]))
+
+    def _chip(self, line):
+        if line.startswith('Chip is '):
+            rest = line[len('Chip is '):]
+        elif line.startswith('Chip type:'):
+            rest = line[len('Chip type:'):].strip()
+        else:
+            # 'Chip erase completed ...'（v4 erase_flash）
+            return self._erased(line)
+        self.description = rest.split(' (revision')[0]
+        facts = self._set_chip(self.description)
+        match = _REVISION.search(rest)
+        if match:
+            self.revision = match.group(1)
+            facts.append(Fact(REVISION, self.revision))
+        return tuple(facts)
+
+    def _features(self, line):
+        self.features = tuple(f.strip() for f in line[len('Features:'):].split(',') if f.strip())
+        return (Fact(FEATURES, self.features),)
+
+    def _crystal(self, line):
+        if line.startswith('Crystal is '):
+            self.crystal = line[len('Crystal is '):].strip()
+        elif line.startswith('Crystal frequency:'):
+            self.crystal = line[len('Crystal frequency:'):].strip()
+        else:
+            return _NO_FACTS
+        return (Fact(CRYSTAL, self.crystal),)
+
+    def _mac(self, line):
+        match = _MAC.search(line)
+        if not match:
+            return _NO_FACTS
+        self.mac = match.group(0)
+        return (Fact(MAC, self.mac),)
+
+    def _uploading(self, line):
+        if line.startswith('Uploading stub'):
+            self.stage = STAGE_STUB
+        return _NO_FACTS
+
+    def _stub(self, line):
+        if line.startswith('Stub running') or line.startswith('Stub flasher running'):
+            self.stub = True
+        return _NO_FACTS
+
+    def _manufacturer(self, line):
+        self.flash_manufacturer = line.split(':', 1)[1].strip()
+        return _NO_FACTS
+
+    def _device(self, line):
+        if not self.flash_manufacturer:
+            return _NO_FACTS
+        self.flash_device = line.split(':', 1)[1].strip()
+        return (Fact(FLASH_ID, (self.flash_manufacturer, self.flash_device)),)
+
+    def _flash_size(self, line):
+        match = _FLASH_SIZE.search(line)
+        if not match:
+            return _NO_FACTS
+        self.flash_size = match.group(1)
+        return (Fact(FLASH_SIZE, self.flash_size),)
+
+    def _flash(self, line):
+        if line.startswith('Flash will be erased'):
+            self.stage = STAGE_WRITE
+            return _NO_FACTS
+        if line.startswith('Flash memory erased'):
+            return self._erased(line)
+        return self._flash_size(line)
+
+    def _erasing(self, line):
+        if line.startswith('Erasing flash'):
+            self.stage = STAGE_ERASE
+        return _NO_FACTS
+
+    def _erased(self, line):
+        if not (line.startswith('Chip erase completed') or line.startswith('Flash memory erased')):
+            return _NO_FACTS
+        match = _SECONDS.search(line)
+        self.erase_seconds = float(match.group(1)) if match else None
+        return (Fact(ERASED, self.erase_seconds),)
+
+    def _compressed(self, line):
+        self.stage = STAGE_WRITE
+        return _NO_FACTS
+
+    def _wrote(self, line):
+        match = _WROTE.match(line)
+        if not match:
+            return _NO_FACTS
+        size, compressed, address, seconds, kbps = match.groups()
+        transfer = Transfer(int(size), int(compressed) if compressed else None,
+                            int(address, 16), float(seconds), float(kbps))
+        self.transfers.append(transfer)
+        self.stage = STAGE_VERIFY
+        return (Fact(WROTE, transfer),)
+
+    def _read(self, line):
+        match = _READ.match(line)
+        if not match:
+            return _NO_FACTS
+        size, address, seconds, kbps = match.groups()
+        transfer = Transfer(int(size), None, int(address, 16), float(seconds), float(kbps))
+        self.transfers.append(transfer)
+        return (Fact(READ, transfer),)
+
+    def _verifying(self, line):
+        self.stage = STAGE_VERIFY
+        return _NO_FACTS
+
+    def _verify_ok(self, line):
+        if not (line.startswith('Hash of data verified') or line.startswith('-- verify OK')
+                or line.startswith('Verification successful')):
+            return self._verify_failed(line)
+        self.verified = True
+        return (Fact(VERIFIED, True),)
+
+    def _verify_failed(self, line):
+        if not (line.startswith('-- verify FAILED') or line.startswith('Verification failed')):
+            return _NO_FACTS
+        self.verified = False
+        return (Fact(VERIFIED, False),)
+
+    def _reset(self, line):
+        if self.stage != STAGE_FAILED:
+            self.stage = STAGE_RESET
+        return _NO_FACTS
+
+
+# 行首单词 -> 处理函数
+_HANDLERS = {
+    'Writing': EsptoolOutputParser._writing,
+    'Reading': EsptoolOutputParser._reading,
+    'Detecting': EsptoolOutputParser._detecting,
+    'Connected': EsptoolOutputParser._connected,
+    'Chip': EsptoolOutputParser._chip,
+    'Features:': EsptoolOutputParser._features,
+    'Crystal': EsptoolOutputParser._crystal,
+    'MAC:': EsptoolOutputParser._mac,
+    'Uploading': EsptoolOutputParser._uploading,
+    'Stub': EsptoolOutputParser._stub,
+    'Manufacturer:': EsptoolOutputParser._manufacturer,
+    'Device:': EsptoolOutputParser._device,
+    'Detected': EsptoolOutputParser._flash_size,
+    'Auto-detected': EsptoolOutputParser._flash_size,
+    'Flash': EsptoolOutputParser._flash,
+    'Erasing': EsptoolOutputParser._erasing,
+    'Compressed': EsptoolOutputParser._compressed,
+    'Wrote': EsptoolOutputParser._wrote,
+    'Read': EsptoolOutputParser._read,
+    'Verifying': EsptoolOutputParser._verifying,
+    'Hash': EsptoolOutputParser._verify_ok,
+    '--': EsptoolOutputParser._verify_ok,
+    'Verification': EsptoolOutputParser._verify_ok,
+    'Hard': EsptoolOutputParser._reset,
+    'Leaving...': EsptoolOutputParser._reset,
+    'A': EsptoolOutputParser._fatal,
+    'ERROR:': EsptoolOutputParser._fatal,
+}
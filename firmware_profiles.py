@@ -0,0 +1,162 @@
+"""按芯片型号选择固件配置（混线生产）
+
+同一条线上交替生产不同产品（如 ESP32-S3 和 ESP32-C3 的板子）时，在配置中为每种产品
+建一个固件配置，绑定芯片型号，并可进一步限定 Flash 容量或 USB 描述符：
+
+    "firmware_profiles": [
+        {"name": "S3 网关", "chip": "ESP32-S3", "flash_size": "8MB",
+         "firmwares": [{"path": "s3/bootloader.bin", "address": "0x0"},
+                       {"path": "s3/partition-table.bin", "address": "0x8000"},
+                       {"path": "s3/app.bin", "address": "0x10000"}]},
+        {"name": "C3 传感器", "chip": "ESP32-C3", "vid_pid": "303A:1001",
+         "firmwares": [{"path": "c3/merged.bin", "address": "0x0"}]}
+    ]
+
+烧录引擎检测到芯片后选择匹配的配置中条件最多的一个；没有匹配的配置时使用任务提交的固件
+（烧录工具中即界面上启用的固件）。配置加载后在后台预读所有固件文件并计算 SHA-256，
+一是尽早发现缺失的文件，二是让文件进入系统缓存；之后文件被修改时会在日志中提示。
+"""
+import hashlib
+import os
+import threading
+
+
+def normalize_chip(chip):
+    """芯片型号的比较形式：ESP32-S3、esp32s3 都为 ESP32S3"""
+    return ''.join(ch for ch in str(chip or '').upper() if ch.isalnum())
+
+
+class FirmwareProfile:
+    """一个固件配置：匹配条件和 [(路径, 地址)]"""
+
+    def __init__(self, name, chip, firmwares, flash_size=None, vid_pid=None):
+        self.name = name
+        self.chip = chip
+        self.firmwares = list(firmwares)
+        self.flash_size = flash_size
+        self.vid_pid = vid_pid
+
+    def score(self, chip, flash_size, descriptor):
+        """匹配时返回条件个数（越多越具体），不匹配返回 None"""
+        if normalize_chip(chip) != normalize_chip(self.chip):
+            return None
+        score = 1
+        if self.flash_size:
+            if str(flash_size or '').upper() != str(self.flash_size).upper():
+                return None
+            score += 1
+        if self.vid_pid:
+            if str(descriptor or '').upper() != str(self.vid_pid).upper():
+                return None
+            score += 1
+        return score
+
+    def describe(self):
+        conditions = [self.chip]
+        if self.flash_size:
+            conditions.append(self.flash_size)
+        if self.vid_pid:
+            conditions.append(self.vid_pid)
+        return f"{self.name}（{' '.join(conditions)}，{len(self.firmwares)} 个固件）"
+
+
+def parse_profiles(value, base_dir=None):
+    """解析配置项 firmware_profiles，格式错误时抛出 ValueError"""
+    if not value:
+        return []
+    if not isinstance(value, list):
+        raise ValueError("firmware_profiles 应为列表")
+    profiles = []
+    for index, entry in enumerate(value, 1):
+        if not isinstance(entry, dict) or not entry.get('chip'):
+            raise ValueError(f"固件配置 #{index} 缺少 chip")
+        firmwares = []
+        for item in entry.get('firmwares') or []:
+            if not isinstance(item, dict) or not item.get('path'):
+                raise ValueError(f"固件配置 #{index} 的固件缺少 path")
+            path = item['path']
+            if base_dir and not os.path.isabs(path):
+                path = os.path.join(base_dir, path)
+            address = str(item.get('address', '0x0'))
+            try:
+                int(address, 0)
+            except ValueError:
+                raise ValueError(f"固件配置 #{index} 的地址无效: {address}")
+            firmwares.append((path, address))
+        if not firmwares:
+            raise ValueError(f"固件配置 #{index} 没有固件")
+        profiles.append(FirmwareProfile(entry.get('name') or f"配置{index}", entry['chip'], firmwares,
+                                        entry.get('flash_size'), entry.get('vid_pid')))
+    return profiles
+
+
+class ProfileRouter:
+    """固件配置的选择和预读；select() 可在任意线程中调用"""
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+        self._cache = {}  # 路径 -> (修改时间, 大小, SHA-256)
+
+    @property
+    def needs_flash_size(self):
+        """有配置按 Flash 容量区分时，检测芯片需要同时读取 Flash 信息"""
+        return any(profile.flash_size for profile in self.profiles)
+
+    def load(self, value, base_dir=None):
+        profiles = parse_profiles(value, base_dir)
+        with self._lock:
+            self.profiles = profiles
+        return profiles
+
+    def select(self, chip, flash_size=None, descriptor=None):
+        """条件最多的匹配配置；同样具体时取配置中靠前的"""
+        best, best_score = None, 0
+        for profile in self.profiles:
+            score = profile.score(chip, flash_size, descriptor)
+            if score is not None and score > best_score:
+                best, best_score = profile, score
+        return best
+
+    def precache(self, log=None):
+        """读取所有固件文件（进入系统缓存并计算 SHA-256），返回缺失或无法读取的文件说明"""
+        problems = []
+        for profile in list(self.profiles):
+            for path, _ in profile.firmwares:
+                try:
+                    self._digest(path)
+                except OSError as e:
+                    problems.append(f"固件配置 {profile.name}: {path} 无法读取 ({e.strerror or e})")
+        if log:
+            for problem in problems:
+                log(problem)
+        return problems
+
+    def check(self, profile):
+        """任务开始前确认配置的固件都可读；返回自预读以来内容发生变化的文件"""
+        changed = []
+        for path, _ in profile.firmwares:
+            with self._lock:
+                previous = self._cache.get(path)
+            stat = os.stat(path)
+            if previous is None or previous[:2] != (stat.st_mtime, stat.st_size):
+                digest = self._digest(path)
+                if previous is not None and previous[2] != digest:
+                    changed.append(path)
+        return changed
+
+    def digest(self, path):
+        with self._lock:
+            entry = self._cache.get(path)
+        return entry[2] if entry else None
+
+    def _digest(self, path):
+        stat = os.stat(path)
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        with self._lock:
+            self._cache[path] = (stat.st_mtime, stat.st_size, digest)
+        return digest
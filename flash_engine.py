@@ -0,0 +1,1113 @@
+"""烧录引擎：不依赖界面的烧录流程
+
+烧录工具和统一工具的界面都建立在本模块之上；测试脚本也可以直接导入，
+不创建任何窗口，并行烧录多块板子：
+
+    from flash_engine import FlashEngine, FlashOptions
+
+    engine = FlashEngine(on_log=lambda job, line: print(job.port, line))
+    options = FlashOptions(baud=921600, erase=False)
+    jobs = engine.flash_all(['COM3', 'COM4'], [('app.bin', '0x10000')], options)
+    for job in jobs:
+        print(job.port, job.result, job.chip, job.mac, job.note)
+
+也可以逐个提交（submit 立即返回 FlashJob，job.wait() 等待结束），或在 asyncio 中使用：
+
+    job = engine.submit('COM3', firmwares, options)
+    await job                                     # FlashJob 可以直接 await
+    jobs = await engine.flash_all_async(ports, firmwares, options)
+
+每个任务在独立线程中运行（线程名 "烧录 <端口>"），esptool 以子进程方式调用；
+重试、阶段看门狗、续写、回读校验和原生USB重新枚举的处理与烧录工具完全相同。
+engine.configure(config) 接受与烧录工具 config.json 相同的键。
+
+回调都在工作线程中调用，界面程序需要自行转到主线程；回调抛出的异常不会影响任务：
+
+    on_log(job, line)          任务日志的一行
+    on_message(text)           引擎消息（开始、停止、跳过、设备拔出等）
+    on_job_started(job)        任务开始（已确定设备标识 job.key）
+    on_phase(job, phase)       进入新阶段（检测芯片、擦除Flash、写入固件 1/2 ...）
+    on_reattached(key, port)   原生USB设备重新枚举到新端口
+    on_record(job)             任务产生一条烧录记录（成功、失败、设备移除）
+    on_job_finished(job)       任务结束，job.result 见 RESULTS
+"""
+import asyncio
+import codecs
+import locale
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+import serial
+from serial.tools import list_ports
+
+from device_tracker import RecentDeviceTable, FlashSession, device_key, find_port, native_usb_serial
+from flash_watchdog import PhaseWatchdog, WatchdogTimeout, PHASE_LABELS, load_deadlines
+from flash_retry import (EsptoolError, classify_error, describe_error, load_retry_limits,
+                         backoff_delay, resume_address, LINK, SYNC, VERIFY)
+from esptool_output import EsptoolOutputParser, OutputSplitter, WROTE
+from flash_trace import TraceRecorder, CAT_JOB, CAT_PHASE, CAT_WAIT
+from flash_verify import (VerifyPolicy, DigestCache, MODE_LABELS, HASH, mode_from_label, readback_regions,
+                          compare_region)
+import flash_md5
+from esptool_launcher import esptool_command, flash_md5_command
+from station_metrics import StationMetrics, hub_of
+from hub_scheduler import HubScheduler, AUTO
+from link_quality import LinkQualityTracker, location_key
+from reset_strategy import ResetStrategyTable, STRATEGY_LABELS, NO_RESET, descriptor_of
+from port_filter import PortFilter
+from port_lease import PortLeases, describe_holder
+from firmware_profiles import ProfileRouter
+from esp_image import ImageCache, check_target
+
+# 任务结果
+SUCCESS = 'success'      # 烧录成功
+VERIFIED = 'verified'    # 冷却期内重复出现的设备，仅校验
+FAIL = 'fail'            # 烧录失败
+REMOVED = 'removed'      # 设备中途拔出
+CANCELLED = 'cancelled'  # 被 stop() 停止
+SKIPPED = 'skipped'      # 冷却期内重复出现的设备，跳过
+BUSY = 'busy'            # 同一设备已有任务在进行，未开始
+RESULTS = (SUCCESS, VERIFIED, FAIL, REMOVED, CANCELLED, SKIPPED, BUSY)
+
+_ESPTOOL_COMMANDS = ('read_mac', 'chip_id', 'flash_id', 'erase_flash', 'erase_region',
+                     'write_flash', 'verify_flash', 'read_flash')
+
+
+def _esptool_command(args):
+    """esptool 参数中的命令名（时间线中的区间名称）"""
+    for arg in args:
+        name = str(arg).replace('-', '_')
+        if name in _ESPTOOL_COMMANDS:
+            return f"esptool {name}"
+    return "esptool"
+
+
+class FlashOptions:
+    """一个任务的烧录参数，提交时确定，任务运行中不再读取界面"""
+
+    def __init__(self, baud=921600, erase=False, flash_mode='keep', flash_freq='keep'):
+        self.baud = int(baud)
+        self.erase = bool(erase)
+        self.flash_mode = flash_mode or 'keep'
+        self.flash_freq = flash_freq or 'keep'
+
+    @classmethod
+    def from_config(cls, config):
+        """按 config.json 的 baudrate / erase_flash / flash_mode / flash_freq 创建"""
+        return cls(config.get('baudrate', 921600), config.get('erase_flash', False),
+                   config.get('flash_mode', 'keep'), config.get('flash_freq', 'keep'))
+
+
+class FlashJob:
+    """一块板子的烧录任务；结束后 result、chip、mac、note 等字段有效"""
+
+    def __init__(self, engine, port, firmwares, options, auto=False):
+        self.engine = engine
+        self.port = port  # 提交时的端口名，重新枚举后以 current_port 为准
+        self.firmwares = list(firmwares or [])  # [(路径, 地址)]，有匹配芯片的固件配置时被替换
+        self.profile = None  # 按芯片选中的固件配置名
+        self.options = options
+        self.auto = auto  # 自动烧录（新插入的设备），冷却期内的重复设备会跳过或仅校验
+        self.session = None
+        self.started = time.monotonic()
+        self.result = None
+        self.success = False
+        self.chip = None
+        self.mac = "Unknown"
+        self.flash_size = None  # 检测芯片时读取到的 Flash 容量（未读取 Flash 信息时为 None）
+        self.usb_serial = None
+        self.hub = None  # 所在的USB集线器
+        self.location = None  # 端口的USB位置（链路质量按位置统计）
+        self.descriptor = None  # USB描述符 VID:PID（复位方式按位置和描述符学习）
+        self._hub_slot = False  # 已占用集线器的任务名额
+        self.note = ""  # 记录中的备注或错误信息
+        self.holder = None  # 端口被其他工具实例占用时，占用者的描述
+        self.error = None  # 失败时的异常
+        self.verify = None  # (校验方式, 耗时秒)
+        self.verify_only = False
+        self.cycle_time = None  # 从开始到产生记录的秒数
+        self.future = Future()
+
+    @property
+    def key(self):
+        return self.session.key if self.session else self.port
+
+    @property
+    def current_port(self):
+        return self.session.port if self.session else self.port
+
+    @property
+    def phase(self):
+        return self.session.phase if self.session else "准备"
+
+    @property
+    def retries(self):
+        return self.session.retries if self.session else 0
+
+    def done(self):
+        return self.future.done()
+
+    def wait(self, timeout=None):
+        """等待任务结束，返回任务本身；超时抛出 concurrent.futures.TimeoutError"""
+        return self.future.result(timeout)
+
+    def cancel(self):
+        self.engine.stop(self.key)
+
+    def __await__(self):
+        return asyncio.wrap_future(self.future).__await__()
+
+    def __repr__(self):
+        return f"<FlashJob {self.current_port} {self.result or self.phase}>"
+
+
+class FlashEngine:
+    """并行烧录多块板子；可在任意线程中提交和停止任务"""
+
+    def __init__(self, on_log=None, on_message=None, on_job_started=None, on_phase=None,
+                 on_reattached=None, on_record=None, on_job_finished=None,
+                 tracer=None, metrics=None):
+        self.on_log = on_log
+        self.on_message = on_message
+        self.on_job_started = on_job_started
+        self.on_phase = on_phase
+        self.on_reattached = on_reattached
+        self.on_record = on_record
+        self.on_job_finished = on_job_finished
+        # 时间线记录（flash_trace.TraceRecorder），默认不记录
+        self.tracer = tracer or TraceRecorder()
+        # 进行中的任务：稳定设备标识 -> FlashSession（端口名可能随重新枚举变化）
+        self.sessions = {}
+        # 端口名 -> list_ports 信息（USB序列号等）；界面的监控线程会定时整体替换，
+        # 没有监控线程时在任务开始时扫描
+        self.port_info = {}
+        self.reattach_timeout = 5.0  # 原生USB设备重新枚举的最长等待时间（秒）
+        self.phase_deadlines = load_deadlines(None)  # esptool 各阶段时限
+        self.retry_limits = load_retry_limits(None)  # 各类错误的自动重试次数
+        self.retry_backoff = 1.0  # 首次重试前的等待时间（秒），之后逐次加倍
+        self.verify_policy = VerifyPolicy()  # 每台设备的校验方式
+        # 刚烧录完成的设备（原生USB芯片复位后会重新枚举），冷却期内不重复烧录
+        self.recent_devices = RecentDeviceTable()
+        self.recent_action = 'skip'  # 冷却期内再次出现时: 'skip' 跳过 / 'verify' 仅校验
+        # 按USB集线器限制并发（默认自动选择吞吐最高的并发数）
+        self.scheduler = HubScheduler(on_limit=lambda hub, old, new: self._message(
+            f"集线器 {hub} 并发上限调整为 {new}（原 {old}）"))
+        # 按端口位置统计写入速率、重试和同步次数，发现降速的端口
+        self.link_quality = LinkQualityTracker()
+        # 按端口位置、USB描述符和芯片记住成功的复位方式，下次先用
+        self.reset_strategies = ResetStrategyTable()
+        self.fixed_reset = None  # 固定使用的复位方式；None 表示自动选择
+        self.port_filter = PortFilter()  # 自动模式只处理符合条件的端口
+        self.profiles = ProfileRouter()  # 按芯片型号选择固件（混线生产）
+        self.images = ImageCache()  # 固件镜像头的解析结果，写入前对照芯片检查
+        self.digests = DigestCache()  # 镜像 MD5（快速校验模式与设备端 MD5 比较）
+        self.image_check = True
+        self._setup_metrics(metrics or StationMetrics('engine'))
+        # 跨进程的端口租约，其他工具实例正在处理的端口不再启动任务
+        self.leases = PortLeases(self.metrics.tool)
+
+    def _setup_metrics(self, metrics):
+        self.metrics = metrics
+        self.m_jobs = metrics.counter('esp32_jobs_total', 'Flash jobs by result', ('result',))
+        self.m_job_seconds = metrics.histogram(
+            'esp32_job_duration_seconds', 'Flash job duration from start to finish', ('result',))
+        self.m_phase_seconds = metrics.histogram(
+            'esp32_phase_duration_seconds', 'esptool phase duration per invocation', ('phase',))
+        self.m_bytes_written = metrics.counter('esp32_bytes_written_total', 'Firmware bytes written (uncompressed)')
+        self.m_retries = metrics.counter('esp32_retries_total', 'Automatic retries by error category', ('category',))
+        metrics.gauge('esp32_hub_concurrency_limit', 'Concurrent jobs allowed per USB hub',
+                      lambda: {(hub['hub'],): hub['limit'] for hub in self.scheduler.snapshot()
+                               if hub['limit'] is not None}, ('hub',))
+        metrics.gauge('esp32_link_kbps', 'Median effective write rate of recent jobs per port location',
+                      lambda: {(link['location'],): link['kbps'] for link in self.link_quality.summary()
+                               if link['kbps'] is not None}, ('location',))
+        metrics.gauge('esp32_link_degraded', 'Port location flagged for degraded link quality (1) or normal (0)',
+                      lambda: {(link['location'],): int(bool(link['issues'])) for link in self.link_quality.summary()},
+                      ('location',))
+        metrics.gauge('esp32_hub_write_kbps', 'Aggregate effective write rate per USB hub (last 30 s)',
+                      lambda: {(hub['hub'],): hub['kbps'] for hub in self.scheduler.snapshot()}, ('hub',))
+
+    def configure(self, config):
+        """按 config.json 设置冷却、重新枚举、看门狗、重试和校验参数"""
+        self.recent_devices.cooldown = float(config.get('recent_cooldown', 60))
+        self.recent_action = config.get('recent_action', 'skip')
+        self.reattach_timeout = float(config.get('reattach_timeout', 5))
+        self.phase_deadlines = load_deadlines(config.get('phase_deadlines'))
+        self.retry_limits = load_retry_limits(config.get('retry_limits'))
+        self.retry_backoff = float(config.get('retry_backoff', 1))
+        self.verify_policy = VerifyPolicy(
+            mode_from_label(config.get('verify_mode', HASH)),
+            config.get('verify_sample_every', 10),
+            config.get('verify_sample_sectors', 4)
+        )
+        self.scheduler.configure(config.get('hub_concurrency', AUTO),
+                                 config.get('hub_concurrency_start', 4),
+                                 config.get('hub_concurrency_max', 16))
+        path = config.get('link_quality_file', 'link_quality.json')
+        if path != self.link_quality.path:
+            try:
+                self.link_quality.load(path)
+            except (OSError, ValueError) as e:
+                self._message(f"读取链路质量记录失败: {str(e)}")
+        self.port_filter = PortFilter.from_config(config.get('port_filter'))
+        try:
+            profiles = self.profiles.load(config.get('firmware_profiles'))
+        except ValueError as e:
+            self._message(f"固件配置无效: {str(e)}")
+            profiles = self.profiles.load(None)
+        if profiles:
+            for profile in profiles:
+                self._message(f"固件配置: {profile.describe()}")
+            # 后台预读所有固件，尽早发现缺失的文件和与配置的芯片不符的镜像
+            threading.Thread(target=self._precache_profiles, name="预读固件", daemon=True).start()
+        self.image_check = bool(config.get('image_check', True))
+        self.leases.enabled = bool(config.get('port_lease', True))
+        if config.get('port_lease_dir'):
+            self.leases.directory = config['port_lease_dir']
+        reset = config.get('reset_strategy', 'auto')
+        self.fixed_reset = reset if reset in STRATEGY_LABELS else None
+        path = config.get('reset_strategy_file', 'reset_strategies.json')
+        if path != self.reset_strategies.path:
+            try:
+                self.reset_strategies.load(path)
+            except (OSError, ValueError) as e:
+                self._message(f"读取复位方式记录失败: {str(e)}")
+
+    # ---- 固件镜像检查 ----
+
+    def inspect_firmwares(self, firmwares, chip=None, revision=None, flash_size=None, log=None):
+        """解析固件的镜像头（每个文件只解析一次），返回结构错误和与芯片不符的说明
+
+        加载固件时只给出 chip（或不给），任务中检测到芯片后再带上芯片版本和 Flash 容量检查一次。
+        关闭 image_check 时不检查。
+        """
+        problems = []
+        if not self.image_check:
+            return problems
+        for path, address in firmwares:
+            try:
+                firmware = self.images.inspect(path)
+            except OSError as e:
+                problems.append(f"{path} 无法读取 ({e.strerror or e})")
+                continue
+            for problem in check_target(firmware, address, chip, revision, flash_size):
+                problems.append(f"{os.path.basename(path)}: {problem}")
+        if log:
+            for problem in problems:
+                log(f"固件镜像检查: {problem}")
+        return problems
+
+    def _precache_profiles(self):
+        self.profiles.precache(self._message)
+        for profile in list(self.profiles.profiles):
+            self.inspect_firmwares(profile.firmwares, profile.chip,
+                                   log=lambda line, name=profile.name: self._message(f"固件配置 {name}: {line}"))
+
+    def _needs_flash_info(self, firmwares):
+        """检测芯片时是否需要同时读取 Flash 容量（按容量选择固件配置，或需要检查引导程序头）"""
+        if self.profiles.needs_flash_size:
+            return True
+        if not self.image_check:
+            return False
+        candidates = list(firmwares)
+        for profile in list(self.profiles.profiles):
+            candidates.extend(profile.firmwares)
+        return self.images.has_bootloader(candidates)
+
+    # ---- 提交任务 ----
+
+    def submit(self, port, firmwares, options=None, auto=False):
+        """在新线程中烧录 port，立即返回 FlashJob"""
+        job = FlashJob(self, port, firmwares, options or FlashOptions(), auto)
+        threading.Thread(target=self.run_job, args=(job,), name=f"烧录 {port}", daemon=True).start()
+        return job
+
+    def flash(self, port, firmwares, options=None, auto=False):
+        """在当前线程中烧录 port，结束后返回 FlashJob"""
+        job = FlashJob(self, port, firmwares, options or FlashOptions(), auto)
+        self.run_job(job)
+        return job
+
+    def flash_all(self, ports, firmwares, options=None, timeout=None):
+        """并行烧录多个端口并等待全部结束"""
+        jobs = [self.submit(port, firmwares, options) for port in ports]
+        for job in jobs:
+            job.wait(timeout)
+        return jobs
+
+    async def flash_all_async(self, ports, firmwares, options=None):
+        """flash_all 的 asyncio 版本"""
+        jobs = [self.submit(port, firmwares, options) for port in ports]
+        return list(await asyncio.gather(*jobs))
+
+    def erase(self, port, baud=921600, log=None):
+        """擦除整片Flash（在当前线程中运行），失败时抛出异常"""
+        log = log or (lambda line: None)
+        if not self.leases.acquire(port):
+            raise RuntimeError(f"端口 {port} 正被 {describe_holder(self.leases.holder(port))} 使用")
+        try:
+            args = ["--port", port, "--baud", str(baud), "erase_flash"]
+            log(f"执行命令: esptool {' '.join(args)}")
+            self._run_esptool(args, log)
+        finally:
+            self.leases.release(port)
+
+    # ---- 停止任务和端口变化 ----
+
+    def stop(self, port=None):
+        """停止烧录（port 可以是端口名或设备标识，None 表示停止所有任务）"""
+        if port is None:
+            for session in list(self.sessions.values()):
+                self._cancel_session(session)
+            return
+
+        session = self.find_session(port)
+        if session:
+            self._cancel_session(session)
+        else:
+            self.release_port(port)
+
+    def port_lost(self, port):
+        """端口消失：原生USB设备先等待重新枚举，其余设备立即终止任务；返回受影响的会话"""
+        session = self.session_on_port(port)
+        if session is None:
+            return None
+        if session.follows_reenumeration and self.reattach_timeout > 0:
+            self._message(f"端口 {session.port} 断开，等待设备重新枚举 (最长 {self.reattach_timeout:g} 秒)...")
+            session.detach()
+            # 立即结束旧端口上的 esptool，由工作线程在新端口上重做当前步骤
+            self._terminate_process(session)
+            timer = threading.Timer(self.reattach_timeout, self._check_reattached, args=(session,))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.abort_removed_session(session)
+        return session
+
+    def port_appeared(self, port):
+        """新端口属于进行中的任务（重新枚举）时交还给原任务并返回会话，否则返回 None"""
+        session = self.sessions.get(self.device_key(port))
+        if session is None:
+            return None
+        if session.port != port or session.detached:
+            self._message(f"设备 {session.key} 重新枚举为 {port}，继续原任务")
+            session.attach(port)
+            self._notify(self.on_reattached, session.key, port)
+        return session
+
+    def _check_reattached(self, session):
+        if self.sessions.get(session.key) is session and session.detached:
+            self.abort_removed_session(session)
+
+    def abort_removed_session(self, session):
+        """设备被拔出：立即终止任务并释放任务槽，重新插入的设备可马上开始新任务"""
+        session.removed_phase = session.phase
+        self._message(f"端口 {session.port} 已拔出，终止当前任务 (阶段: {session.phase})")
+        if self.sessions.get(session.key) is session:
+            del self.sessions[session.key]
+        # 端口已不存在，无需再打开串口复位控制线
+        self._cancel_session(session, release=False)
+
+    def _cancel_session(self, session, release=True):
+        """设置取消标志并结束该任务正在运行的 esptool 进程"""
+        session.cancel_event.set()
+        self._terminate_process(session)
+        if release:
+            try:
+                self.release_port(session.port)
+            except Exception:
+                pass
+
+    def _terminate_process(self, session):
+        self.kill_process(session.process)
+
+    def kill_process(self, proc):
+        try:
+            if proc and proc.poll() is None:
+                if os.name == "nt":
+                    subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                else:
+                    proc.terminate()
+        except Exception:
+            pass
+
+    def release_port(self, port):
+        """拉低 DTR/RTS，让停止后的板子正常运行"""
+        if self.leases.holder(port) is not None:
+            # 端口正被其他工具实例使用，不能打开
+            return
+        try:
+            s = serial.Serial(port=port, baudrate=115200, timeout=0)
+            try:
+                s.dtr = False
+                s.rts = False
+            except Exception:
+                pass
+            s.close()
+        except Exception:
+            pass
+
+    # ---- 端口和会话查询 ----
+
+    def refresh_ports(self):
+        """重新扫描串口，返回端口名集合"""
+        try:
+            self.port_info = {port.device: port for port in list_ports.comports()}
+        except Exception:
+            pass
+        return set(self.port_info)
+
+    def filter_new_ports(self, ports):
+        """自动模式：去掉不符合 port_filter 的端口（在日志中提示），返回目标端口列表"""
+        accepted, ignored = self.port_filter.split(ports, self.port_info)
+        for port, reason in ignored.items():
+            self._message(f"端口 {port} 不是目标设备，自动模式忽略（{reason}）")
+        return accepted
+
+    def usb_serial(self, port):
+        """端口上乐鑫原生USB设备的序列号（用于识别重新枚举的同一块板子）；
+        USB转串口芯片的序列号可能重复，返回None，只按 MAC 识别"""
+        return native_usb_serial(self.port_info.get(port))
+
+    def hub_of(self, port):
+        """端口所在的USB集线器（按USB位置推算）"""
+        return hub_of(getattr(self.port_info.get(port), 'location', None))
+
+    def device_key(self, port):
+        """端口上设备的稳定标识"""
+        info = self.port_info.get(port)
+        return device_key(info) if info else port
+
+    def session_on_port(self, port):
+        for session in list(self.sessions.values()):
+            if session.port == port:
+                return session
+        return None
+
+    def find_session(self, port_or_key):
+        return self.sessions.get(port_or_key) or self.session_on_port(port_or_key)
+
+    def _list_port_names(self):
+        try:
+            return set(p.device for p in list_ports.comports())
+        except Exception:
+            return set()
+
+    # ---- 回调 ----
+
+    def _notify(self, callback, *args):
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception:
+            # 回调出错不能影响任务；sys.stderr 可能已被重定向到日志，这里写到原始 stderr
+            try:
+                traceback.print_exc(file=sys.__stderr__)
+            except Exception:
+                pass
+
+    def _message(self, text):
+        self._notify(self.on_message, text)
+
+    def _set_phase(self, job, phase):
+        """记录任务当前的烧录阶段"""
+        session = job.session
+        now = time.monotonic()
+        self.tracer.complete(session.phase, session.key, session.phase_started, now, CAT_JOB)
+        session.phase = phase
+        session.phase_started = now
+        self._notify(self.on_phase, job, phase)
+
+    def _learn_reset(self, job):
+        """记录本次任务中各复位方式的同步结果"""
+        session = job.session
+        chip = job.chip if session.connected else None
+        try:
+            for strategy in session.reset_failed:
+                self.reset_strategies.record(job.location, job.descriptor, chip, strategy, False)
+            if session.connected:
+                self.reset_strategies.record(job.location, job.descriptor, chip, session.reset, True)
+            elif getattr(job.error, 'category', None) == SYNC:
+                self.reset_strategies.record(job.location, job.descriptor, chip, session.reset, False)
+        except Exception as e:
+            self._message(f"复位方式记录失败: {str(e)}")
+
+    def _record_link(self, job):
+        """计入链路质量统计，位置出现或解除问题时发出消息"""
+        session = job.session
+        try:
+            issues, changed = self.link_quality.add(job.location, session.port, job.chip, job.options.baud,
+                                                    session.write_kbps, session.retries, session.sync_attempts)
+        except Exception as e:
+            self._message(f"链路质量统计失败: {str(e)}")
+            return
+        if not changed:
+            return
+        if issues:
+            self._message(f"⚠ 端口位置 {job.location} ({session.port}) 链路质量下降: {'；'.join(issues)}")
+        else:
+            self._message(f"端口位置 {job.location} ({session.port}) 链路质量已恢复正常")
+
+    def _record(self, job, success, note):
+        job.success = success
+        job.note = note
+        job.cycle_time = time.monotonic() - job.started
+        self._notify(self.on_record, job)
+
+    # ---- 任务流程 ----
+
+    def run_job(self, job):
+        """在当前线程中执行任务（submit 的线程入口）"""
+        if job.port not in self.port_info:
+            self.refresh_ports()
+        session = FlashSession(self.device_key(job.port), job.port)
+        # 同一设备已有任务在进行（例如重新枚举后的端口又被当作新设备）
+        if self.sessions.setdefault(session.key, session) is not session:
+            self._message(f"端口 {job.port} 的设备已有烧录任务在进行，跳过")
+            job.result = BUSY
+            job.future.set_result(job)
+            return
+        # 其他工具实例（MAC读取工具、另一个烧录工具）已在处理这个端口
+        if not self.leases.acquire(job.port):
+            del self.sessions[session.key]
+            job.holder = describe_holder(self.leases.holder(job.port))
+            job.note = f"端口正被 {job.holder} 使用"
+            self._message(f"端口 {job.port} 正被 {job.holder} 使用，跳过")
+            job.result = BUSY
+            job.future.set_result(job)
+            return
+        session.leases.append(job.port)
+        job.session = session
+        job.started = session.phase_started
+        job.usb_serial = self.usb_serial(job.port)
+        job.hub = session.hub = self.hub_of(job.port)
+        job.location = location_key(getattr(self.port_info.get(job.port), 'location', None), job.port)
+        job.descriptor = descriptor_of(self.port_info.get(job.port))
+        if self.fixed_reset:
+            session.reset_candidates = [self.fixed_reset]
+        else:
+            session.reset_candidates = self.reset_strategies.order(job.location, job.descriptor)
+        session.reset = session.reset_candidates[0]
+        self._notify(self.on_job_started, job)
+        try:
+            self._run_job(job)
+        finally:
+            # 设备拔出后任务槽可能已被释放并分配给重新插入的设备，只清理属于本任务的条目
+            if self.sessions.get(session.key) is session:
+                del self.sessions[session.key]
+            for port in session.leases:
+                self.leases.release(port)
+            if job._hub_slot:
+                self.scheduler.release(job.hub)
+            if job.result in (SUCCESS, VERIFIED, FAIL):
+                self._record_link(job)
+            if not self.fixed_reset and job.result in (SUCCESS, VERIFIED, FAIL, SKIPPED):
+                self._learn_reset(job)
+            seconds = time.monotonic() - job.started
+            if job.result:
+                self.m_jobs.inc(result=job.result)
+                self.m_job_seconds.observe(seconds, result=job.result)
+            if self.tracer.enabled:
+                self._set_phase(job, "结束")
+                self.tracer.complete(f"烧录 {job.port}", session.key, job.started, session.phase_started, CAT_JOB,
+                                     {'chip': job.chip, 'mac': job.mac, 'retries': session.retries})
+            self._notify(self.on_job_finished, job)
+            job.future.set_result(job)
+
+    def _run_job(self, job):
+        session = job.session
+        options = job.options
+        firmwares = job.firmwares
+        cancel_event = session.cancel_event
+
+        def log(line):
+            self._notify(self.on_log, job, line)
+
+        log(f"开始为端口 {job.port} 烧录固件...")
+        self._message(f"开始为端口 {job.port} 烧录固件...")
+
+        try:
+            if cancel_event.is_set():
+                raise Exception("cancelled")
+
+            # 集线器上的任务数已达上限时排队
+            def wait_for_hub(limit):
+                self._set_phase(job, "等待集线器")
+                log(f"集线器 {job.hub} 已有 {limit} 个任务在进行，排队等待...")
+
+            if not self.scheduler.acquire(job.hub, cancel_event, wait_for_hub):
+                raise Exception("cancelled")
+            job._hub_slot = True
+
+            self._set_phase(job, "检测芯片")
+            log(f"检测芯片类型（{STRATEGY_LABELS.get(session.reset, session.reset)}）...")
+            if session.reset == NO_RESET:
+                log("不复位时需手动进入下载模式：按住 BOOT 键再按一下 RESET/EN 键")
+            # 需要 Flash 容量时（按容量选择固件配置、检查引导程序头），检测芯片的同时读取 Flash 信息（同样输出 MAC）
+            # 命令名用下划线写法，esptool v4 和 v5 都接受
+            detect = "flash_id" if self._needs_flash_info(firmwares) else "read_mac"
+            result = self._run_step(session, lambda p: ["--port", p, "--before", session.reset, detect], log)
+            session.connected = True
+
+            job.chip = result.chip
+            job.flash_size = result.flash_size
+            if not job.chip:
+                log("警告: 未能自动识别芯片类型，将使用通用参数")
+                job.chip = "ESP32"
+
+            log(f"检测到芯片类型: {job.chip}")
+
+            if result.mac:
+                job.mac = result.mac
+                log(f"MAC地址: {job.mac}")
+
+            # 自动烧录时，冷却期内刚完成的设备不再重复烧录
+            if job.auto and self.recent_devices.is_recent(mac=job.mac, usb_serial=job.usb_serial):
+                if self.recent_action == 'verify':
+                    job.verify_only = True
+                    log(f"设备 {job.mac} 刚烧录完成，本次仅校验固件")
+                else:
+                    log(f"设备 {job.mac} 刚烧录完成（复位后重新枚举），跳过烧录")
+                    self._message(f"端口 {job.port} 设备 {job.mac} 刚烧录完成，跳过")
+                    job.result = SKIPPED
+                    return
+
+            # 混线生产：按芯片型号（及 Flash 容量、USB描述符）选择固件配置
+            profile = self.profiles.select(job.chip, result.flash_size, job.descriptor)
+            if profile is not None:
+                for path in self.profiles.check(profile):
+                    log(f"固件 {path} 在加载配置后已被修改，使用新内容")
+                job.profile = profile.name
+                firmwares = job.firmwares = list(profile.firmwares)
+                log(f"使用固件配置: {profile.describe()}")
+            elif not firmwares:
+                log(f"没有匹配芯片 {job.chip} 的固件配置")
+                self._record(job, False, f"没有匹配芯片 {job.chip} 的固件配置")
+                job.result = FAIL
+                return
+
+            # 写入任何数据之前，对照检测到的芯片检查固件镜像头（未识别出芯片时只检查镜像结构）
+            if self.image_check:
+                problems = self.inspect_firmwares(firmwares, result.chip, result.revision, result.flash_size, log)
+                if problems:
+                    self._record(job, False, f"固件镜像与芯片不符: {problems[0]}")
+                    job.result = FAIL
+                    return
+                log(f"固件镜像检查通过（{job.chip}{' ' + result.revision if result.revision else ''}）")
+
+            verify_only = job.verify_only
+            session.baud = options.baud
+            if options.erase and not verify_only:
+                self._set_phase(job, "擦除Flash")
+                log("正在擦除Flash...")
+                self._run_step(session, lambda p: [
+                    "--port", p,
+                    "--baud", str(session.baud),
+                    "--before", session.reset,
+                    "erase_flash"
+                ], log)
+                log("Flash擦除完成!")
+
+            for index, (firmware, address) in enumerate(firmwares, 1):
+                if cancel_event.is_set():
+                    raise Exception("cancelled")
+                self._set_phase(job, f"{'校验' if verify_only else '写入'}固件 {index}/{len(firmwares)}")
+                self._write_firmware(session, firmware, address, options, verify_only, log)
+                log(f"端口 {session.port} 固件 {firmware} {'校验' if verify_only else '烧录'}完成!")
+
+            if not verify_only:
+                # 写入时 esptool 已做过 MD5 校验，回读模式在此基础上再逐字节比较
+                verify_mode = self.verify_policy.next_unit()
+                verify_time = session.phase_times.get('verify', 0.0)
+                started = time.monotonic()
+                if verify_mode == HASH:
+                    self._set_phase(job, "MD5校验")
+                    self._md5_verify(session, firmwares, log)
+                else:
+                    self._set_phase(job, "回读校验")
+                    self._readback_verify(session, firmwares, verify_mode, log)
+                verify_time += time.monotonic() - started
+                job.verify = (MODE_LABELS[verify_mode], verify_time)
+                log(f"校验方式: {job.verify[0]}，耗时 {verify_time:.1f} 秒")
+
+            log(f"端口 {session.port} 所有固件{'校验' if verify_only else '烧录'}完成!")
+            self.recent_devices.mark(mac=job.mac, usb_serial=job.usb_serial)
+            note = "仅校验（冷却期内重复设备）" if verify_only else ""
+            if job.profile:
+                note = f"{note} 固件配置 {job.profile}".strip()
+            if session.retries:
+                note = f"{note} 自动重试{session.retries}次".strip()
+            self._record(job, True, note)
+            job.result = VERIFIED if verify_only else SUCCESS
+
+        except Exception as e:
+            job.error = e
+            error_msg = str(e)
+            port = session.port
+            if session.removed_phase is not None:
+                phase = session.removed_phase
+                log(f"端口 {port} 设备已移除，任务终止 (阶段: {phase})")
+                self._record(job, False, f"设备已移除 (阶段: {phase})")
+                job.result = REMOVED
+            elif "cancelled" in error_msg.lower() or error_msg == "cancelled":
+                log(f"端口 {port} 已停止烧录")
+                self._message(f"端口 {port} 已停止烧录")
+                self.release_port(port)
+                job.result = CANCELLED
+            else:
+                error_msg = describe_error(e)
+                log(f"端口 {port} 烧录错误: {error_msg}")
+                self._message(f"错误: {error_msg}")
+                self._record(job, False, error_msg)
+                job.result = FAIL
+
+    def _write_firmware(self, session, firmware, address, options, verify_only, log):
+        """写入（或仅校验）一个固件；写入中断后从失败位置续写"""
+        # 当前要写入的起始地址和镜像；写入中断后改为从失败位置续写的片段
+        state = {'address': address, 'image': firmware}
+
+        def make_flash_args(p):
+            flash_args = [
+                "--port", p,
+                "--baud", str(session.baud),
+                "--before", session.reset,
+                "--after", "hard_reset"
+            ]
+            if options.flash_mode != 'keep':
+                flash_args.extend(["--flash_mode", options.flash_mode])
+            if options.flash_freq != 'keep':
+                flash_args.extend(["--flash_freq", options.flash_freq])
+            flash_args.extend(["verify_flash" if verify_only else "write_flash", state['address'], state['image']])
+            log(f"执行命令: esptool {' '.join(flash_args)}")
+            return flash_args
+
+        def resume_from_failure(category, exc):
+            if verify_only:
+                return
+            if state['image'] != firmware:
+                self._remove_temp(state['image'])
+            state['address'], state['image'] = address, firmware
+            if category == VERIFY:
+                # 写入完成但内容不一致，整段重写
+                return
+            try:
+                base = int(address, 0)
+                size = os.path.getsize(firmware)
+                parsed = getattr(exc, 'parsed', None)
+                resume = resume_address(parsed.write_address if parsed else None, base, size)
+                if resume is None:
+                    return
+                state['image'] = self._slice_firmware(firmware, resume - base)
+                state['address'] = hex(resume)
+                log(f"从 {state['address']} 续写，跳过已写入的 {(resume - base) // 1024} KB")
+            except Exception as e:
+                log(f"无法续写，将重写整段: {str(e)}")
+
+        try:
+            self._run_step(session, make_flash_args, log, on_retry=resume_from_failure)
+            if state['image'] != firmware:
+                # 续写只校验了后半部分，整段再校验一次
+                self._remove_temp(state['image'])
+                state['address'], state['image'] = address, firmware
+                log("续写完成，校验整段固件...")
+                self._run_step(session, lambda p: [
+                    "--port", p, "--baud", str(session.baud),
+                    "--before", session.reset, "--after", "hard_reset",
+                    "verify_flash", address, firmware
+                ], log)
+        finally:
+            if state['image'] != firmware:
+                self._remove_temp(state['image'])
+
+    def _md5_verify(self, session, firmwares, log):
+        """全部写入后由设备计算各区域的 MD5（一次连接），与缓存的镜像 MD5 比较"""
+        regions = [(firmware, int(address, 0), os.path.getsize(firmware)) for firmware, address in firmwares]
+        regions = [region for region in regions if region[2]]
+        if not regions:
+            return
+        digests = {}
+
+        def capture(line):
+            result = flash_md5.parse_line(line)
+            if result:
+                digests[result[0]] = result[2]
+            log(line)
+
+        self._run_step(session, lambda p: [
+            "--port", p, "--baud", str(session.baud), "--before", session.reset
+        ] + [f"0x{base:x}:{size}" for _, base, size in regions], capture,
+            program=flash_md5_command())
+        for firmware, base, size in regions:
+            expected = self.digests.md5(firmware)
+            if digests.get(base) != expected:
+                raise RuntimeError(f"MD5校验不一致: {os.path.basename(firmware)} @ 0x{base:x} "
+                                   f"设备 {digests.get(base, '无结果')}，镜像 {expected}")
+        log(f"设备端 MD5 校验通过（{len(regions)} 个区域）")
+
+    def _readback_verify(self, session, firmwares, mode, log):
+        """回读Flash并与镜像逐字节比较（全量或抽检扇区）"""
+        regions = readback_regions(firmwares, mode, self.verify_policy.sample_sectors)
+        log(f"{MODE_LABELS[mode]}: 回读 {len(regions)} 个区域...")
+        for firmware, address, offset, length in regions:
+            fd, path = tempfile.mkstemp(prefix="readback_", suffix=".bin")
+            os.close(fd)
+            try:
+                self._run_step(session, lambda p: [
+                    "--port", p, "--baud", str(session.baud),
+                    "--before", session.reset, "--after", "hard_reset",
+                    "read_flash", hex(address), hex(length), path
+                ], log)
+                with open(path, 'rb') as f:
+                    data = f.read()
+            finally:
+                self._remove_temp(path)
+            mismatch = compare_region(firmware, offset, length, data)
+            if mismatch is not None:
+                raise RuntimeError(f"回读校验不一致: {os.path.basename(firmware)} 偏移 0x{mismatch:x}")
+        log("回读校验通过")
+
+    # ---- esptool 调用 ----
+
+    def _run_esptool(self, args, log, session=None, program=None):
+        """运行 esptool 子进程，逐行解析输出，返回 EsptoolOutputParser
+
+        program 为替代 esptool 的命令前缀（如设备端 MD5 校验 flash_md5_command()），输出格式与 esptool 相同。
+        """
+        parser = EsptoolOutputParser()
+        cancel_event = session.cancel_event if session else None
+
+        cmd = list(program or esptool_command()) + list(args)
+        creationflags = 0
+        if os.name == "nt":
+            try:
+                creationflags = subprocess.CREATE_NO_WINDOW
+            except Exception:
+                creationflags = 0
+
+        # 不用文本模式：输出按块读取，退格处也要切分（见 _pump_output）
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=0,
+            creationflags=creationflags
+        )
+
+        if session:
+            session.process = proc
+
+        # 输出由后台线程读取，本线程在等待输出的同时检查取消标志和阶段时限
+        output = queue.SimpleQueue()
+        threading.Thread(target=self._pump_output, args=(proc, output),
+                         name=f"esptool输出 {threading.current_thread().name}", daemon=True).start()
+        on_phase = None
+        if self.tracer.enabled:
+            track = session.key if session else args[1] if len(args) > 1 else "esptool"
+            started = self.tracer.now()
+            on_phase = lambda phase, start, end: self.tracer.complete(
+                PHASE_LABELS.get(phase, phase), track, start, end, CAT_PHASE)
+        reading = any(arg in ('read_flash', 'read-flash') for arg in args)
+        watchdog = PhaseWatchdog(self.phase_deadlines, on_phase=on_phase, reading=reading)
+
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise RuntimeError("cancelled")
+
+                try:
+                    item = output.get(timeout=0.1)
+                except queue.Empty:
+                    item = ""
+                if item is None:
+                    break
+
+                if item:
+                    text_line, complete = item
+                    for fact in parser.feed(text_line):
+                        if fact.kind == WROTE:
+                            self.m_bytes_written.inc(fact.value.size)
+                            if session:
+                                session.write_kbps.append(fact.value.kbps)
+                                self.scheduler.record(session.hub, fact.value)
+                    # v4 回读进度的片段只用于看门狗计时，不写日志（最后一条带换行，照常写入）
+                    if complete:
+                        log(text_line)
+                    watchdog.feed(text_line)
+
+                expired = watchdog.expired()
+                if expired:
+                    self.kill_process(proc)
+                    label = PHASE_LABELS.get(expired, expired)
+                    if watchdog.stalled:
+                        log(f"看门狗: {label}阶段 {watchdog.limit:.0f} 秒没有进度，终止 esptool")
+                    else:
+                        log(f"看门狗: {label}阶段超过 {watchdog.limit:.0f} 秒，终止 esptool")
+                    timeout = WatchdogTimeout(expired, watchdog.limit)
+                    timeout.output = parser.text()
+                    timeout.parsed = parser
+                    raise timeout
+
+            rc = proc.wait()
+            # 进程被 stop() 终止时，按取消处理而不是普通失败
+            if cancel_event is not None and cancel_event.is_set():
+                raise RuntimeError("cancelled")
+            if rc != 0:
+                raise EsptoolError(f"esptool exited with code {rc}", parser.text(), parser)
+        finally:
+            durations = watchdog.finish()
+            if on_phase:
+                self.tracer.complete(_esptool_command(args), track, started, self.tracer.now(),
+                                     args={'rc': proc.poll()})
+            if session:
+                session.sync_attempts += parser.sync_attempts
+            for phase, seconds in durations.items():
+                self.m_phase_seconds.observe(seconds, phase=phase)
+                if session:
+                    session.phase_times[phase] = session.phase_times.get(phase, 0.0) + seconds
+            if session and session.process is proc:
+                session.process = None
+            try:
+                if proc.stdout:
+                    proc.stdout.close()
+            except Exception:
+                pass
+
+        return parser
+
+    def _pump_output(self, proc, output):
+        """后台读取 esptool 输出，逐段放入 (文本, 是否为完整的行)，结束时放入 None
+
+        按块读取而不是按行读取：v4 的回读进度以退格覆盖同一行，按行读取要等回读结束才能拿到，
+        看门狗会把整个回读当作没有进度。
+        """
+        decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))('replace')
+        splitter = OutputSplitter()
+        try:
+            while True:
+                chunk = proc.stdout.read(4096)
+                if not chunk:
+                    break
+                for piece in splitter.feed(decoder.decode(chunk)):
+                    output.put(piece)
+        except Exception:
+            pass
+        for piece in splitter.feed(decoder.decode(b'', final=True)) + splitter.close():
+            output.put(piece)
+        output.put(None)
+
+    def _run_session_step(self, session, make_args, log, program=None):
+        """运行一个 esptool 步骤
+
+        make_args(port) 根据当前端口名生成参数。原生USB设备在步骤中途重新枚举时，
+        等待它以新端口名出现后只重做这一步，而不是整个任务从头开始。
+        """
+        reattach_count = 0
+        while True:
+            port = session.port
+            # 重新枚举后的新端口名也要占用，避免被其他工具实例当作新设备
+            if port not in session.leases:
+                if not self.leases.acquire(port):
+                    raise RuntimeError(f"端口 {port} 正被 {describe_holder(self.leases.holder(port))} 使用")
+                session.leases.append(port)
+            try:
+                return self._run_esptool(make_args(port), log, session=session, program=program)
+            except RuntimeError:
+                if (session.cancel_event.is_set() or not session.follows_reenumeration
+                        or reattach_count >= 3):
+                    raise
+                # 端口仍在且未被标记断开，说明是普通失败
+                if not session.detached and port in self._list_port_names():
+                    raise
+                reattach_count += 1
+                log(f"端口 {port} 已断开，等待设备重新枚举...")
+                with self.tracer.span("等待重新枚举", session.key, CAT_WAIT):
+                    reattached = self._wait_reattach(session)
+                if not reattached:
+                    raise
+                log(f"设备已重新连接到 {session.port}，继续当前步骤")
+
+    def _run_step(self, session, make_args, log, on_retry=None, program=None):
+        """运行一个 esptool 步骤，偶发性错误按类别退避重试
+
+        on_retry(category, exc) 在每次重试前调用，可据此调整下一次的参数（例如续写位置）。
+        """
+        attempts = {}
+        while True:
+            try:
+                return self._run_session_step(session, make_args, log, program)
+            except RuntimeError as e:
+                if session.cancel_event.is_set() or session.removed_phase is not None:
+                    raise
+                category = classify_error(e)
+                if category == SYNC and self._next_reset(session, log):
+                    continue
+                e.category = category
+                e.retries = session.retries
+                used = attempts.get(category, 0)
+                if used >= self.retry_limits.get(category, 0):
+                    raise
+                attempts[category] = used + 1
+                session.retries += 1
+                self.m_retries.inc(category=category)
+
+                if category == LINK and session.baud and session.baud > 115200:
+                    session.baud = max(115200, session.baud // 2)
+                    log(f"通信不稳定，波特率降至 {session.baud}")
+                delay = backoff_delay(self.retry_backoff, attempts[category])
+                log(f"{describe_error(e)}，{delay:g} 秒后重试 ({attempts[category]}/{self.retry_limits[category]})")
+                if on_retry:
+                    on_retry(category, e)
+                with self.tracer.span("重试等待", session.key, CAT_WAIT, {'category': category}):
+                    cancelled = session.cancel_event.wait(delay)
+                if cancelled:
+                    raise RuntimeError("cancelled")
+
+    def _next_reset(self, session, log):
+        """同步失败后换用下一种未失败过的复位方式，没有可换的返回 False"""
+        remaining = [s for s in session.reset_candidates
+                     if s != session.reset and s not in session.reset_failed]
+        if not remaining:
+            return False
+        if session.reset not in session.reset_failed:
+            session.reset_failed.append(session.reset)
+        previous, session.reset = session.reset, remaining[0]
+        log(f"{STRATEGY_LABELS.get(previous, previous)}未能同步，改用{STRATEGY_LABELS[session.reset]}重试")
+        return True
+
+    def _slice_firmware(self, firmware, offset):
+        """把固件从 offset 起的部分写入临时文件，用于续写"""
+        with open(firmware, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        fd, path = tempfile.mkstemp(prefix="resume_", suffix=".bin")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _remove_temp(self, path):
+        try:
+            os.remove(path)
+        except Exception:
+            pass
+
+    def _wait_reattach(self, session):
+        """等待会话对应的设备重新出现（监控线程或本线程发现均可）"""
+        deadline = time.monotonic() + self.reattach_timeout
+        while time.monotonic() < deadline and not session.cancel_event.is_set():
+            if not session.detached and session.port in self._list_port_names():
+                return True
+            port = find_port(session.key, list_ports.comports())
+            if port:
+                session.attach(port)
+                self._notify(self.on_reattached, session.key, port)
+                return True
+            session.wait_attached(0.3)
+        return False
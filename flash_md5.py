@@ -0,0 +1,75 @@
+"""设备端 MD5 校验（快速校验模式）
+
+烧录引擎在全部固件写入后运行本模块：一次连接中让设备（stub 的 SPI_FLASH_MD5 命令）
+计算每个区域的 MD5，逐行输出
+
+    Flash MD5 0x00010000 409600 0123456789abcdef0123456789abcdef
+
+由引擎与缓存的镜像 MD5 比较。与 esptool 一样以子进程方式运行，可被看门狗终止、随任务取消：
+
+    python flash_md5.py --port COM3 --baud 921600 --before default_reset 0x10000:409600 0x8000:3072
+"""
+import argparse
+import re
+import sys
+
+_LINE = re.compile(r'^Flash MD5 (0x[0-9a-fA-F]+) (\d+) ([0-9a-f]{32})$')
+_INITIAL_BAUD = 115200
+
+
+def format_line(address, size, digest):
+    return f"Flash MD5 0x{address:08x} {size} {digest}"
+
+
+def parse_line(line):
+    """解析输出行，返回 (地址, 长度, MD5)；不是结果行返回 None"""
+    match = _LINE.match(line.strip())
+    if not match:
+        return None
+    return int(match.group(1), 16), int(match.group(2)), match.group(3)
+
+
+def _region(text):
+    address, _, size = text.partition(':')
+    return int(address, 0), int(size, 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='flash_md5', description='设备端计算 Flash 区域的 MD5')
+    parser.add_argument('--port', required=True)
+    parser.add_argument('--baud', type=int, default=_INITIAL_BAUD)
+    parser.add_argument('--before', default='default_reset')
+    parser.add_argument('regions', nargs='+', type=_region, help='地址:长度')
+    args = parser.parse_args(argv)
+
+    import esptool
+    from esptool.cmds import detect_chip
+    from esptool.util import FatalError
+
+    # esptool v5 的复位方式写作 default-reset，v4 为 default_reset
+    mode = args.before
+    if int(esptool.__version__.split('.')[0]) >= 5:
+        mode = mode.replace('_', '-')
+    esp = None
+    try:
+        esp = detect_chip(args.port, _INITIAL_BAUD, mode)
+        esp = esp.run_stub()
+        if args.baud > _INITIAL_BAUD:
+            esp.change_baud(args.baud)
+        for address, size in args.regions:
+            # 以 Verifying 开头，看门狗按校验阶段计时
+            print(f"Verifying flash MD5 at 0x{address:08x} ({size} bytes)...", flush=True)
+            print(format_line(address, size, esp.flash_md5sum(address, size)), flush=True)
+        esp.hard_reset()
+    except FatalError as e:
+        # 与 esptool 相同的格式，烧录引擎据此对错误分类和重试
+        print(f"\nA fatal error occurred: {e}", flush=True)
+        return 2
+    finally:
+        if esp is not None:
+            esp._port.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""esptool 失败分类与重试
+
+把 esptool 的失败归为几类（同步失败、串口通信/校验错误、Flash写入错误、校验不一致、
+超时、端口占用），对可能是偶发的类别按退避时间自动重试；写入中断时根据已确认写入的
+地址计算续写位置，只重写失败的那部分而不是整个镜像。
+"""
+import re
+
+# 错误类别
+SYNC = 'sync'
+LINK = 'link'
+FLASH_WRITE = 'flash_write'
+VERIFY = 'verify'
+TIMEOUT = 'timeout'
+PORT = 'port'
+OTHER = 'other'
+
+CATEGORY_LABELS = {
+    SYNC: '同步失败',
+    LINK: '通信错误',
+    FLASH_WRITE: 'Flash写入错误',
+    VERIFY: '校验不一致',
+    TIMEOUT: '超时',
+    PORT: '端口不可用',
+    OTHER: '错误',
+}
+
+# 每类错误的默认重试次数；0 表示不重试
+DEFAULT_RETRY_LIMITS = {
+    SYNC: 2,
+    LINK: 2,
+    FLASH_WRITE: 1,
+    VERIFY: 1,
+    TIMEOUT: 1,
+    PORT: 2,
+    OTHER: 0,
+}
+
+# 退避时间上限（秒）
+_MAX_BACKOFF = 10.0
+# 续写时向前多退的字节数（一个写入块），stub 对最后一块的确认早于实际写入完成
+_RESUME_MARGIN = 0x4000
+_SECTOR_SIZE = 0x1000
+
+# 按顺序匹配，先命中的类别生效
+_PATTERNS = [
+    (VERIFY, re.compile(r'MD5 of file does not match|回读校验不一致|MD5校验不一致|Verification failed|digest mismatch|does not match', re.IGNORECASE)),
+    (FLASH_WRITE, re.compile(r'Failed to (?:write|erase)|Flash write', re.IGNORECASE)),
+    (LINK, re.compile(r'Invalid head of packet|checksum|Packet content transfer stopped|Corrupt data|'
+                      r'Serial data stream stopped|Possible serial noise|Lost connection|'
+                      r'Response doesn\'t match|Invalid SLIP|chip stopped responding', re.IGNORECASE)),
+    (SYNC, re.compile(r'Failed to connect|Wrong boot mode|No serial data received|'
+                      r'Timed out waiting for packet header|Failed to start stub', re.IGNORECASE)),
+    (PORT, re.compile(r'could not open port|Access is denied|Resource busy|PermissionError|'
+                      r'No such file or directory|Could not exclusively lock port', re.IGNORECASE)),
+]
+
+_FATAL = re.compile(r'A fatal error occurred:\s*(.+)')
+
+
+class EsptoolError(RuntimeError):
+    """esptool 以非零退出码结束，携带其输出（最近若干行）和解析结果便于分类"""
+
+    def __init__(self, message, output='', parsed=None):
+        self.output = output
+        self.parsed = parsed
+        super().__init__(message)
+
+
+def fatal_message(output):
+    """esptool 输出中的致命错误说明（没有则返回 None）"""
+    matches = _FATAL.findall(output or '')
+    return matches[-1].strip() if matches else None
+
+
+def classify_error(exc):
+    """返回异常所属的错误类别"""
+    if getattr(exc, 'phase', None) is not None and hasattr(exc, 'limit'):
+        return TIMEOUT
+    output = getattr(exc, 'output', '') or ''
+    text = f"{fatal_message(output) or ''}\n{exc}"
+    for category, pattern in _PATTERNS:
+        if pattern.search(text):
+            return category
+    return OTHER
+
+
+def describe_error(exc):
+    """带类别前缀的错误说明，用于烧录记录"""
+    category = getattr(exc, 'category', None) or classify_error(exc)
+    detail = fatal_message(getattr(exc, 'output', '')) or str(exc)
+    message = f"{CATEGORY_LABELS.get(category, '错误')}: {detail}"
+    retries = getattr(exc, 'retries', 0)
+    if retries:
+        message += f" (已重试{retries}次)"
+    return message
+
+
+def load_retry_limits(config_value):
+    """合并配置中的重试次数与默认值"""
+    limits = dict(DEFAULT_RETRY_LIMITS)
+    if isinstance(config_value, dict):
+        for name, value in config_value.items():
+            if name in limits:
+                try:
+                    limits[name] = max(0, int(value))
+                except (TypeError, ValueError):
+                    pass
+    return limits
+
+
+def backoff_delay(base, attempt):
+    """第 attempt 次重试（从1开始）前的等待时间，指数增长"""
+    return min(base * (2 ** (attempt - 1)), _MAX_BACKOFF)
+
+
+def resume_address(written_at, base, size):
+    """写入中断后的续写地址
+
+    written_at 为最后一条 "Writing at 0x..." 进度中的地址（EsptoolOutputParser.write_address），
+    回退一个写入块并按扇区对齐。无法续写（尚未开始写入或已退回到起点）时返回 None。
+    """
+    if written_at is None:
+        return None
+    written = written_at - _RESUME_MARGIN
+    address = written - (written % _SECTOR_SIZE)
+    if address <= base or address >= base + size:
+        return None
+    return address
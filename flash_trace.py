@@ -0,0 +1,117 @@
+"""烧录时间线记录（Chrome trace / Perfetto 格式）
+
+记录期间，每个烧录任务的各个阶段（排队、检测芯片、连接、加载stub、擦除、每段固件写入、
+校验、复位、重试等待）和 UI 主线程的事件批处理都记为带起止时间的区间，
+导出的 JSON 可以直接拖进 chrome://tracing 或 https://ui.perfetto.dev 查看，
+每个端口一行，多路并行时可以看出任务是卡在 USB、CPU、Tk 主循环还是固定延时上。
+
+未开始记录时所有接口都是空操作，开销只有一次属性判断。
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+UI_TRACK = 'UI主线程'
+
+# 事件分类（Perfetto 中可按分类筛选）
+CAT_JOB = 'job'
+CAT_STEP = 'step'
+CAT_PHASE = 'phase'
+CAT_WAIT = 'wait'
+CAT_UI = 'ui'
+
+
+class TraceRecorder:
+    """线程安全的时间线记录器，最多保留 max_events 个事件（超出后丢弃最早的）"""
+
+    def __init__(self, max_events=200000, clock=time.monotonic):
+        self._clock = clock
+        self._events = deque(maxlen=max_events)
+        self._tracks = {UI_TRACK: 0}
+        self._lock = threading.Lock()
+        self._origin = clock()
+        self._pid = os.getpid()
+        self.enabled = False
+
+    def start(self):
+        """清空并开始记录"""
+        with self._lock:
+            self._events.clear()
+            self._tracks = {UI_TRACK: 0}
+            self._origin = self._clock()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def now(self):
+        return self._clock()
+
+    def _tid(self, track):
+        tid = self._tracks.get(track)
+        if tid is None:
+            with self._lock:
+                tid = self._tracks.setdefault(track, len(self._tracks))
+        return tid
+
+    def _us(self, t):
+        return round((t - self._origin) * 1e6)
+
+    def complete(self, name, track, start, end, category=CAT_STEP, args=None):
+        """记录一个已结束的区间，start/end 为 clock() 时间"""
+        if not self.enabled or start < self._origin:
+            return
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': self._pid, 'tid': self._tid(track),
+                 'ts': self._us(start), 'dur': max(0, self._us(end) - self._us(start))}
+        if args:
+            event['args'] = args
+        self._events.append(event)
+
+    @contextmanager
+    def span(self, name, track, category=CAT_STEP, args=None):
+        """记录 with 块的执行时间"""
+        if not self.enabled:
+            yield
+            return
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.complete(name, track, start, self._clock(), category, args)
+
+    def instant(self, name, track, args=None):
+        """记录一个时间点（例如设备插入、任务失败）"""
+        if not self.enabled:
+            return
+        event = {'name': name, 'ph': 'i', 's': 't', 'pid': self._pid, 'tid': self._tid(track),
+                 'ts': self._us(self._clock())}
+        if args:
+            event['args'] = args
+        self._events.append(event)
+
+    def counter(self, name, values):
+        """记录计数器取值，values 为 {序列名: 数值}"""
+        if not self.enabled:
+            return
+        self._events.append({'name': name, 'ph': 'C', 'pid': self._pid, 'ts': self._us(self._clock()),
+                             'args': values})
+
+    def event_count(self):
+        return len(self._events)
+
+    def export(self, path):
+        """写出 Chrome trace JSON，返回事件数"""
+        with self._lock:
+            tracks = dict(self._tracks)
+        events = list(self._events)
+        meta = [{'name': 'process_name', 'ph': 'M', 'pid': self._pid, 'args': {'name': 'ESP32 烧录工具'}}]
+        for track, tid in tracks.items():
+            meta.append({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': track}})
+            meta.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': self._pid, 'tid': tid,
+                         'args': {'sort_index': tid}})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': meta + events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+        return len(events)
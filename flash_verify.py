@@ -0,0 +1,115 @@
+"""烧录校验模式
+
+- hash：esptool 写入每段后由设备计算 MD5 与镜像比较；全部写入后再一次连接中由设备计算
+  所有区域的 MD5，与缓存的镜像 MD5 比较（flash_md5.py），发现段之间相互覆盖等问题（默认，最快）
+- sample：每 N 台抽检一台，随机回读若干扇区与镜像逐字节比较；每批第一台做全量回读（首件检验）
+- full：每台全量回读整个镜像逐字节比较
+"""
+import hashlib
+import os
+import random
+import threading
+
+HASH = 'hash'
+SAMPLE = 'sample'
+FULL = 'full'
+
+MODE_LABELS = {
+    HASH: '快速(MD5)',
+    SAMPLE: '抽检回读',
+    FULL: '全量回读',
+}
+
+SECTOR_SIZE = 0x1000
+
+
+def mode_from_label(label):
+    """界面显示名转换为模式名"""
+    for mode, text in MODE_LABELS.items():
+        if text == label or mode == label:
+            return mode
+    return HASH
+
+
+class VerifyPolicy:
+    """决定每台设备实际使用的校验方式（线程安全的计数）"""
+
+    def __init__(self, mode=HASH, sample_every=10, sample_sectors=4):
+        self.mode = mode
+        self.sample_every = max(1, int(sample_every))
+        self.sample_sectors = max(1, int(sample_sectors))
+        self._lock = threading.Lock()
+        self._units = 0
+
+    def reset(self):
+        """开始新的一批（首件重新做全量回读）"""
+        with self._lock:
+            self._units = 0
+
+    def next_unit(self):
+        """为下一台设备分配校验方式"""
+        with self._lock:
+            index = self._units
+            self._units += 1
+        if self.mode == SAMPLE:
+            if index == 0:
+                return FULL
+            return SAMPLE if index % self.sample_every == 0 else HASH
+        return self.mode
+
+
+def readback_regions(firmwares, mode, sample_sectors=4, rng=random):
+    """生成需要回读的区域列表 [(固件路径, Flash地址, 文件内偏移, 长度)]
+
+    firmwares 为 [(路径, 地址字符串)]；全量模式每段一个区域，抽检模式按镜像大小随机选扇区。
+    """
+    segments = []
+    for firmware, address in firmwares:
+        segments.append((firmware, int(address, 0), os.path.getsize(firmware)))
+
+    if mode == FULL:
+        return [(firmware, base, 0, size) for firmware, base, size in segments if size]
+
+    sectors = []
+    for firmware, base, size in segments:
+        for offset in range(0, size, SECTOR_SIZE):
+            sectors.append((firmware, base + offset, offset, min(SECTOR_SIZE, size - offset)))
+    if len(sectors) > sample_sectors:
+        sectors = rng.sample(sectors, sample_sectors)
+    return sorted(sectors, key=lambda region: region[1])
+
+
+def compare_region(firmware, offset, length, data):
+    """比较回读数据与镜像，返回第一个不一致字节的文件偏移（一致返回 None）"""
+    with open(firmware, 'rb') as f:
+        f.seek(offset)
+        expected = f.read(length)
+    if data[:length] == expected:
+        return None
+    for index, (a, b) in enumerate(zip(data, expected)):
+        if a != b:
+            return offset + index
+    return offset + min(len(data), len(expected))
+
+
+class DigestCache:
+    """镜像文件的 MD5 缓存，文件修改（修改时间或大小变化）后重新计算；可在任意线程中使用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # 路径 -> (修改时间, 大小, MD5)
+
+    def md5(self, path):
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[:2] == (stat.st_mtime, stat.st_size):
+            return entry[2]
+        digest = hashlib.md5()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        result = digest.hexdigest()
+        with self._lock:
+            self._entries[path] = (stat.st_mtime, stat.st_size, result)
+        return result
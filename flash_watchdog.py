@@ -0,0 +1,169 @@
+"""esptool 分阶段看门狗
+
+根据 esptool 的输出判断当前所处阶段（同步、加载stub、擦除、写入、校验、复位），
+为每个阶段设定截止时间。卡在 "Connecting...." 或写入停滞的设备会在几秒内被判定超时，
+而不必等待 esptool 自己的长超时。
+
+写入和回读按停滞判定：每条进度输出（"Writing at 0x..."、"Reading from 0x..."，以及 v4 回读时
+不换行的 "4096 (12 %)"）重新计时，115200 等低波特率下写入较慢，只要进度还在推进就不会超时。
+v4 的 read_flash 不输出 "Reading from"，回读阶段从 "Configuring flash size" 开始计。
+"""
+import re
+import time
+
+# 默认阶段时限（秒）；擦除和写入按数据量（MB）计算，另加固定余量
+DEFAULT_DEADLINES = {
+    'sync': 12.0,           # 启动esptool到与ROM同步完成
+    'stub': 8.0,            # 上传并运行stub、切换波特率
+    'erase_per_mb': 3.0,    # 整片擦除，每MB
+    'write_per_mb': 12.0,   # 写入开始到第一条进度（含区域擦除），每MB
+    'write_stall': 10.0,    # 写入中两条进度之间的最长间隔
+    'verify': 10.0,         # MD5校验
+}
+
+PHASE_LABELS = {
+    'sync': '同步',
+    'stub': '加载stub',
+    'erase': '擦除',
+    'write': '写入',
+    'verify': '校验',
+    'reset': '复位',
+}
+
+# 余量：擦除和写入的固定开销
+_BASE_MARGIN = 3.0
+# 复位及退出的时限
+_RESET_DEADLINE = 5.0
+# 未能识别Flash大小时按16MB估算整片擦除时间
+_DEFAULT_FLASH_MB = 16
+
+_ERASE_RANGE = re.compile(r'Flash will be erased from (0x[0-9a-fA-F]+) to (0x[0-9a-fA-F]+)')
+_COMPRESSED = re.compile(r'Compressed (\d+) bytes to')
+_FLASH_SIZE = re.compile(r'(?:flash size|Flash size)[:\s]+(\d+)MB', re.IGNORECASE)
+_V4_READ_PROGRESS = re.compile(r'^\d+ \(\d+ %\)')
+
+
+class WatchdogTimeout(RuntimeError):
+    """某个阶段超过时限"""
+
+    def __init__(self, phase, limit):
+        self.phase = phase
+        self.limit = limit
+        super().__init__(f"{PHASE_LABELS.get(phase, phase)}阶段超时 ({limit:.0f}秒)")
+
+
+def load_deadlines(config_value):
+    """合并配置中的阶段时限与默认值"""
+    deadlines = dict(DEFAULT_DEADLINES)
+    if isinstance(config_value, dict):
+        for name, value in config_value.items():
+            if name in deadlines:
+                try:
+                    deadlines[name] = float(value)
+                except (TypeError, ValueError):
+                    pass
+    return deadlines
+
+
+class PhaseWatchdog:
+    """跟踪一次 esptool 调用的阶段并判断是否超时
+
+    feed() 逐行喂入输出，expired() 返回已超时的阶段（未超时返回 None）。
+    时限为 0 或负数表示该阶段不限时。durations 累计各阶段耗时（秒）。
+    on_phase(phase, started_at, ended_at) 在每个阶段结束时调用（用于时间线记录）。
+    reading 表示这次调用是 read_flash（回读校验）。
+    """
+
+    def __init__(self, deadlines=None, clock=time.monotonic, on_phase=None, reading=False):
+        self.deadlines = deadlines or DEFAULT_DEADLINES
+        self.reading = reading
+        self._clock = clock
+        self._on_phase = on_phase
+        self.flash_mb = None
+        self.phase = None
+        self.limit = 0.0
+        self.started_at = 0.0
+        self.armed_at = 0.0  # 当前时限的计时起点（进度输出会重新计时）
+        self.stalled = False  # 当前时限是否为进度停滞时限（阶段内已收到过进度）
+        self.durations = {}
+        self._enter('sync', self.deadlines['sync'])
+
+    def _enter(self, phase, limit):
+        self._close_phase()
+        self.phase = phase
+        self.limit = limit
+        self.started_at = self.armed_at = self._clock()
+        self.stalled = False
+
+    def _rearm(self, limit):
+        """阶段不变，重新开始计时（收到进度输出）"""
+        self.limit = limit
+        self.armed_at = self._clock()
+        self.stalled = True
+
+    def feed(self, line):
+        """根据一行输出更新阶段"""
+        match = _FLASH_SIZE.search(line)
+        if match:
+            self.flash_mb = int(match.group(1))
+
+        if 'Uploading stub' in line:
+            self._enter('stub', self.deadlines['stub'])
+        elif line.startswith('Erasing flash') and 'region' not in line and self.phase != 'write':
+            # 整片擦除（erase_flash）
+            mb = self.flash_mb or _DEFAULT_FLASH_MB
+            self._enter('erase', _BASE_MARGIN + self.deadlines['erase_per_mb'] * mb)
+        else:
+            size = None
+            match = _ERASE_RANGE.search(line)
+            if match:
+                size = int(match.group(2), 16) - int(match.group(1), 16) + 1
+            else:
+                match = _COMPRESSED.search(line)
+                if match and self.phase != 'write':
+                    size = int(match.group(1))
+            if size is not None:
+                per_mb = self.deadlines['write_per_mb']
+                limit = max(self.deadlines['write_stall'], _BASE_MARGIN + per_mb * size / (1024 * 1024))
+                self._enter('write', limit if per_mb > 0 else 0.0)
+            elif line.startswith('Writing at 0x') and self.phase == 'write':
+                # 写入进度：只在两条进度之间停滞过久时超时，与波特率无关
+                self._rearm(self.deadlines['write_stall'])
+            elif line.startswith('Wrote ') or line.startswith('Verifying'):
+                self._enter('verify', self.deadlines['verify'])
+            elif line.startswith('Configuring flash size') and self.reading:
+                # stub 已就绪，接下来就是回读
+                self._enter('verify', self.deadlines['verify'])
+            elif line.startswith('Reading from') or _V4_READ_PROGRESS.match(line):
+                # 回读校验：每条进度都重新计时，只在回读停滞时超时
+                if self.phase == 'verify':
+                    self._rearm(self.deadlines['verify'])
+                else:
+                    self._enter('verify', self.deadlines['verify'])
+            elif line.startswith('Hash of data verified'):
+                # 段间空闲，下一段开始前按校验时限计
+                self._enter('verify', self.deadlines['verify'])
+            elif line.startswith('Leaving') or line.startswith('Hard resetting'):
+                self._enter('reset', _RESET_DEADLINE)
+        return self.phase
+
+    def _close_phase(self):
+        if self.phase:
+            now = self._clock()
+            elapsed = now - self.started_at
+            self.durations[self.phase] = self.durations.get(self.phase, 0.0) + elapsed
+            if self._on_phase:
+                self._on_phase(self.phase, self.started_at, now)
+
+    def finish(self):
+        """结束计时，返回各阶段耗时"""
+        self._close_phase()
+        self.phase = None
+        self.limit = 0.0
+        return self.durations
+
+    def expired(self):
+        """当前阶段超时则返回阶段名"""
+        if self.limit > 0 and self._clock() - self.armed_at > self.limit:
+            return self.phase
+        return None
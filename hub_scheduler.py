@@ -0,0 +1,179 @@
+"""按USB集线器限制并发，并自动选择吞吐最高的并发数
+
+同一个 USB 2.0 集线器下的设备共享上行带宽（全速的USB转串口芯片还共用集线器的事务转换器），
+并行任务超过一定数量后总吞吐不升反降。调度器按端口的USB位置（Linux 上由 pyserial 从 sysfs
+读取，如 1-4.3:1.0）把端口归到集线器，每个集线器同时只运行 limit 个任务，其余任务排队。
+
+自动调优：每段固件写入完成时（esptool 输出 "Wrote ... (X kbit/s)"）按当时该集线器上的任务数 n
+记录这一段的有效速率，按 n 分别求滑动平均，n 个任务并行时的总吞吐估计为 n × 单任务速率。
+上限取总吞吐最高的 n；当前上限已是测到的最好值而仍有任务排队时，上限加一试探更高的并发。
+测量值超过 STALE_SECONDS 不再使用，条件变化（换芯片、换固件）后会重新试探。
+
+没有USB位置信息的端口（主板串口等）不受限制。
+"""
+import threading
+import time
+from collections import deque
+
+AUTO = 'auto'
+UNKNOWN_HUB = 'unknown'
+
+MIN_SAMPLES = 3  # 一个并发数至少有几段写入才参与比较
+TOLERANCE = 0.05  # 总吞吐高出 5% 以上才改变上限，避免来回跳动
+STALE_SECONDS = 600  # 测量值的有效期（秒）
+RATE_WINDOW = 30  # 当前总速率的统计窗口（秒）
+_ALPHA = 0.3  # 单任务速率的滑动平均系数
+
+
+class HubState:
+    """一个集线器的任务数、上限和速率测量"""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        self.rates = {}  # 并发数 -> [单任务 kbit/s 滑动平均, 样本数, 更新时间]
+        self._written = deque()  # (完成时间, kbit)
+
+    def throughput(self, n, now):
+        """n 个任务并行时的总吞吐估计（kbit/s），样本不足或已过期时返回 None"""
+        rate = self.rates.get(n)
+        if rate is None or rate[1] < MIN_SAMPLES or now - rate[2] > STALE_SECONDS:
+            return None
+        return n * rate[0]
+
+    def measured(self, now):
+        levels = {}
+        for n in self.rates:
+            value = self.throughput(n, now)
+            if value is not None:
+                levels[n] = value
+        return levels
+
+    def wrote(self, now, kbit):
+        self._written.append((now, kbit))
+
+    def current_kbps(self, now):
+        """最近 RATE_WINDOW 秒写入的总速率"""
+        while self._written and now - self._written[0][0] > RATE_WINDOW:
+            self._written.popleft()
+        return sum(kbit for _, kbit in self._written) / RATE_WINDOW
+
+
+class HubScheduler:
+    """集线器并发限制；acquire/release/record 可在任意线程中调用"""
+
+    def __init__(self, mode=AUTO, start=4, max_limit=16, clock=time.monotonic, on_limit=None):
+        self._clock = clock
+        self.on_limit = on_limit  # on_limit(集线器, 原上限, 新上限)，自动调整上限时调用
+        self._cond = threading.Condition()
+        self.hubs = {}
+        self.configure(mode, start, max_limit)
+
+    def configure(self, mode=AUTO, start=4, max_limit=16):
+        """mode 为 'auto' 时自动调优（从 start 开始，不超过 max_limit）；
+        为整数时每个集线器固定上限，0 表示不限制"""
+        with self._cond:
+            self.auto = str(mode).lower() == AUTO
+            self.max_limit = max(1, int(max_limit))
+            if self.auto:
+                self.start = min(self.max_limit, max(1, int(start)))
+            else:
+                self.start = max(0, int(mode))
+            for state in self.hubs.values():
+                state.limit = self.start
+            self._cond.notify_all()
+
+    def _state(self, hub):
+        state = self.hubs.get(hub)
+        if state is None:
+            state = self.hubs[hub] = HubState(hub, self.start)
+        return state
+
+    def _limited(self, hub, state):
+        return hub != UNKNOWN_HUB and state.limit > 0
+
+    def acquire(self, hub, cancel_event=None, on_wait=None):
+        """占用集线器的一个任务名额；需要排队时先调用 on_wait(limit)。被取消时返回 False"""
+        with self._cond:
+            state = self._state(hub)
+            if self._limited(hub, state) and state.active >= state.limit:
+                if on_wait:
+                    on_wait(state.limit)
+                state.waiting += 1
+                try:
+                    while self._limited(hub, state) and state.active >= state.limit:
+                        if cancel_event is not None and cancel_event.is_set():
+                            return False
+                        # 取消不会唤醒条件变量，定时检查
+                        self._cond.wait(0.2)
+                finally:
+                    state.waiting -= 1
+            state.active += 1
+            return True
+
+    def release(self, hub):
+        with self._cond:
+            state = self._state(hub)
+            state.active = max(0, state.active - 1)
+            self._cond.notify_all()
+
+    def record(self, hub, transfer):
+        """记录一段写入（esptool_output.Transfer），必要时调整上限"""
+        if not transfer.kbps or transfer.kbps <= 0:
+            return
+        now = self._clock()
+        with self._cond:
+            state = self._state(hub)
+            state.wrote(now, transfer.size * 8 / 1000)
+            n = max(1, state.active)
+            rate = state.rates.get(n)
+            if rate is None or now - rate[2] > STALE_SECONDS:
+                state.rates[n] = [transfer.kbps, 1, now]
+            else:
+                rate[0] += _ALPHA * (transfer.kbps - rate[0])
+                rate[1] += 1
+                rate[2] = now
+            if self.auto and hub != UNKNOWN_HUB and self._retune(state, now):
+                self._cond.notify_all()
+
+    def _retune(self, state, now):
+        """按测量结果调整上限，有变化时返回 True"""
+        measured = state.measured(now)
+        if not measured:
+            return False
+        best = max(measured, key=measured.get)
+        limit = state.limit
+        current = measured.get(limit)
+        if current is not None and measured[best] > current * (1 + TOLERANCE):
+            limit = best
+        elif (best == limit and best == max(measured) and state.waiting
+              and limit < self.max_limit):
+            # 吞吐仍随并发增加，且有任务在排队：试探更高的并发
+            limit = best + 1
+        if limit == state.limit:
+            return False
+        previous, state.limit = state.limit, limit
+        if self.on_limit:
+            self.on_limit(state.name, previous, limit)
+        return True
+
+    def snapshot(self):
+        """各集线器的状态（界面、控制接口和监控指标使用）"""
+        now = self._clock()
+        with self._cond:
+            result = []
+            for name in sorted(self.hubs):
+                state = self.hubs[name]
+                limited = self._limited(name, state)
+                result.append({
+                    'hub': name,
+                    'limit': state.limit if limited else None,
+                    'auto': self.auto and limited,
+                    'active': state.active,
+                    'waiting': state.waiting,
+                    'kbps': round(state.current_kbps(now), 1),
+                    'levels': {n: round(value, 1) for n, value in sorted(state.measured(now).items())},
+                })
+            return result
@@ -0,0 +1,217 @@
+"""按端口位置统计链路质量
+
+每个烧录任务结束时记录：各段写入的有效速率（esptool 输出 "Wrote ... (X kbit/s)"）、
+自动重试次数和同步尝试次数，按端口的USB位置（如 1-4.3，线缆和集线器端口固定时位置不变）
+归档。数据保存在 JSON 文件中，保留最近的任务样本和按天汇总的趋势。
+
+降速判断只在芯片型号和波特率相同的任务之间比较（二者决定了正常的写入速率）：
+
+- 与同组其他位置比较：最近 RECENT 个任务的速率中位数低于其他位置中位数的 DEGRADED_RATIO
+- 与自身历史比较：最近的中位数低于本位置更早任务中位数的 DEGRADED_RATIO
+- 最近任务平均每台自动重试 >= RETRY_LIMIT 次，或平均同步尝试 >= SYNC_LIMIT 次
+
+线缆接触不良、集线器端口老化通常先表现为速率下降和重试增多，之后才是烧录失败。
+"""
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+RECENT = 5  # 判断时使用的最近任务数
+MAX_SAMPLES = 60  # 每个位置保留的任务样本数
+TREND_DAYS = 90  # 按天汇总保留的天数
+DEGRADED_RATIO = 0.75
+RETRY_LIMIT = 1.0
+SYNC_LIMIT = 3.0
+SAVE_INTERVAL = 60  # 两次写文件的最小间隔（秒）
+
+
+def location_key(location, port):
+    """USB位置去掉接口号（1-4.3:1.0 -> 1-4.3），没有位置时用端口名"""
+    if location:
+        return str(location).split(':', 1)[0]
+    return port
+
+
+class LinkQualityTracker:
+    """各端口位置的速率、重试和同步统计；add() 可在任意线程中调用"""
+
+    def __init__(self, path=None, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.path = path
+        self.locations = {}
+        self.flagged = {}  # 位置 -> 问题列表
+        self._dirty = False
+        self._saved_at = 0.0
+
+    def load(self, path):
+        """从文件加载历史数据（文件不存在时从空开始）"""
+        data = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        with self._lock:
+            self.path = path
+            self.locations = {}
+            for location, entry in data.get('locations', {}).items():
+                self.locations[location] = {
+                    'port': entry.get('port', ''),
+                    'samples': deque((tuple(s) for s in entry.get('samples', [])), maxlen=MAX_SAMPLES),
+                    'days': dict(entry.get('days', {})),
+                }
+            self.flagged = {}
+            for location in self.locations:
+                issues = self._issues(location)
+                if issues:
+                    self.flagged[location] = issues
+
+    def save(self, force=True):
+        """写入文件；force=False 时距上次写入不足 SAVE_INTERVAL 秒则跳过"""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            now = self._clock()
+            if not force and now - self._saved_at < SAVE_INTERVAL:
+                return
+            data = {'version': 1, 'locations': {
+                location: {'port': entry['port'], 'samples': [list(s) for s in entry['samples']],
+                           'days': entry['days']}
+                for location, entry in self.locations.items()
+            }}
+            self._dirty = False
+            self._saved_at = now
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def add(self, location, port, chip, baud, kbps, retries, sync_attempts):
+        """记录一个任务；kbps 为各段写入速率的列表（仅校验时为空）。
+
+        返回 (问题列表, 是否变化)：位置新出现问题、问题内容变化或恢复正常时为 True。
+        """
+        now = self._clock()
+        rate = round(statistics.median(kbps), 1) if kbps else None
+        day = time.strftime('%Y-%m-%d', time.localtime(now))
+        with self._lock:
+            entry = self.locations.get(location)
+            if entry is None:
+                entry = self.locations[location] = {'port': port, 'samples': deque(maxlen=MAX_SAMPLES), 'days': {}}
+            entry['port'] = port
+            entry['samples'].append((round(now, 1), rate, int(retries), int(sync_attempts), chip or '', int(baud or 0)))
+            # 按天汇总：[任务数, 速率合计, 有速率的任务数, 重试合计, 同步尝试合计]
+            totals = entry['days'].setdefault(day, [0, 0.0, 0, 0, 0])
+            totals[0] += 1
+            if rate is not None:
+                totals[1] = round(totals[1] + rate, 1)
+                totals[2] += 1
+            totals[3] += int(retries)
+            totals[4] += int(sync_attempts)
+            if len(entry['days']) > TREND_DAYS:
+                for old in sorted(entry['days'])[:-TREND_DAYS]:
+                    del entry['days'][old]
+            self._dirty = True
+
+            issues = self._issues(location)
+            previous = self.flagged.get(location, [])
+            if issues:
+                self.flagged[location] = issues
+            else:
+                self.flagged.pop(location, None)
+            changed = [i.split('：', 1)[0] for i in issues] != [i.split('：', 1)[0] for i in previous]
+        try:
+            self.save(force=False)
+        except OSError:
+            pass
+        return issues, changed
+
+    def _recent(self, samples, group):
+        return [s for s in samples if (s[4], s[5]) == group]
+
+    def _rates(self, samples):
+        return [s[1] for s in samples if s[1] is not None]
+
+    def _assess(self, location):
+        """最近任务的中位速率及比较基准：(组, 最近中位数, 同组其他位置, 自身历史)"""
+        samples = list(self.locations[location]['samples'])
+        if not samples:
+            return None, None, None, None
+        group = (samples[-1][4], samples[-1][5])
+        same = self._recent(samples, group)
+        rates = self._rates(same)
+        recent = statistics.median(rates[-RECENT:]) if len(rates) >= RECENT else None
+
+        history = rates[:-RECENT]
+        own = statistics.median(history) if len(history) >= RECENT else None
+
+        peers = []
+        for other, entry in self.locations.items():
+            if other == location:
+                continue
+            other_rates = self._rates(self._recent(entry['samples'], group))[-RECENT:]
+            if len(other_rates) >= RECENT:
+                peers.append(statistics.median(other_rates))
+        peer = statistics.median(peers) if len(peers) >= 2 else None
+        return group, recent, peer, own
+
+    def _issues(self, location):
+        samples = list(self.locations[location]['samples'])[-RECENT:]
+        issues = []
+        group, recent, peer, own = self._assess(location)
+        if recent is not None:
+            if peer and recent < peer * DEGRADED_RATIO:
+                issues.append(f"速率偏低：{recent:.0f} kbit/s，为同组其他位置的 {recent / peer * 100:.0f}%")
+            elif own and recent < own * DEGRADED_RATIO:
+                issues.append(f"速率下降：{recent:.0f} kbit/s，为本位置以往的 {recent / own * 100:.0f}%")
+        if len(samples) >= RECENT:
+            retries = sum(s[2] for s in samples) / len(samples)
+            sync = sum(s[3] for s in samples) / len(samples)
+            if retries >= RETRY_LIMIT:
+                issues.append(f"重试频繁：平均每台 {retries:.1f} 次")
+            if sync >= SYNC_LIMIT:
+                issues.append(f"同步困难：平均每台 {sync:.1f} 次同步尝试")
+        return issues
+
+    def trend(self, location, days=7):
+        """最近 days 天每天的平均速率 [(日期, kbit/s 或 None)]"""
+        with self._lock:
+            entry = self.locations.get(location)
+            if entry is None:
+                return []
+            result = []
+            for day in sorted(entry['days'])[-days:]:
+                jobs, total, rated, _, _ = entry['days'][day]
+                result.append((day, round(total / rated, 1) if rated else None))
+            return result
+
+    def summary(self):
+        """各位置的当前状态（界面、控制接口和监控指标使用）"""
+        with self._lock:
+            locations = sorted(self.locations)
+        result = []
+        for location in locations:
+            with self._lock:
+                entry = self.locations[location]
+                samples = list(entry['samples'])[-RECENT:]
+                group, recent, peer, own = self._assess(location)
+                issues = list(self.flagged.get(location, []))
+                jobs = sum(day[0] for day in entry['days'].values())
+                port = entry['port']
+            rates = self._rates(samples)
+            result.append({
+                'location': location,
+                'port': port,
+                'jobs': jobs,
+                'kbps': round(recent if recent is not None else statistics.median(rates), 1) if rates else None,
+                'reference': round(peer or own, 1) if (peer or own) else None,
+                'retries': round(sum(s[2] for s in samples) / len(samples), 2) if samples else 0,
+                'sync_attempts': round(sum(s[3] for s in samples) / len(samples), 2) if samples else 0,
+                'chip': group[0] if group else None,
+                'baud': group[1] if group else None,
+                'issues': issues,
+                'trend': self.trend(location),
+            })
+        return result
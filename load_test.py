@@ -0,0 +1,352 @@
+"""多设备负载测试
+
+用 esp_emulator 的模拟设备代替真实板子，按时间错开逐个"插入"，走烧录工具真实的
+自动烧录路径（端口监控 → handle_port_changes → handle_new_ports → 烧录引擎），
+每块板子烧录完成后"拔下"并在同一位置插入一块新板子，模拟连续生产。
+
+报告每个并发规模下的 产量(台/小时)、单台周期 p50/p95、UI 事件队列延迟、
+主循环卡顿、CPU 占用（含 esptool 子进程）和内存。
+
+用法（需要图形界面；无显示器的 Linux 上用 xvfb-run 运行）:
+    python load_test.py --ports 32 --duration 300
+    python load_test.py --ports 8,16,32,64 --duration 180 --json result.json
+    python load_test.py --ports 16 --duration 120 --trace timeline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from serial.tools import list_ports
+from serial.tools.list_ports_common import ListPortInfo
+
+import esp_emulator
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, pct):
+    """简单百分位数（最近秩）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def current_rss_mb():
+    """当前常驻内存（MB），读取 /proc，其他平台退回峰值"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _emulator_main(conn, options):
+    """模拟器子进程：启动设备后按主进程的指令更换板子"""
+    devices = esp_emulator.start_devices(**options)
+    conn.send([(device.port, device.chip.chip) for device in devices])
+    try:
+        while True:
+            message = conn.recv()
+            if message[0] == 'plug':
+                _, index, mac = message
+                devices[index].chip.mac = mac
+                devices[index].chip.reset()
+            elif message[0] == 'stop':
+                break
+    except EOFError:
+        pass
+    finally:
+        for device in devices:
+            device.stop()
+
+
+class EmulatorProcess:
+    """在独立进程中运行模拟设备，避免模拟器占用被测工具的 GIL 和 CPU 统计"""
+
+    def __init__(self, **options):
+        self._conn, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_emulator_main, args=(child, options), daemon=True)
+        self._process.start()
+        self.ports = self._conn.recv()  # [(端口, 芯片名)]
+
+    def plug(self, index, mac):
+        self._conn.send(('plug', index, mac))
+
+    def stop(self):
+        try:
+            self._conn.send(('stop',))
+        except (OSError, EOFError):
+            pass
+        self._process.join(5)
+
+
+class VirtualRack:
+    """模拟的 USB 插座：把模拟设备以虚拟串口的形式加入端口列表"""
+
+    def __init__(self, emulator, hub_size=8):
+        self.emulator = emulator
+        self.ports = [port for port, _ in emulator.ports]
+        self.hub_size = hub_size
+        self._lock = threading.Lock()
+        self._plugged = {}  # 端口 -> ListPortInfo
+        self._board = 0
+        self.plugged_at = {}  # 端口 -> 插入时间
+        self._real_comports = list_ports.comports
+
+    def install(self):
+        """让端口监控只看到虚拟端口，测试期间不会误烧录真实设备"""
+        list_ports.comports = self.comports
+
+    def uninstall(self):
+        list_ports.comports = self._real_comports
+
+    def comports(self, include_links=False):
+        with self._lock:
+            return list(self._plugged.values())
+
+    def plug(self, index):
+        """在第 index 个位置插入一块新板子（新的 MAC 和 USB 序列号）"""
+        port, chip = self.emulator.ports[index]
+        with self._lock:
+            self._board += 1
+            board = self._board
+        mac_value = 0x240AC4000000 + board
+        self.emulator.plug(index, ':'.join(f"{(mac_value >> shift) & 0xFF:02x}" for shift in range(40, -8, -8)))
+        info = ListPortInfo(port)
+        info.description = f"ESP Emulator {chip}"
+        info.serial_number = f"EMU{board:06d}"
+        info.location = f"1-{index // self.hub_size + 1}.{index % self.hub_size + 1}"
+        info.hwid = f"EMU SER={info.serial_number} LOCATION={info.location}"
+        with self._lock:
+            self._plugged[port] = info
+            self.plugged_at[port] = time.monotonic()
+
+    def unplug(self, port):
+        with self._lock:
+            self._plugged.pop(port, None)
+
+
+class LoadTest:
+    """在一个 Tk 主循环中运行烧录工具并采集指标"""
+
+    def __init__(self, args):
+        self.args = args
+        self.samples_latency = []  # UI 事件队列延迟（秒）
+        self.samples_lag = []  # 主循环定时器的延迟（秒）
+        self.samples_depth = []
+        self.cycles = []
+        self.failures = 0
+        self.started = None
+        self._seen_records = 0
+        self._next_tick = None
+
+    def run(self):
+        import tkinter as tk
+        import esp32_flasher
+
+        args = self.args
+        workdir = tempfile.mkdtemp(prefix="esp_load_")
+        firmware = args.firmware or self._make_firmware(workdir, args.size)
+        emulator = EmulatorProcess(
+            count=args.ports, chip=args.chip, flash_size=args.flash_size, link_baud=args.link_baud,
+            link_prefix=os.path.join(workdir, 'tty'), write_rate=args.write_rate * 1024,
+            erase_rate=args.erase_rate * 1024
+        )
+        self.rack = VirtualRack(emulator, args.hub_size)
+        self.rack.install()
+
+        # 配置文件写在临时目录，不影响正常使用的 config.json
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            self.root = tk.Tk()
+            self.app = esp32_flasher.ESP32Flasher(self.root)
+            self.root.after(500, lambda: self._configure(firmware))
+            self.root.mainloop()
+        finally:
+            os.chdir(cwd)
+            self.rack.uninstall()
+            emulator.stop()
+        return self.report()
+
+    def _make_firmware(self, workdir, size_kb):
+        # 一半随机数据、一半填充，压缩率接近真实固件
+        path = os.path.join(workdir, 'firmware.bin')
+        half = size_kb * 512
+        with open(path, 'wb') as f:
+            f.write(os.urandom(half) + b'\xff' * half)
+        return path
+
+    def _configure(self, firmware):
+        app = self.app
+        app.firmware_enables[0].set(True)
+        app.firmware_paths[0].set(firmware)
+        app.firmware_addresses[0].delete(0, 'end')
+        app.firmware_addresses[0].insert(0, self.args.address)
+        app.baud_combobox.set(str(self.args.baud))
+        app.auto_flash.set(True)
+        if self.args.trace:
+            app.tracer.start()
+
+        self.started = time.monotonic()
+        self._cpu_start = self._cpu_seconds()
+        for index in range(self.args.ports):
+            self.root.after(int(index * self.args.stagger * 1000), lambda i=index: self.rack.plug(i))
+        self._next_tick = time.monotonic() + 0.1
+        self.root.after(100, self._tick)
+        self.root.after(int(self.args.duration * 1000), self._finish)
+
+    def _tick(self):
+        """每 100ms 采样一次：主循环卡顿、事件队列延迟和新完成的记录"""
+        now = time.monotonic()
+        self.samples_lag.append(max(0.0, now - self._next_tick))
+        self._next_tick = now + 0.1
+        self.samples_latency.append(self.app.ui.last_latency)
+        self.samples_depth.append(self.app.ui.depth())
+
+        records = self.app.flash_records
+        for record in records[self._seen_records:]:
+            port = record['port']
+            plugged = self.rack.plugged_at.get(port)
+            if record['success']:
+                if plugged is not None:
+                    self.cycles.append(now - plugged)
+            else:
+                self.failures += 1
+            # 拔下完成的板子，稍后在同一位置插入新板子
+            self.rack.unplug(port)
+            index = self.rack.ports.index(port)
+            self.root.after(int(self.args.swap_delay * 1000), lambda i=index: self.rack.plug(i))
+        self._seen_records = len(records)
+        self.root.after(100, self._tick)
+
+    def _cpu_seconds(self):
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return (own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime)
+
+    def _finish(self):
+        self.elapsed = time.monotonic() - self.started
+        own_end, children_end = self._cpu_seconds()
+        own_start, children_start = self._cpu_start
+        self.cpu_tool = (own_end - own_start) / self.elapsed * 100
+        self.cpu_esptool = (children_end - children_start) / self.elapsed * 100
+        self.rss = current_rss_mb()
+        if self.args.trace:
+            self.app.tracer.stop()
+            self.app.tracer.export(self.args.trace)
+        try:
+            self.app.stop_flash()
+            self.app.ui.stop()
+        except Exception:
+            pass
+        self.root.destroy()
+
+    def report(self):
+        units = len(self.cycles)
+        return {
+            'ports': self.args.ports,
+            'duration_s': round(self.elapsed, 1),
+            'units': units,
+            'failures': self.failures,
+            'units_per_hour': round(units / self.elapsed * 3600, 1) if self.elapsed else 0,
+            'cycle_p50_s': round(percentile(self.cycles, 50), 2),
+            'cycle_p95_s': round(percentile(self.cycles, 95), 2),
+            'ui_latency_p50_ms': round(percentile(self.samples_latency, 50) * 1000, 1),
+            'ui_latency_p95_ms': round(percentile(self.samples_latency, 95) * 1000, 1),
+            'ui_latency_max_ms': round(max(self.samples_latency, default=0) * 1000, 1),
+            'mainloop_lag_p95_ms': round(percentile(self.samples_lag, 95) * 1000, 1),
+            'queue_depth_max': max(self.samples_depth, default=0),
+            'cpu_tool_pct': round(self.cpu_tool, 1),
+            'cpu_esptool_pct': round(self.cpu_esptool, 1),
+            'rss_mb': round(self.rss, 1),
+        }
+
+
+_COLUMNS = [
+    ('ports', '端口'), ('units', '完成'), ('failures', '失败'), ('units_per_hour', '台/小时'),
+    ('cycle_p50_s', '周期p50(s)'), ('cycle_p95_s', '周期p95(s)'),
+    ('ui_latency_p95_ms', '队列延迟p95(ms)'), ('mainloop_lag_p95_ms', '主循环卡顿p95(ms)'),
+    ('cpu_tool_pct', '工具CPU%'), ('cpu_esptool_pct', 'esptool CPU%'), ('rss_mb', '内存(MB)'),
+]
+
+
+def print_table(results):
+    out = sys.__stdout__
+    out.write("  ".join(title for _, title in _COLUMNS) + "\n")
+    for result in results:
+        out.write("  ".join(f"{result[key]:>{len(title)}}" for key, title in _COLUMNS) + "\n")
+    out.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ESP32 烧录工具多设备负载测试")
+    parser.add_argument('--ports', default='32', help="并发端口数，多个规模用逗号分隔，如 8,16,32,64")
+    parser.add_argument('--duration', type=float, default=300, help="每个规模的测试时长（秒）")
+    parser.add_argument('--stagger', type=float, default=0.5, help="相邻板子首次插入的间隔（秒）")
+    parser.add_argument('--swap-delay', type=float, default=2.0, help="拔下到插入新板子的间隔（秒）")
+    parser.add_argument('--chip', default='ESP32-S3')
+    parser.add_argument('--flash-size', default='4MB')
+    parser.add_argument('--firmware', help="固件文件，不指定则生成随机镜像")
+    parser.add_argument('--size', type=int, default=1024, help="生成镜像的大小（KB）")
+    parser.add_argument('--address', default='0x10000')
+    parser.add_argument('--baud', type=int, default=921600, help="烧录波特率")
+    parser.add_argument('--link-baud', type=int, default=2000000, help="模拟链路的最高速率，0 表示不限速")
+    parser.add_argument('--write-rate', type=int, default=400, help="模拟 Flash 写入速度 (KB/s)")
+    parser.add_argument('--erase-rate', type=int, default=4096, help="模拟 Flash 擦除速度 (KB/s)")
+    parser.add_argument('--hub-size', type=int, default=8, help="每个模拟USB集线器的端口数")
+    parser.add_argument('--json', help="把结果写入 JSON 文件")
+    parser.add_argument('--trace', help="把烧录时间线导出为 Chrome trace JSON（多个规模时文件名后加 _<端口数>）")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.trace:
+        # 测试在临时目录中运行
+        args.trace = os.path.abspath(args.trace)
+    levels = [int(value) for value in args.ports.split(',') if value.strip()]
+
+    if len(levels) == 1:
+        args.ports = levels[0]
+        results = [LoadTest(args).run()]
+    else:
+        # 每个规模在独立进程中运行，CPU 和内存互不影响
+        results = []
+        for level in levels:
+            fd, path = tempfile.mkstemp(suffix='.json')
+            os.close(fd)
+            argv = [sys.executable, os.path.abspath(__file__), '--ports', str(level), '--json', path]
+            for name, value in vars(args).items():
+                if name == 'trace' and value:
+                    stem, ext = os.path.splitext(value)
+                    value = f"{stem}_{level}{ext or '.json'}"
+                if name not in ('ports', 'json') and value is not None:
+                    argv += [f"--{name.replace('_', '-')}", str(value)]
+            subprocess.run(argv, cwd=_HERE, check=False)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    results.extend(json.load(f))
+            except (OSError, ValueError):
+                sys.__stdout__.write(f"规模 {level} 没有产生结果\n")
+            finally:
+                os.remove(path)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""批次（生产批）实时统计
+
+每条烧录记录到达时增量更新，不重新扫描历史记录：
+
+- 产量：本批合格台数 / 目标数量，ETA = 剩余台数 / 最长统计窗口内的台/小时
+- 台/小时：多个滚动窗口（默认 5、15、60 分钟），窗口内合格台数 / 窗口时长；
+  批次开始不足一个窗口时按已进行的时长计算
+- 单台周期：按端口和芯片型号分别统计平均值和 P95（对数分桶直方图，误差约 2.5%）
+- 首次通过率：首次出现即一次烧录成功（无自动重试）的设备数 / 设备数；
+  设备按MAC识别，读到MAC之前就失败的任务无法与后续重试关联，按独立设备计
+
+仅校验的记录（冷却期内重复出现的设备）不计入批次。
+"""
+import math
+import time
+from collections import deque
+
+DEFAULT_WINDOWS = (5, 15, 60)  # 分钟
+
+# 周期直方图分桶：相邻桶上界相差 5%
+_BUCKET_RATIO = 1.05
+_LOG_RATIO = math.log(_BUCKET_RATIO)
+
+
+class CycleStats:
+    """单台周期的计数、平均值和分位数"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._buckets = {}
+
+    def add(self, seconds):
+        seconds = max(0.001, float(seconds))
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(math.log(seconds) / _LOG_RATIO)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, p):
+        """分位数（取所在桶的上界，不超过最大值）"""
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                return min(self.max, _BUCKET_RATIO ** (bucket + 1))
+        return self.max
+
+
+class LotTracker:
+    """一个批次的统计；在主线程中调用 add()"""
+
+    def __init__(self, target=0, windows=DEFAULT_WINDOWS, clock=time.monotonic):
+        self._clock = clock
+        self.windows = tuple(sorted(max(1, int(w)) for w in windows)) or DEFAULT_WINDOWS
+        self.start(target)
+
+    def start(self, target=0):
+        """开始新批次"""
+        self.target = max(0, int(target))
+        self.started_at = self._clock()
+        self.passed = 0
+        self.failed_jobs = 0
+        self.units = 0
+        self.first_pass = 0
+        self.by_port = {}
+        self.by_chip = {}
+        self._seen = set()  # 已出现过的设备MAC
+        self._recent = {w: deque() for w in self.windows}  # 窗口内合格设备的完成时间
+
+    @property
+    def remaining(self):
+        return max(0, self.target - self.passed)
+
+    @property
+    def complete(self):
+        return self.target > 0 and self.passed >= self.target
+
+    def add(self, record, now=None):
+        """计入一条烧录记录，返回 (端口, 芯片) 中周期统计有变化的键，未计入时返回 None"""
+        if record.get('verify_only'):
+            return None
+        now = self._clock() if now is None else now
+        success = record['success']
+        mac = record.get('mac_address') or ''
+        known = mac and mac != 'Unknown'
+
+        if not known or mac not in self._seen:
+            self.units += 1
+            if known:
+                self._seen.add(mac)
+            if success and not record.get('retries'):
+                self.first_pass += 1
+
+        if not success:
+            self.failed_jobs += 1
+            return None
+
+        self.passed += 1
+        for window, times in self._recent.items():
+            times.append(now)
+            self._expire(window, times, now)
+
+        port, chip = record['port'], record.get('chip_type') or 'Unknown'
+        cycle = record.get('cycle_time')
+        if cycle is None:
+            return None
+        self.by_port.setdefault(port, CycleStats()).add(cycle)
+        self.by_chip.setdefault(chip, CycleStats()).add(cycle)
+        return port, chip
+
+    def _expire(self, window, times, now):
+        limit = now - window * 60
+        while times and times[0] < limit:
+            times.popleft()
+
+    def units_per_hour(self, window, now=None):
+        """窗口内的合格台/小时"""
+        now = self._clock() if now is None else now
+        times = self._recent[window]
+        self._expire(window, times, now)
+        span = min(window * 60, now - self.started_at)
+        if span <= 0 or not times:
+            return 0.0
+        return len(times) * 3600 / span
+
+    @property
+    def first_pass_yield(self):
+        return self.first_pass / self.units if self.units else None
+
+    def eta(self, now=None):
+        """预计还需多少秒完成本批，无目标或尚无产量时返回 None"""
+        if not self.target:
+            return None
+        if self.complete:
+            return 0.0
+        rate = self.units_per_hour(self.windows[-1], now)
+        if rate <= 0:
+            return None
+        return self.remaining / rate * 3600
+
+
+def format_duration(seconds):
+    """ETA 显示：1:05:30 / 12:04"""
+    if seconds is None:
+        return "-"
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
@@ -0,0 +1,94 @@
+"""自动模式的设备筛选：只把真正的目标板当作新设备
+
+自动烧录/读取会对每个新出现的串口启动 esptool，扫码枪、调试器、USB 调制解调器等
+也会被当作目标，直到 esptool 超时才放弃。配置 port_filter 后，只有符合条件的端口
+进入自动处理，其余端口只在日志中提示一次。手动操作不受影响。
+
+配置示例（各项均可省略；列表内任一项匹配即可，不同项之间需同时满足）：
+
+    "port_filter": {
+        "vid_pid": ["303A:*", "10C4:EA60", "1A86:7523"],
+        "manufacturer": ["Silicon Labs*", "Espressif*"],
+        "description": ["*CP210*", "*CH340*", "*JTAG*"],
+        "location": ["1-4.*"],
+        "exclude": {"description": ["*Bluetooth*"]}
+    }
+
+匹配使用通配符（* 和 ?），不区分大小写。没有USB信息的端口（主板串口、蓝牙串口等）
+在配置了 vid_pid、manufacturer 或 location 条件时不会匹配。
+"""
+from fnmatch import fnmatchcase
+
+FIELDS = ('vid_pid', 'manufacturer', 'description', 'location')
+FIELD_LABELS = {'vid_pid': 'VID:PID', 'manufacturer': '厂商', 'description': '描述', 'location': 'USB位置'}
+
+
+def port_fields(port_info):
+    """端口用于匹配的各项属性"""
+    vid = getattr(port_info, 'vid', None)
+    pid = getattr(port_info, 'pid', None)
+    return {
+        'vid_pid': f"{vid:04X}:{pid:04X}" if vid is not None and pid is not None else '',
+        'manufacturer': getattr(port_info, 'manufacturer', None) or '',
+        'description': getattr(port_info, 'description', None) or '',
+        'location': getattr(port_info, 'location', None) or '',
+    }
+
+
+def _patterns(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    return [str(pattern).upper() for pattern in value if str(pattern).strip()]
+
+
+def _matches(text, patterns):
+    text = text.upper()
+    return any(fnmatchcase(text, pattern) for pattern in patterns)
+
+
+class PortFilter:
+    """按 VID:PID、厂商、描述和USB位置筛选自动模式的端口"""
+
+    def __init__(self, include=None, exclude=None):
+        self.include = {field: _patterns((include or {}).get(field)) for field in FIELDS}
+        self.exclude = {field: _patterns((exclude or {}).get(field)) for field in FIELDS}
+
+    @classmethod
+    def from_config(cls, value):
+        """由配置项 port_filter 创建；未配置时所有端口都通过"""
+        if not isinstance(value, dict):
+            return cls()
+        return cls(value, value.get('exclude'))
+
+    @property
+    def enabled(self):
+        return any(self.include.values()) or any(self.exclude.values())
+
+    def reject_reason(self, port_info):
+        """端口不符合条件时返回原因，符合时返回 None"""
+        if not self.enabled:
+            return None
+        fields = port_fields(port_info)
+        for field in FIELDS:
+            patterns = self.exclude[field]
+            if patterns and _matches(fields[field], patterns):
+                return f"{FIELD_LABELS[field]} {fields[field]} 在排除列表中"
+        for field in FIELDS:
+            patterns = self.include[field]
+            if patterns and not _matches(fields[field], patterns):
+                return f"{FIELD_LABELS[field]} {fields[field] or '（无）'} 不在允许列表中"
+        return None
+
+    def split(self, ports, port_info):
+        """把端口分为 (目标端口, {被忽略的端口: 原因})"""
+        accepted = []
+        ignored = {}
+        for port in ports:
+            reason = self.reject_reason(port_info.get(port))
+            if reason is None:
+                accepted.append(port)
+            else:
+                ignored[port] = reason
+        return accepted, ignored
@@ -0,0 +1,164 @@
+"""跨进程的端口租约：同一台电脑上的多个工具实例不会同时处理一个串口
+
+烧录工具、MAC读取工具、统一工具（或同一工具的多个实例）都会对新插入的端口做出反应。
+开始处理端口前先在公共目录（系统临时目录下的 esp32_port_leases）中对端口对应的锁文件
+加排他锁，成功的实例获得租约，其他实例把该端口视为占用并跳过。锁由操作系统持有，
+进程退出（包括崩溃）时自动释放，不会留下需要手动清理的"死锁"。
+
+锁文件开头写入持有者信息（工具名、进程号、开始时间），其他实例据此显示端口被谁占用。
+同一进程内的租约可重入（统一工具先占用端口，再在其中调用烧录引擎）。
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LEASE_DIR = os.path.join(tempfile.gettempdir(), 'esp32_port_leases')
+TOOL_LABELS = {'flasher': '烧录工具', 'readmac': 'MAC读取工具', 'unified': '统一工具', 'engine': '烧录脚本'}
+# Windows 的字节锁是强制锁，锁在持有者信息之后的位置，其他进程仍能读取信息
+_LOCK_OFFSET = 4096
+_ACQUIRE_ATTEMPTS = 3
+
+
+def _try_lock(fd):
+    """加非阻塞排他锁，已被其他进程锁定时抛出 OSError"""
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        os.lseek(fd, _LOCK_OFFSET, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, _LOCK_OFFSET, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def describe_holder(holder):
+    """持有者信息的说明文字，如 "烧录工具 (PID 1234)" """
+    if not holder:
+        return "其他程序"
+    tool = holder.get('tool')
+    return f"{TOOL_LABELS.get(tool, tool or '其他程序')} (PID {holder.get('pid', '?')})"
+
+
+class PortLeases:
+    """本进程持有的端口租约；acquire/release 可在任意线程中调用"""
+
+    def __init__(self, tool, directory=None):
+        self.tool = tool
+        self.directory = directory or LEASE_DIR
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._held = {}  # 端口 -> [文件描述符, 重入次数]
+
+    def _path(self, port):
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', str(port)).strip('_') or 'port'
+        return os.path.join(self.directory, f"{name}.lock")
+
+    def acquire(self, port):
+        """获得端口的租约，已被其他进程持有时返回 False"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            held = self._held.get(port)
+            if held is not None:
+                held[1] += 1
+                return True
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(self._path(port), os.O_RDWR | os.O_CREAT, 0o666)
+            # 其他实例用 holder() 查询时会短暂加锁，失败后稍等再试
+            for attempt in range(_ACQUIRE_ATTEMPTS):
+                try:
+                    _try_lock(fd)
+                    break
+                except OSError:
+                    if attempt == _ACQUIRE_ATTEMPTS - 1:
+                        os.close(fd)
+                        return False
+                    time.sleep(0.05)
+            info = json.dumps({'tool': self.tool, 'pid': os.getpid(), 'port': port,
+                               'since': time.strftime("%Y-%m-%d %H:%M:%S")}, ensure_ascii=False)
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, info.encode('utf-8').ljust(256))
+            except OSError:
+                pass
+            self._held[port] = [fd, 1]
+            return True
+
+    def release(self, port):
+        with self._lock:
+            held = self._held.get(port)
+            if held is None:
+                return
+            held[1] -= 1
+            if held[1] > 0:
+                return
+            del self._held[port]
+            fd = held[0]
+        # 锁文件不删除：删除与其他进程加锁之间存在竞争
+        try:
+            _unlock(fd)
+        except OSError:
+            pass
+        os.close(fd)
+
+    def release_all(self):
+        with self._lock:
+            ports = list(self._held)
+        for port in ports:
+            with self._lock:
+                if port in self._held:
+                    self._held[port][1] = 1
+            self.release(port)
+
+    def held(self, port):
+        with self._lock:
+            return port in self._held
+
+    def holder(self, port):
+        """持有端口租约的其他进程信息（dict），未被其他进程持有时返回 None"""
+        if not self.enabled or self.held(port):
+            return None
+        path = self._path(port)
+        if not os.path.exists(path):
+            return None
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except OSError:
+            return None
+        try:
+            try:
+                _try_lock(fd)
+            except OSError:
+                os.lseek(fd, 0, os.SEEK_SET)
+                text = os.read(fd, 256).decode('utf-8', 'replace').strip()
+                try:
+                    return json.loads(text)
+                except ValueError:
+                    return {}
+            _unlock(fd)
+            return None
+        finally:
+            os.close(fd)
+
+    def busy_ports(self, ports):
+        """被其他进程占用的端口 {端口: 持有者信息}"""
+        busy = {}
+        for port in ports:
+            holder = self.holder(port)
+            if holder is not None:
+                busy[port] = holder
+        return busy
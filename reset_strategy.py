@@ -0,0 +1,159 @@
+"""按端口和芯片学习进入下载模式的复位方式
+
+esptool 连接前用 --before 指定的方式让芯片进入下载模式，不同板子适合的方式不同：
+
+- default_reset：经典的 DTR/RTS 自动复位电路（CP210x、CH340 等USB转串口芯片的板子）
+- usb_reset：芯片内置的 USB-Serial-JTAG（ESP32-C3/S3/C6/H2 等原生USB，VID:PID 303A:1001）
+- no_reset：没有自动复位电路，需要按住 BOOT 手动进入下载模式的板子
+
+方式不对时 esptool 会反复 "Connecting...." 直到同步失败。烧录引擎按这里给出的顺序尝试，
+同步失败时换下一种方式，并按端口的USB位置 + USB描述符（VID:PID）记住成功的方式，下次先用；
+新位置上同型号的设备使用按 描述符 + 芯片型号 汇总的结果。数据保存在 JSON 文件中。
+
+no_reset 不参与自动选择：板子没人按 BOOT 时它只会多等一次同步超时，偶然处于下载模式的板子
+用它成功一次也不说明该位置需要手动操作。需要手动进入下载模式的工位应固定使用 no_reset。
+"""
+import json
+import os
+import threading
+import time
+
+DEFAULT_RESET = 'default_reset'
+USB_RESET = 'usb_reset'
+NO_RESET = 'no_reset'
+
+STRATEGY_LABELS = {
+    DEFAULT_RESET: 'DTR/RTS复位',
+    USB_RESET: 'USB-JTAG复位',
+    NO_RESET: '不复位',
+}
+
+ESPRESSIF_VID = 0x303A
+USB_JTAG_PID = 0x1001  # 芯片内置 USB-Serial-JTAG
+SAVE_INTERVAL = 60  # 两次写文件的最小间隔（秒）
+# 自动选择时尝试和学习的方式
+AUTO_STRATEGIES = (USB_RESET, DEFAULT_RESET)
+
+
+def descriptor_of(port_info):
+    """端口的USB描述符 "VID:PID"（非USB端口返回 None）"""
+    vid = getattr(port_info, 'vid', None)
+    pid = getattr(port_info, 'pid', None)
+    if vid is None or pid is None:
+        return None
+    return f"{vid:04X}:{pid:04X}"
+
+
+def default_order(descriptor):
+    """没有学习记录时的尝试顺序"""
+    if descriptor == f"{ESPRESSIF_VID:04X}:{USB_JTAG_PID:04X}":
+        return [USB_RESET, DEFAULT_RESET]
+    # USB转串口芯片和普通串口：usb_reset 只对内置 USB-Serial-JTAG 有效，不参与尝试
+    return [DEFAULT_RESET]
+
+
+class ResetStrategyTable:
+    """各端口位置/设备型号下各复位方式的成功、失败次数；可在任意线程中使用"""
+
+    def __init__(self, path=None, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.path = path
+        self.entries = {}  # 键 -> {复位方式: [成功次数, 失败次数, 最近成功时间]}
+        self._dirty = False
+        self._saved_at = 0.0
+
+    def load(self, path):
+        """从文件加载学习记录（文件不存在时从空开始）"""
+        data = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        with self._lock:
+            self.path = path
+            self.entries = {key: {strategy: list(stats) for strategy, stats in strategies.items()}
+                            for key, strategies in data.get('entries', {}).items()}
+
+    def save(self, force=True):
+        """写入文件；force=False 时距上次写入不足 SAVE_INTERVAL 秒则跳过"""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            now = self._clock()
+            if not force and now - self._saved_at < SAVE_INTERVAL:
+                return
+            data = {'version': 1, 'entries': self.entries}
+            text = json.dumps(data, ensure_ascii=False, indent=1)
+            self._dirty = False
+            self._saved_at = now
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def _keys(self, location, descriptor, chip):
+        """学习记录的键：具体位置上的设备，以及同型号设备的汇总"""
+        keys = [f"{location}|{descriptor or '-'}"]
+        if chip:
+            keys.append(f"*|{descriptor or '-'}|{chip}")
+        return keys
+
+    def order(self, location, descriptor, chip=None):
+        """按成功率排列的尝试顺序；位置上的记录优先于同型号的汇总，都没有时按默认顺序"""
+        candidates = default_order(descriptor)
+        with self._lock:
+            learned = [self.entries.get(key, {}) for key in self._keys(location, descriptor, chip)]
+            # 同型号汇总在芯片未知（检测前）时按描述符查找
+            if not chip:
+                prefix = f"*|{descriptor or '-'}|"
+                learned.extend(strategies for key, strategies in self.entries.items() if key.startswith(prefix))
+
+            def score(strategy):
+                for strategies in learned:
+                    stats = strategies.get(strategy)
+                    if stats:
+                        successes, failures, last = stats
+                        # 成功率（平滑），相同时最近成功的优先
+                        return (successes + 1) / (successes + failures + 2), last
+                # 没有记录：排在有成功记录的方式之后、只有失败记录的方式之前
+                return 0.5, 0
+
+            # 旧版本记录的 no_reset 不再参与
+            for strategies in learned:
+                for strategy in strategies:
+                    if strategy not in candidates and strategy in AUTO_STRATEGIES:
+                        candidates.append(strategy)
+            return sorted(candidates, key=score, reverse=True)
+
+    def record(self, location, descriptor, chip, strategy, success):
+        """记录一次连接结果（只记录参与自动选择的方式）"""
+        if strategy not in AUTO_STRATEGIES:
+            return
+        now = round(self._clock(), 1)
+        with self._lock:
+            for key in self._keys(location, descriptor, chip):
+                stats = self.entries.setdefault(key, {}).setdefault(strategy, [0, 0, 0])
+                if success:
+                    stats[0] += 1
+                    stats[2] = now
+                else:
+                    stats[1] += 1
+            self._dirty = True
+        try:
+            self.save(force=False)
+        except OSError:
+            pass
+
+    def summary(self):
+        """各位置学到的首选复位方式（控制接口使用）"""
+        with self._lock:
+            result = {}
+            for key, strategies in sorted(self.entries.items()):
+                strategies = {s: v for s, v in strategies.items() if s in AUTO_STRATEGIES}
+                if not strategies:
+                    continue
+                best = max(strategies, key=lambda s: ((strategies[s][0] + 1) / (sum(strategies[s][:2]) + 2),
+                                                      strategies[s][2]))
+                result[key] = {'preferred': best,
+                               'stats': {s: {'success': v[0], 'fail': v[1]} for s, v in strategies.items()}}
+            return result
@@ -0,0 +1,252 @@
+"""运行中的性能分析（采样 CPU + tracemalloc 内存）
+
+不需要安装任何外部工具：后台线程按固定间隔对所有线程的调用栈采样，同时用 tracemalloc
+记录分析期间新分配且仍未释放的内存，结束时生成按线程（烧录/读取线程以端口命名）分组的文本报告。
+
+各线程的 CPU 时间在 Windows 上用 GetThreadTimes、Linux 上读取 /proc 获得，其他平台只有采样数据。
+tracemalloc 会让 Python 代码明显变慢，分析窗口不宜过长。
+
+    profiler = SamplingProfiler('flasher')
+    profiler.start(duration=60, on_finish=lambda path: ...)
+    ...
+    path = profiler.stop()   # 手动结束，返回报告路径
+"""
+import argparse
+import datetime
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# 每个线程报告中列出的函数数
+_TOP_FUNCTIONS = 12
+# 内存报告中列出的分配位置数
+_TOP_ALLOCATIONS = 20
+_MAX_DEPTH = 64
+
+
+def _thread_cpu_seconds(native_id):
+    """线程累计 CPU 时间（秒），无法获取时返回 None"""
+    if native_id is None:
+        return None
+    if sys.platform.startswith('linux'):
+        try:
+            with open(f'/proc/self/task/{native_id}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            # utime、stime 为第 14、15 个字段（去掉前两个字段后下标 11、12）
+            return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError, IndexError):
+            return None
+    if os.name == 'nt':
+        try:
+            import ctypes
+            from ctypes import wintypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.OpenThread.restype = wintypes.HANDLE
+            handle = kernel32.OpenThread(0x0800, False, native_id)  # THREAD_QUERY_LIMITED_INFORMATION
+            if not handle:
+                return None
+            try:
+                times = [wintypes.FILETIME() for _ in range(4)]
+                if not kernel32.GetThreadTimes(handle, *[ctypes.byref(t) for t in times]):
+                    return None
+                kernel, user = times[2], times[3]
+                total = ((kernel.dwHighDateTime << 32) | kernel.dwLowDateTime) + \
+                        ((user.dwHighDateTime << 32) | user.dwLowDateTime)
+                return total / 1e7
+            finally:
+                kernel32.CloseHandle(handle)
+        except Exception:
+            return None
+    return None
+
+
+def _short_path(filename):
+    parts = filename.replace('\\', '/').split('/')
+    return '/'.join(parts[-2:]) if len(parts) > 1 else filename
+
+
+class _ThreadStats:
+    def __init__(self, name):
+        self.name = name
+        self.samples = 0
+        self.own = Counter()        # 栈顶函数
+        self.inclusive = Counter()  # 栈中出现过的函数
+        self.cpu_start = None
+        self.cpu_end = None
+
+
+class SamplingProfiler:
+    """所有线程的采样分析器"""
+
+    def __init__(self, name='profile', interval=0.005, output_dir='.', alloc_frames=8):
+        self.name = name
+        self.interval = interval
+        self.output_dir = output_dir
+        self.alloc_frames = alloc_frames
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {}
+        self._started_tracemalloc = False
+        self.started_at = None
+        self.last_report = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=None, on_finish=None):
+        """开始分析；duration 秒后自动结束并保存报告，随后在分析线程中调用 on_finish(报告路径)"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._stats = {}
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.alloc_frames)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, args=(duration, on_finish),
+                                        name="性能分析", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """结束分析并保存报告，返回报告路径（未在分析时返回 None）"""
+        thread = self._thread
+        if thread is None:
+            return None
+        self._stop.set()
+        if thread is not threading.current_thread():
+            thread.join()
+        return self.last_report
+
+    def _run(self, duration, on_finish):
+        deadline = self.started_at + duration if duration else None
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self._sample(own_ident)
+            if deadline and time.monotonic() >= deadline:
+                break
+        path = self._finish()
+        if on_finish and not self._stop.is_set():
+            try:
+                on_finish(path)
+            except Exception:
+                pass
+
+    def _sample(self, own_ident):
+        threads = {t.ident: t for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            thread = threads.get(ident)
+            stats = self._stats.get(ident)
+            if stats is None:
+                stats = _ThreadStats(thread.name if thread else f"线程 {ident}")
+                stats.cpu_start = _thread_cpu_seconds(getattr(thread, 'native_id', None))
+                self._stats[ident] = stats
+            elif thread is not None and thread.name != stats.name:
+                # 工作线程开始任务后会改名为端口名
+                stats.name = thread.name
+            if thread is not None:
+                stats.cpu_end = _thread_cpu_seconds(getattr(thread, 'native_id', None))
+
+            stats.samples += 1
+            seen = set()
+            depth = 0
+            while frame is not None and depth < _MAX_DEPTH:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if depth == 0:
+                    stats.own[key] += 1
+                if key not in seen:
+                    seen.add(key)
+                    stats.inclusive[key] += 1
+                frame = frame.f_back
+                depth += 1
+
+    def _finish(self):
+        elapsed = time.monotonic() - self.started_at
+        snapshot = None
+        peak = 0
+        if tracemalloc.is_tracing():
+            # 排除分析器自身的分配
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ])
+            peak = tracemalloc.get_traced_memory()[1]
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+        report = self._format(elapsed, snapshot, peak)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(self.output_dir, f"profile_{self.name}_{stamp}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(report)
+        self.last_report = path
+        return path
+
+    def _format(self, elapsed, snapshot, peak):
+        lines = [
+            f"性能分析报告 {self.name}  {datetime.datetime.now():%Y-%m-%d %H:%M:%S}",
+            f"分析时长 {elapsed:.1f} 秒，采样间隔 {self.interval * 1000:g} ms",
+            "",
+            "== 线程概览（按 CPU 时间排序；采样数为线程存活期间的调用栈采样次数） ==",
+        ]
+        stats = list(self._stats.values())
+
+        def cpu(s):
+            if s.cpu_start is None or s.cpu_end is None:
+                return None
+            return max(0.0, s.cpu_end - s.cpu_start)
+
+        stats.sort(key=lambda s: (cpu(s) or 0.0, s.samples), reverse=True)
+        for s in stats:
+            seconds = cpu(s)
+            usage = f"CPU {seconds:7.2f}s ({seconds / elapsed * 100:5.1f}%)" if seconds is not None else "CPU      -"
+            lines.append(f"  {s.name:<32} {usage}  采样 {s.samples}")
+
+        for s in stats:
+            if not s.samples:
+                continue
+            lines.append("")
+            lines.append(f"== {s.name} ==")
+            lines.append("  栈顶函数（自身耗时）:")
+            for (filename, lineno, func), count in s.own.most_common(_TOP_FUNCTIONS):
+                lines.append(f"    {count / s.samples * 100:5.1f}%  {func}  ({_short_path(filename)}:{lineno})")
+            lines.append("  包含调用（累计耗时）:")
+            for (filename, lineno, func), count in s.inclusive.most_common(_TOP_FUNCTIONS):
+                lines.append(f"    {count / s.samples * 100:5.1f}%  {func}  ({_short_path(filename)}:{lineno})")
+
+        lines.append("")
+        if snapshot is None:
+            lines.append("== 内存：tracemalloc 不可用 ==")
+        else:
+            stats = snapshot.statistics('lineno')
+            total = sum(stat.size for stat in stats)
+            lines.append(f"== 内存：分析期间新分配且仍存活 {total / 1024:.1f} KiB，峰值 {peak / 1024:.1f} KiB ==")
+            for stat in stats[:_TOP_ALLOCATIONS]:
+                frame = stat.traceback[0]
+                lines.append(f"  {stat.size / 1024:9.1f} KiB  {stat.count:7d} 块  "
+                             f"{_short_path(frame.filename)}:{frame.lineno}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+def add_profile_argument(parser):
+    """为工具的命令行加入 --profile 参数"""
+    parser.add_argument('--profile', type=float, nargs='?', const=60.0, metavar='秒',
+                        help="启动后立即进行性能分析，持续指定秒数（默认60）后保存报告")
+    return parser
+
+
+def parse_tool_args(argv=None):
+    """解析三个工具共用的命令行参数（忽略未知参数，打包后的程序可能收到额外参数）"""
+    parser = add_profile_argument(argparse.ArgumentParser(add_help=True))
+    args, _ = parser.parse_known_args(argv)
+    return args
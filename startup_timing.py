@@ -0,0 +1,100 @@
+"""启动耗时统计
+
+入口脚本最先导入本模块，之后在启动的各个节点调用 mark()，窗口可用、串口监控开始后
+调用 summary() 得到一行分段耗时写入日志，例如：
+
+    启动就绪 0.62 秒（进程启动 0.18 | 导入模块 0.09 | 创建主窗口 0.04 | 构建界面 0.21 | 首次绘制 0.05 | 加载配置 0.01 | 扫描串口 0.04）
+
+"进程启动"是操作系统创建进程到执行 Python 代码之间的时间（解释器启动；打包成单文件时还包括解压），
+取不到进程创建时间时省略。
+"""
+import os
+import sys
+import time
+
+# 本模块被导入的时刻，入口脚本应在第一行导入
+_T0 = time.perf_counter()
+
+
+def _process_age():
+    """进程已运行的秒数，无法获取时返回 None"""
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open('/proc/uptime') as f:
+                uptime = float(f.read().split()[0])
+            # starttime 为第 22 个字段（去掉前两个字段后下标 19），单位为时钟滴答
+            return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError, IndexError):
+            return None
+    if os.name == 'nt':
+        try:
+            import ctypes
+            from ctypes import wintypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+            times = [wintypes.FILETIME() for _ in range(4)]
+            if not kernel32.GetProcessTimes(kernel32.GetCurrentProcess(), *[ctypes.byref(t) for t in times]):
+                return None
+            now = wintypes.FILETIME()
+            kernel32.GetSystemTimeAsFileTime(ctypes.byref(now))
+            created = (times[0].dwHighDateTime << 32) | times[0].dwLowDateTime
+            current = (now.dwHighDateTime << 32) | now.dwLowDateTime
+            return (current - created) / 1e7
+        except Exception:
+            return None
+    return None
+
+
+class StartupTimer:
+    """按顺序记录启动各阶段的耗时"""
+
+    def __init__(self, origin=_T0):
+        self._origin = origin
+        self._last = origin
+        self.steps = []  # [(阶段名, 秒)]
+        self.ready_at = None
+        self.pre_python = None
+
+    def mark(self, label):
+        """记录从上一个节点到现在的阶段"""
+        now = time.perf_counter()
+        self.steps.append((label, now - self._last))
+        self._last = now
+
+    def ready(self):
+        """标记启动完成，返回从导入本模块到现在的秒数"""
+        if self.ready_at is None:
+            self.ready_at = time.perf_counter() - self._origin
+            age = _process_age()
+            if age is not None:
+                # /proc 的精度为一个时钟滴答，差值可能略小于 0
+                self.pre_python = max(0.0, age - self.ready_at)
+        return self.ready_at
+
+    def total(self):
+        if self.ready_at is None:
+            return None
+        return self.ready_at + (self.pre_python or 0.0)
+
+    def summary(self):
+        """一行启动耗时摘要（会先调用 ready()）"""
+        self.ready()
+        parts = []
+        if self.pre_python is not None:
+            parts.append(f"进程启动 {self.pre_python:.2f}")
+        parts.extend(f"{label} {seconds:.2f}" for label, seconds in self.steps)
+        return f"启动就绪 {self.total():.2f} 秒（{' | '.join(parts)}）"
+
+
+# 每个进程只运行一个工具，共用一个计时器
+timer = StartupTimer()
+
+
+def mark(label):
+    timer.mark(label)
+
+
+def summary():
+    return timer.summary()
@@ -0,0 +1,201 @@
+"""工位监控指标（Prometheus 文本格式）
+
+烧录工具和MAC读取工具可以在本机开一个 HTTP 端口，产线监控系统定时抓取 /metrics：
+
+    metrics = StationMetrics('flasher')
+    jobs = metrics.counter('esp32_jobs_total', 'Jobs by result', ('result',))
+    jobs.inc(result='success')
+    metrics.gauge('esp32_ui_queue_depth', 'Pending UI events', lambda: dispatcher.depth())
+    metrics.serve('127.0.0.1', 9108)
+
+计数器和直方图在任意线程中更新；仪表（gauge）在抓取时调用回调取值，
+回调返回数值，或返回 {标签值元组: 数值} 表示一组带标签的序列。
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 耗时直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def hub_of(location):
+    """USB 位置（如 1-4.3:1.0）所在的集线器（1-4）；直接接在主机端口上时返回总线号，
+    无位置信息时返回 'unknown'"""
+    if not location:
+        return 'unknown'
+    path = str(location).split(':', 1)[0]
+    return path.rsplit('.', 1)[0] if '.' in path else path.split('-', 1)[0]
+
+
+class _Metric:
+    def __init__(self, registry, name, help_text, labels):
+        self._lock = registry._lock
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, registry, name, help_text, labels=()):
+        super().__init__(registry, name, help_text, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labels:
+            values = [((), 0)]
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}  # 标签 -> [各桶计数, 总和, 次数]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help_text, callback, labels=()):
+        super().__init__(registry, name, help_text, labels)
+        self._callback = callback
+
+    def render(self):
+        try:
+            value = self._callback()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(v)}"
+                    for key, v in sorted(value.items())]
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class StationMetrics:
+    """一个工具进程的全部指标"""
+
+    def __init__(self, tool):
+        self.tool = tool
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._server = None
+        self.gauge('esp32_station_info', 'Tool running on this station', lambda: {(tool,): 1}, ('tool',))
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(self, name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self, name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, callback, labels=()):
+        return self._add(Gauge(self, name, help_text, callback, labels))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    @property
+    def serving(self):
+        return self._server is not None
+
+    def serve(self, host, port):
+        """在后台线程中提供 http://host:port/metrics，返回实际监听的端口"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # 工具的 stderr 已重定向到日志窗口，抓取请求不写日志
+                pass
+
+        self._server = ThreadingHTTPServer((host, int(port)), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="指标服务", daemon=True).start()
+        return self._server.server_address[1]
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,25 @@
+"""测试公共设置：模块都在仓库根目录下（平铺），测试从 tests/ 中导入"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    """可控的时钟，代替 time.monotonic / time.time 注入被测对象；测试中调用 advance() 或直接修改 now"""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
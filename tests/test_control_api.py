@@ -0,0 +1,150 @@
+import base64
+import http.client
+import json
+import os
+import socket
+import time
+
+import pytest
+
+from control_api import ControlServer, EventHub, _hostname
+
+
+class FakeHandler:
+    def __init__(self):
+        self.started = []
+
+    def api_status(self):
+        return {'ports': []}
+
+    def api_load_manifest(self, data):
+        return {'loaded': len(data.get('firmwares', []))}
+
+    def api_start(self, data):
+        self.started.append(data)
+        return {'started': data.get('ports', [])}
+
+    def api_stop(self, data):
+        return {'stopped': True}
+
+    def api_records(self, since):
+        return {'records': [], 'next': since}
+
+
+@pytest.fixture
+def server(request):
+    token = getattr(request, 'param', None)
+    handler = FakeHandler()
+    control = ControlServer(handler, EventHub(), token)
+    port = control.serve('127.0.0.1', 0)
+    yield control, handler, port
+    control.shutdown()
+
+
+def call(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b'null')
+    finally:
+        conn.close()
+
+
+JSON = {'Content-Type': 'application/json'}
+
+
+@pytest.mark.parametrize('value, host', [
+    ('127.0.0.1:9200', '127.0.0.1'),
+    ('[::1]:9200', '::1'),
+    ('LOCALHOST', 'localhost'),
+    ('http://evil.example:80', 'evil.example'),
+    ('null', 'null'),
+])
+def test_hostname(value, host):
+    assert _hostname(value) == host
+
+
+def test_local_requests_accepted(server):
+    control, handler, port = server
+    assert call(port, 'GET', '/status') == (200, {'ports': []})
+    status, result = call(port, 'POST', '/jobs', b'{"ports": ["COM3"]}',
+                          {'Content-Type': 'application/json; charset=utf-8', 'Origin': 'http://localhost:8080'})
+    assert (status, result) == (200, {'started': ['COM3']})
+
+
+def test_post_requires_json_content_type(server):
+    control, handler, port = server
+    status, _ = call(port, 'POST', '/jobs', b'{"ports": ["COM3"]}',
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+    assert status == 415
+    status, _ = call(port, 'POST', '/jobs/stop', b'')
+    assert status == 415
+    assert handler.started == []
+
+
+def test_cross_origin_rejected(server):
+    control, handler, port = server
+    status, _ = call(port, 'POST', '/jobs', b'{}', dict(JSON, Origin='http://evil.example'))
+    assert status == 403
+    status, _ = call(port, 'GET', '/status', headers={'Origin': 'null'})
+    assert status == 403
+    assert handler.started == []
+
+
+def test_rebound_host_rejected(server):
+    control, handler, port = server
+    status, _ = call(port, 'GET', '/status', headers={'Host': f'evil.example:{port}'})
+    assert status == 403
+
+
+@pytest.mark.parametrize('server', ['secret'], indirect=True)
+def test_token_allows_other_host_names(server):
+    control, handler, port = server
+    headers = {'Host': f'station-7:{port}'}
+    assert call(port, 'GET', '/status', headers=headers)[0] == 401
+    headers['Authorization'] = 'Bearer secret'
+    assert call(port, 'GET', '/status', headers=headers)[0] == 200
+    # 令牌不放行跨站请求
+    headers['Origin'] = 'http://evil.example'
+    assert call(port, 'GET', '/status', headers=headers)[0] == 403
+
+
+def websocket_upgrade(port, origin=None):
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    lines = ['GET /events HTTP/1.1', f'Host: 127.0.0.1:{port}', 'Upgrade: websocket',
+             'Connection: Upgrade', f'Sec-WebSocket-Key: {key}', 'Sec-WebSocket-Version: 13']
+    if origin:
+        lines.append(f'Origin: {origin}')
+    sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+    sock.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode('ascii'))
+    return sock, sock.recv(4096).split(b'\r\n')[0]
+
+
+def test_websocket_cross_origin_rejected(server):
+    control, handler, port = server
+    sock, status = websocket_upgrade(port, 'http://evil.example')
+    sock.close()
+    assert b' 403 ' in status
+    assert control.hub._subscribers == []
+
+
+def test_websocket_close_with_full_queue(server, monkeypatch):
+    import control_api
+    monkeypatch.setattr(control_api, '_SUBSCRIBER_QUEUE', 2)
+    control, handler, port = server
+    sock, status = websocket_upgrade(port, 'http://127.0.0.1')
+    assert b' 101 ' in status
+    for index in range(10):
+        control.hub.publish('phase', index=index)
+    # 客户端发送 close 帧（掩码为 0），服务端不应卡在已满的队列上
+    sock.sendall(bytes([0x88, 0x80, 0, 0, 0, 0]))
+    sock.settimeout(5)
+    while sock.recv(4096):
+        pass
+    sock.close()
+    for _ in range(50):
+        if not control.hub._subscribers:
+            break
+        time.sleep(0.05)
+    assert control.hub._subscribers == []
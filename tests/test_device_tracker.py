@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+from device_tracker import RecentDeviceTable, native_usb_serial
+
+
+def port(vid=None, pid=None, serial_number=None, location=None, device='COM3'):
+    return SimpleNamespace(vid=vid, pid=pid, serial_number=serial_number, location=location, device=device)
+
+
+def test_native_usb_serial_only_for_espressif():
+    assert native_usb_serial(port(0x303A, 0x1001, 'F4:12:FA:00:11:22')) == 'F4:12:FA:00:11:22'
+    assert native_usb_serial(port(0x10C4, 0xEA60, '0001')) is None
+    assert native_usb_serial(port(0x1A86, 0x7523, '0001')) is None
+    assert native_usb_serial(None) is None
+
+
+def test_recent_by_mac_and_serial():
+    table = RecentDeviceTable(cooldown=60)
+    table.mark(mac='24-0A-C4-00-00-01', usb_serial='F4:12:FA:00:11:22')
+    assert table.is_recent(mac='24:0a:c4:00:00:01')
+    assert table.is_recent(usb_serial='F4:12:FA:00:11:22')
+    assert not table.is_recent(mac='24:0a:c4:00:00:02')
+    assert not table.is_recent(mac='Unknown')
+
+
+def test_shared_bridge_serial_does_not_mark_other_boards():
+    # 两块板子接在序列号相同的 CP210x 上：序列号不参与识别，只按 MAC
+    table = RecentDeviceTable(cooldown=60)
+    bridge = port(0x10C4, 0xEA60, '0001')
+    table.mark(mac='24:0a:c4:00:00:01', usb_serial=native_usb_serial(bridge))
+    assert not table.is_recent(mac='24:0a:c4:00:00:02', usb_serial=native_usb_serial(bridge))
+
+
+def test_cooldown_disabled():
+    table = RecentDeviceTable(cooldown=0)
+    table.mark(mac='24:0a:c4:00:00:01')
+    assert not table.is_recent(mac='24:0a:c4:00:00:01')
+
+
+def test_device_key_native_usb_by_serial():
+    from device_tracker import device_key
+    a = port(0x303A, 0x1001, 'F4:12:FA:00:11:22', '1-4.1', 'COM5')
+    moved = port(0x303A, 0x1001, 'F4:12:FA:00:11:22', '1-4.1', 'COM9')
+    assert device_key(a) == device_key(moved) == 'usb:F4:12:FA:00:11:22'
+
+
+def test_device_key_bridges_with_shared_serial_are_distinct():
+    from device_tracker import FlashSession, device_key
+    a = port(0x10C4, 0xEA60, '0001', '1-4.1', 'COM5')
+    b = port(0x10C4, 0xEA60, '0001', '1-4.2', 'COM6')
+    assert device_key(a) != device_key(b)
+    assert not FlashSession(device_key(a), 'COM5').follows_reenumeration
+    assert device_key(port(0x10C4, 0xEA60, '0001', None, 'COM7')) == 'COM7'
@@ -0,0 +1,129 @@
+import os
+
+import pytest
+
+from esp_image import ImageCache, check_target, inspect_data, parse_image
+
+bin_image = pytest.importorskip('esptool.bin_image')
+
+
+def build_image(cls, flash_size=None, digest=True, min_rev=0, max_rev=None):
+    """用 esptool 生成一个两段的镜像"""
+    image = cls()
+    # 内部 RAM 的段（Flash 映射的段会被 esptool 按 64KB 对齐）
+    dram, iram = (0x3FFB0000, 0x40080000) if cls is bin_image.ESP32FirmwareImage else (0x3FC88000, 0x40380000)
+    image.segments = [bin_image.ELFSection(b'.dram0.data', dram, os.urandom(1000), 0),
+                      bin_image.ELFSection(b'.iram0.text', iram, os.urandom(4001), 0)]
+    image.entrypoint = iram
+    image.append_digest = digest
+    if flash_size is not None:
+        image.flash_size_freq = flash_size << 4
+    if cls is not bin_image.ESP32FirmwareImage:
+        image.min_rev_full = min_rev
+        image.max_rev_full = max_rev if max_rev is not None else image.max_rev_full
+    return image
+
+
+def image_bytes(tmp_path, image, name='image.bin'):
+    path = str(tmp_path / name)
+    image.save(path)
+    with open(path, 'rb') as f:
+        return path, f.read()
+
+
+def test_parse_valid_images(tmp_path):
+    _, data = image_bytes(tmp_path, build_image(bin_image.ESP32S3FirmwareImage))
+    info = parse_image(data)
+    assert info.errors == []
+    assert info.chip == 'ESP32-S3' and info.hash_appended and len(info.segments) == 2
+    _, data = image_bytes(tmp_path, build_image(bin_image.ESP32C3FirmwareImage, digest=False))
+    info = parse_image(data)
+    assert info.errors == [] and info.chip == 'ESP32-C3' and info.sha256 is None
+
+
+def test_structural_errors(tmp_path):
+    _, data = image_bytes(tmp_path, build_image(bin_image.ESP32S3FirmwareImage))
+    corrupted = bytearray(data)
+    corrupted[500] ^= 1
+    # 段数据中的一个字节：校验和与 SHA-256 都不一致
+    errors = parse_image(bytes(corrupted)).errors
+    assert errors[0].startswith("校验和不一致") and errors[1] == "附加的 SHA-256 与镜像内容不一致"
+    assert parse_image(data[:3000]).errors[0].startswith("第 2 段")
+    assert parse_image(b'\xE8' + data[1:]).errors == ["魔数错误: 0xE8（应为 0xE9）"]
+    assert parse_image(data[:10]).errors == ["镜像头不完整"]
+
+
+def test_non_images_not_checked():
+    assert inspect_data('pt.bin', b'\xAA\x50' + bytes(100)).kind == 'partition_table'
+    assert inspect_data('nvs.bin', bytes(100)).kind == 'data'
+    assert inspect_data('spiffs.bin', b'\xff' * 100).kind == 'data'
+
+
+def test_chip_mismatch(tmp_path):
+    _, data = image_bytes(tmp_path, build_image(bin_image.ESP32S3FirmwareImage))
+    firmware = inspect_data('app.bin', data)
+    assert check_target(firmware, '0x10000', 'ESP32-S3') == []
+    assert check_target(firmware, '0x10000', 'ESP32') == ["0x10000 处的镜像是 ESP32-S3 的，目标芯片是 ESP32"]
+
+
+def test_revision_range(tmp_path):
+    _, data = image_bytes(tmp_path, build_image(bin_image.ESP32C3FirmwareImage, min_rev=3, max_rev=199))
+    firmware = inspect_data('app.bin', data)
+    assert check_target(firmware, '0x10000', 'ESP32-C3', 'v0.4') == []
+    assert check_target(firmware, '0x10000', 'ESP32-C3', 'v0.2') == \
+        ["0x10000 处的镜像要求芯片版本不低于 v0.3，芯片为 v0.2"]
+    assert check_target(firmware, '0x10000', 'ESP32-C3', 'v2.0') == \
+        ["0x10000 处的镜像支持的芯片版本最高为 v1.99，芯片为 v2.0"]
+    # 无法解析的版本不检查
+    assert check_target(firmware, '0x10000', 'ESP32-C3', 'unknown') == []
+
+
+def test_bootloader_offset_and_flash_size(tmp_path):
+    _, data = image_bytes(tmp_path, build_image(bin_image.ESP32FirmwareImage, flash_size=3))  # 8MB
+    firmware = inspect_data('bootloader.bin', data)
+    assert check_target(firmware, '0x1000', 'ESP32', flash_size='8MB') == []
+    assert check_target(firmware, '0x1000', 'ESP32', flash_size='4MB') == \
+        ["引导程序头中的 Flash 容量为 8MB，芯片实际只有 4MB"]
+    assert check_target(firmware, '0x0', 'ESP32') == ["引导程序烧录在 0x0，ESP32 的引导程序地址应为 0x1000"]
+
+
+def test_merged_image(tmp_path):
+    _, boot = image_bytes(tmp_path, build_image(bin_image.ESP32FirmwareImage), 'boot.bin')
+    _, app = image_bytes(tmp_path, build_image(bin_image.ESP32FirmwareImage), 'app.bin')
+    merged = (b'\xff' * 0x1000 + boot).ljust(0x10000, b'\xff') + app
+    firmware = inspect_data('merged.bin', merged)
+    assert firmware.kind == 'merged'
+    assert [image.offset for image in firmware.images] == [0x1000, 0x10000]
+    assert check_target(firmware, '0x0', 'ESP32') == []
+    assert len(check_target(firmware, '0x0', 'ESP32-S3')) == 2
+
+
+def test_image_cache(tmp_path):
+    path, _ = image_bytes(tmp_path, build_image(bin_image.ESP32FirmwareImage))
+    cache = ImageCache()
+    first = cache.inspect(path)
+    assert cache.inspect(path) is first
+    assert cache.has_bootloader([(path, '0x1000')])
+    assert not cache.has_bootloader([(path, '0x10000'), (str(tmp_path / 'missing.bin'), '0x0')])
+    with open(path, 'wb') as f:
+        f.write(b'\xAA\x50' + bytes(100))
+    assert cache.inspect(path).kind == 'partition_table'
+
+
+def test_engine_rejects_wrong_chip_before_writing(tmp_path):
+    esp_emulator = pytest.importorskip('esp_emulator')
+    from flash_engine import FAIL, FlashEngine, FlashOptions
+    path, _ = image_bytes(tmp_path, build_image(bin_image.ESP32FirmwareImage))
+    lines = []
+    engine = FlashEngine(on_log=lambda job, line: lines.append(line))
+    engine.configure({'link_quality_file': str(tmp_path / 'lq.json'),
+                      'reset_strategy_file': str(tmp_path / 'rs.json'),
+                      'port_lease_dir': str(tmp_path / 'leases')})
+    device = esp_emulator.start_devices(1, 'ESP32-S3')[0]
+    try:
+        job = engine.flash(device.port, [(path, '0x10000')], FlashOptions(baud=460800))
+    finally:
+        device.stop()
+    assert job.result == FAIL
+    assert job.note == "固件镜像与芯片不符: image.bin: 0x10000 处的镜像是 ESP32 的，目标芯片是 ESP32-S3"
+    assert not any('Writing at' in line for line in lines)
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+import esptool_launcher
+from esptool_launcher import ESPTOOL_FLAG, FLASH_MD5_FLAG, esptool_command, flash_md5_command
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_source_commands():
+    assert esptool_command() == [sys.executable, '-m', 'esptool']
+    assert flash_md5_command() == [sys.executable, os.path.join(ROOT, 'flash_md5.py')]
+
+
+def test_frozen_commands_relaunch_tool(monkeypatch):
+    monkeypatch.setattr(sys, 'frozen', True, raising=False)
+    monkeypatch.setattr(sys, 'executable', r'C:\tools\esp32_flasher.exe')
+    assert esptool_command() == [r'C:\tools\esp32_flasher.exe', ESPTOOL_FLAG]
+    assert flash_md5_command() == [r'C:\tools\esp32_flasher.exe', FLASH_MD5_FLAG]
+
+
+def test_passthrough_ignores_normal_arguments():
+    assert esptool_launcher.run_passthrough([]) is None
+    assert esptool_launcher.run_passthrough(['--profile', 'cpu']) is None
+
+
+def run_as_frozen_tool(args):
+    """模拟 --windowed 打包的工具被引擎以子进程启动：没有 sys.stdout，入口先调用 run_passthrough"""
+    script = ("import sys; sys.stdout = sys.stderr = None; "
+              "import esptool_launcher; esptool_launcher.run_passthrough(); "
+              "raise SystemExit('界面不应启动')")
+    return subprocess.run([sys.executable, '-c', script] + args, cwd=ROOT, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, text=True, timeout=60)
+
+
+def test_passthrough_runs_esptool():
+    result = run_as_frozen_tool([ESPTOOL_FLAG, 'version'])
+    assert result.returncode == 0, result.stdout
+    assert 'esptool' in result.stdout
+
+
+def test_passthrough_reports_esptool_fatal_error():
+    result = run_as_frozen_tool([ESPTOOL_FLAG, '--port', '/dev/nonexistent-esp', 'read_mac'])
+    assert result.returncode != 0
+    assert '界面不应启动' not in result.stdout
+
+
+def test_passthrough_runs_flash_md5():
+    result = run_as_frozen_tool([FLASH_MD5_FLAG, '--port', '/dev/nonexistent-esp', '0x0:4096'])
+    assert result.returncode == 2
+    assert 'A fatal error occurred' in result.stdout
@@ -0,0 +1,75 @@
+import os
+import random
+
+import pytest
+
+from esptool_output import EsptoolOutputParser, chip_family
+
+TRANSCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'transcripts')
+FILES = sorted(name for name in os.listdir(TRANSCRIPTS) if name.endswith('.txt'))
+
+
+def parse(name, chunked=False):
+    with open(os.path.join(TRANSCRIPTS, name), encoding='utf-8') as f:
+        text = f.read()
+    parser = EsptoolOutputParser()
+    if chunked:
+        # 任意切分的文本块（重定向 stdout 时 write 的调用方式）
+        rng = random.Random(name)
+        position = 0
+        while position < len(text):
+            size = rng.randint(1, 40)
+            parser.feed_text(text[position:position + size])
+            position += size
+    else:
+        for line in text.splitlines():
+            parser.feed(line)
+    parser.close()
+    return parser
+
+
+@pytest.mark.parametrize('name', FILES)
+def test_transcript(name):
+    _, chip, command = name[:-4].split('_', 2)
+    parser = parse(name)
+    if chip == 'none':
+        assert parser.chip is None
+        assert parser.fatal
+        if command == 'no_response':
+            assert parser.sync_attempts > 0
+        return
+    assert parser.chip == chip
+    assert parser.mac == '24:0a:c4:00:00:01'
+    assert parser.revision == 'v0.0'
+    if command == 'flash_id':
+        assert parser.flash_size == '4MB'
+    elif command == 'write_flash':
+        assert len(parser.transfers) == 1
+        assert parser.verified is True
+        assert parser.write_address is not None
+    elif command == 'verify_flash':
+        assert parser.verified is True
+    elif command == 'verify_mismatch':
+        assert parser.verified is False
+        assert parser.fatal
+
+
+@pytest.mark.parametrize('name', FILES)
+def test_chunked_input_matches_lines(name):
+    by_line, chunked = parse(name), parse(name, chunked=True)
+    for attribute in ('chip', 'mac', 'revision', 'flash_size', 'verified', 'fatal', 'write_address'):
+        assert getattr(chunked, attribute) == getattr(by_line, attribute)
+
+
+def test_connect_dots_followed_by_note():
+    parser = EsptoolOutputParser()
+    # "Connecting..." 本身的三个点不算，其后每个点或下划线是一次重试；同一行的 NOTE 不计入
+    parser.feed("Connecting....NOTE: Failed to get VID/PID of a device on /dev/pts/4")
+    assert parser.sync_attempts == 1
+
+
+def test_chip_family():
+    assert chip_family('ESP32-D0WDQ6') == 'ESP32'
+    assert chip_family('esp32s3') == 'ESP32-S3'
+    assert chip_family('ESP32-C3 (QFN32)') == 'ESP32-C3'
+    assert chip_family('unknown') is None
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from firmware_profiles import ProfileRouter, normalize_chip, parse_profiles
+
+PROFILES = [
+    {'name': 'S3 通用', 'chip': 'esp32s3', 'firmwares': [{'path': 's3/app.bin', 'address': '0x10000'}]},
+    {'name': 'S3 8MB', 'chip': 'ESP32-S3', 'flash_size': '8MB',
+     'firmwares': [{'path': 's3/app8.bin', 'address': '0x10000'}]},
+    {'name': 'C3 原生USB', 'chip': 'ESP32-C3', 'vid_pid': '303a:1001',
+     'firmwares': [{'path': '/abs/merged.bin'}]},
+]
+
+
+def test_normalize_chip():
+    assert normalize_chip('ESP32-S3') == normalize_chip('esp32s3') == 'ESP32S3'
+    assert normalize_chip(None) == ''
+
+
+def test_parse_profiles_resolves_relative_paths():
+    profiles = parse_profiles(PROFILES, base_dir='/fw')
+    assert profiles[0].firmwares == [(os.path.join('/fw', 's3/app.bin'), '0x10000')]
+    assert profiles[2].firmwares == [('/abs/merged.bin', '0x0')]
+    assert parse_profiles(None) == []
+
+
+@pytest.mark.parametrize('value, message', [
+    ({'chip': 'ESP32'}, "应为列表"),
+    ([{'firmwares': [{'path': 'a.bin'}]}], "#1 缺少 chip"),
+    ([{'chip': 'ESP32', 'firmwares': [{'address': '0x0'}]}], "#1 的固件缺少 path"),
+    ([{'chip': 'ESP32', 'firmwares': [{'path': 'a.bin', 'address': 'boot'}]}], "#1 的地址无效: boot"),
+    ([{'chip': 'ESP32', 'firmwares': []}], "#1 没有固件"),
+])
+def test_parse_profiles_errors(value, message):
+    with pytest.raises(ValueError, match=message):
+        parse_profiles(value)
+
+
+def test_select_most_specific_match():
+    router = ProfileRouter()
+    router.load(PROFILES)
+    assert router.needs_flash_size
+    assert router.select('ESP32-S3', '8MB').name == 'S3 8MB'
+    assert router.select('ESP32-S3', '4MB').name == 'S3 通用'
+    assert router.select('ESP32-S3').name == 'S3 通用'
+    assert router.select('ESP32-C3', None, '303A:1001').name == 'C3 原生USB'
+    assert router.select('ESP32-C3', None, '1A86:7523') is None
+    assert router.select('ESP32') is None
+
+
+def test_precache_and_check_changes(tmp_path):
+    (tmp_path / 'app.bin').write_bytes(b'a' * 100)
+    router = ProfileRouter()
+    router.load([{'name': 'C3', 'chip': 'ESP32-C3', 'firmwares': [{'path': 'app.bin'}, {'path': 'gone.bin'}]}],
+                str(tmp_path))
+    logged = []
+    problems = router.precache(logged.append)
+    assert len(problems) == 1 and 'gone.bin' in problems[0] and logged == problems
+    path = str(tmp_path / 'app.bin')
+    assert router.digest(path) is not None
+
+    profile = router.profiles[0]
+    profile.firmwares = profile.firmwares[:1]
+    assert router.check(profile) == []
+    with open(path, 'wb') as f:
+        f.write(b'b' * 101)
+    assert router.check(profile) == [path]
+    assert router.check(profile) == []
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from flash_engine import BUSY, FAIL, SUCCESS, FlashEngine, FlashOptions
+from port_lease import PortLeases
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = FlashEngine()
+    engine.configure({'link_quality_file': str(tmp_path / 'lq.json'),
+                      'reset_strategy_file': str(tmp_path / 'rs.json'),
+                      'port_lease_dir': str(tmp_path / 'leases')})
+    return engine
+
+
+def test_port_leased_by_other_instance(engine, tmp_path):
+    messages = []
+    engine.on_message = messages.append
+    other = PortLeases('readmac', str(tmp_path / 'leases'))
+    assert other.acquire('/dev/ttyFAKE0')
+    try:
+        job = engine.flash('/dev/ttyFAKE0', [], FlashOptions())
+    finally:
+        other.release('/dev/ttyFAKE0')
+    assert job.result == BUSY
+    assert job.holder == f"MAC读取工具 (PID {os.getpid()})"
+    assert job.note == f"端口正被 {job.holder} 使用"
+    assert f"端口 /dev/ttyFAKE0 正被 {job.holder} 使用，跳过" in messages
+
+
+def test_flash_on_emulator(engine, tmp_path):
+    esp_emulator = pytest.importorskip('esp_emulator')  # 伪终端，仅 Linux/macOS
+    path = tmp_path / 'app.bin'
+    path.write_bytes(os.urandom(0x4000))
+    records = []
+    engine.on_record = records.append
+    device = esp_emulator.start_devices(1, 'ESP32-C3', mac_base=0x240AC4000010)[0]
+    try:
+        job = engine.flash(device.port, [(str(path), '0x10000')], FlashOptions(baud=460800))
+    finally:
+        device.stop()
+    assert job.result == SUCCESS, job.note
+    assert job.chip == 'ESP32-C3'
+    assert job.mac == '24:0a:c4:00:00:10'
+    assert job.holder is None
+    assert records == [job]
+
+
+def test_profile_routing_on_emulator(engine, tmp_path):
+    esp_emulator = pytest.importorskip('esp_emulator')
+    path = tmp_path / 'c3.bin'
+    path.write_bytes(os.urandom(0x2000))
+    engine.configure({'link_quality_file': str(tmp_path / 'lq.json'),
+                      'reset_strategy_file': str(tmp_path / 'rs.json'),
+                      'port_lease_dir': str(tmp_path / 'leases'),
+                      'firmware_profiles': [{'name': 'C3 传感器', 'chip': 'ESP32-C3',
+                                             'firmwares': [{'path': str(path), 'address': '0x10000'}]}]})
+    devices = esp_emulator.start_devices(1, 'ESP32-C3') + esp_emulator.start_devices(1, 'ESP32-S3')
+    try:
+        c3 = engine.flash(devices[0].port, [], FlashOptions(baud=460800))
+        s3 = engine.flash(devices[1].port, [], FlashOptions(baud=460800))
+    finally:
+        for device in devices:
+            device.stop()
+    assert c3.result == SUCCESS and c3.profile == 'C3 传感器'
+    assert '固件配置 C3 传感器' in c3.note
+    assert s3.result == FAIL
+    assert s3.note == "没有匹配芯片 ESP32-S3 的固件配置"
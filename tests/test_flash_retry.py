@@ -0,0 +1,60 @@
+import pytest
+
+from flash_retry import (FLASH_WRITE, LINK, OTHER, PORT, SYNC, TIMEOUT, VERIFY, DEFAULT_RETRY_LIMITS,
+                         EsptoolError, backoff_delay, classify_error, describe_error, fatal_message,
+                         load_retry_limits, resume_address)
+from flash_watchdog import WatchdogTimeout
+
+
+def esptool_error(fatal):
+    return EsptoolError("esptool exited with code 2", f"Connecting....\nA fatal error occurred: {fatal}\n")
+
+
+@pytest.mark.parametrize('fatal, category', [
+    ("Failed to connect to ESP32: No serial data received.", SYNC),
+    ("Failed to connect to ESP32-S3: Wrong boot mode detected (0x8)!", SYNC),
+    ("Invalid head of packet (0x65): Possible serial noise or corruption.", LINK),
+    ("Serial data stream stopped: Possible serial noise or corruption.", LINK),
+    ("Packet content transfer stopped (received 8 bytes)", LINK),
+    ("Failed to write to target Flash after seq 12 (result was 0106)", FLASH_WRITE),
+    ("MD5 of file does not match data in flash!", VERIFY),
+    ("Could not open /dev/ttyUSB0, the port is busy or doesn't exist. (could not open port)", PORT),
+    ("Something unexpected", OTHER),
+])
+def test_classify(fatal, category):
+    assert classify_error(esptool_error(fatal)) == category
+
+
+def test_classify_timeout():
+    assert classify_error(WatchdogTimeout('write', 10)) == TIMEOUT
+
+
+def test_describe_error_uses_fatal_message_and_retries():
+    exc = esptool_error("Failed to connect to ESP32: No serial data received.")
+    exc.retries = 2
+    assert describe_error(exc) == "同步失败: Failed to connect to ESP32: No serial data received. (已重试2次)"
+    assert fatal_message("no fatal here") is None
+
+
+def test_load_retry_limits():
+    limits = load_retry_limits({'sync': '5', 'link': -1, 'verify': 'x', 'bogus': 3})
+    assert limits[SYNC] == 5
+    assert limits[LINK] == 0
+    assert limits[VERIFY] == DEFAULT_RETRY_LIMITS[VERIFY]
+    assert 'bogus' not in limits
+
+
+def test_backoff_is_capped():
+    assert backoff_delay(1, 1) == 1
+    assert backoff_delay(1, 3) == 4
+    assert backoff_delay(1, 10) == 10
+
+
+def test_resume_address():
+    base, size = 0x10000, 0x60000
+    # 回退一个写入块并按扇区对齐
+    assert resume_address(0x3bfef, base, size) == 0x37000
+    # 尚未开始写入、刚开始写入或超出范围时不能续写
+    assert resume_address(None, base, size) is None
+    assert resume_address(0x13ff9, base, size) is None
+    assert resume_address(0x80000, base, size) is None
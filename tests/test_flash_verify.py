@@ -0,0 +1,88 @@
+import os
+import random
+
+import pytest
+
+import flash_md5
+from flash_verify import FULL, HASH, SAMPLE, DigestCache, VerifyPolicy, compare_region, mode_from_label, readback_regions
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_sample_policy_first_unit_full_then_every_n():
+    policy = VerifyPolicy(SAMPLE, sample_every=3)
+    assert [policy.next_unit() for _ in range(7)] == [FULL, HASH, HASH, SAMPLE, HASH, HASH, SAMPLE]
+    policy.reset()
+    assert policy.next_unit() == FULL
+    assert VerifyPolicy(HASH).next_unit() == HASH
+
+
+def test_mode_from_label():
+    assert mode_from_label('全量回读') == FULL
+    assert mode_from_label('sample') == SAMPLE
+    assert mode_from_label('bogus') == HASH
+
+
+def test_readback_regions(tmp_path):
+    a = write(tmp_path, 'a.bin', b'\x01' * 0x2800)
+    b = write(tmp_path, 'b.bin', b'\x02' * 0x1000)
+    full = readback_regions([(a, '0x10000'), (b, '0x8000')], FULL)
+    assert full == [(a, 0x10000, 0, 0x2800), (b, 0x8000, 0, 0x1000)]
+    sample = readback_regions([(a, '0x10000'), (b, '0x8000')], SAMPLE, 2, random.Random(1))
+    assert len(sample) == 2
+    assert [region[1] for region in sample] == sorted(region[1] for region in sample)
+    assert all(region[3] <= 0x1000 for region in sample)
+
+
+def test_compare_region(tmp_path):
+    path = write(tmp_path, 'fw.bin', bytes(range(256)) * 16)
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert compare_region(path, 0x100, 0x200, data[0x100:0x300]) is None
+    corrupted = bytearray(data[0x100:0x300])
+    corrupted[5] ^= 0xFF
+    assert compare_region(path, 0x100, 0x200, bytes(corrupted)) == 0x105
+    # 回读数据不足
+    assert compare_region(path, 0x100, 0x200, data[0x100:0x180]) == 0x180
+
+
+def test_digest_cache_recomputes_after_change(tmp_path):
+    path = write(tmp_path, 'fw.bin', b'a' * 1000)
+    cache = DigestCache()
+    first = cache.md5(path)
+    assert first == cache.md5(path)
+    with open(path, 'wb') as f:
+        f.write(b'b' * 1001)
+    assert cache.md5(path) != first
+
+
+def test_md5_line_round_trip():
+    line = flash_md5.format_line(0x10000, 409600, '0123456789abcdef0123456789abcdef')
+    assert flash_md5.parse_line(line) == (0x10000, 409600, '0123456789abcdef0123456789abcdef')
+    assert flash_md5.parse_line("Verifying flash MD5 at 0x00010000 (409600 bytes)...") is None
+
+
+def test_md5_verify_on_emulator(tmp_path):
+    esp_emulator = pytest.importorskip('esp_emulator')  # 伪终端，仅 Linux/macOS
+    from flash_engine import FlashEngine, FlashOptions, SUCCESS, FAIL
+    a = write(tmp_path, 'a.bin', os.urandom(0x3000))
+    b = write(tmp_path, 'b.bin', os.urandom(0x2000))
+    device = esp_emulator.start_devices(1, 'ESP32-S3')[0]
+    try:
+        engine = FlashEngine()
+        engine.configure({'link_quality_file': str(tmp_path / 'lq.json'),
+                          'reset_strategy_file': str(tmp_path / 'rs.json'),
+                          'port_lease_dir': str(tmp_path / 'leases')})
+        job = engine.flash(device.port, [(a, '0x10000'), (b, '0x20000')], FlashOptions(baud=460800))
+        assert job.result == SUCCESS
+        assert job.verify[0] == '快速(MD5)'
+        # b 覆盖了 a 的后半部分：写入时各段自身校验通过，整体 MD5 校验发现
+        job = engine.flash(device.port, [(a, '0x10000'), (b, '0x11000')], FlashOptions(baud=460800))
+        assert job.result == FAIL
+        assert 'MD5校验不一致' in job.note
+    finally:
+        device.stop()
@@ -0,0 +1,123 @@
+import os
+
+import pytest
+
+from esptool_output import OutputSplitter
+from flash_watchdog import DEFAULT_DEADLINES, PhaseWatchdog, load_deadlines
+
+TRANSCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'transcripts')
+
+
+def start_write(watchdog, size=400 * 1024):
+    watchdog.feed("Connecting....")
+    watchdog.feed("Uploading stub...")
+    watchdog.feed(f"Flash will be erased from 0x00010000 to 0x{0x10000 + size - 1:08x}...")
+    assert watchdog.phase == 'write'
+
+
+def test_sync_timeout(clock):
+    watchdog = PhaseWatchdog(clock=clock)
+    clock.advance(DEFAULT_DEADLINES['sync'] - 1)
+    assert watchdog.expired() is None
+    clock.advance(2)
+    assert watchdog.expired() == 'sync'
+
+
+def test_slow_write_with_progress_never_expires(clock):
+    # 115200 波特率写 400KB 约需 40 秒，远超按数据量估算的时限，但进度一直在推进
+    watchdog = PhaseWatchdog(clock=clock)
+    start_write(watchdog)
+    initial = watchdog.limit
+    for percent in range(0, 101, 4):
+        clock.advance(1.5)
+        watchdog.feed(f"Writing at 0x{0x10000 + percent * 4096:08x}... ({percent} %)")
+        assert watchdog.expired() is None
+    assert clock.now > initial
+    assert watchdog.phase == 'write'
+
+
+def test_v5_progress_lines_rearm(clock):
+    watchdog = PhaseWatchdog(clock=clock)
+    start_write(watchdog)
+    for _ in range(10):
+        clock.advance(DEFAULT_DEADLINES['write_stall'] - 1)
+        watchdog.feed("Writing at 0x00013ff9 ━━━━╸          16.6% 16.00kB/96.39kB [0s]")
+        assert watchdog.expired() is None
+
+
+def test_write_stall_expires(clock):
+    watchdog = PhaseWatchdog(clock=clock)
+    start_write(watchdog)
+    watchdog.feed("Writing at 0x00010000... (4 %)")
+    assert watchdog.stalled
+    clock.advance(DEFAULT_DEADLINES['write_stall'] + 0.5)
+    assert watchdog.expired() == 'write'
+
+
+def test_write_stall_zero_disables(clock):
+    watchdog = PhaseWatchdog(load_deadlines({'write_stall': 0}), clock=clock)
+    start_write(watchdog)
+    watchdog.feed("Writing at 0x00010000... (4 %)")
+    clock.advance(3600)
+    assert watchdog.expired() is None
+
+
+def test_durations_and_phase_callback(clock):
+    phases = []
+    watchdog = PhaseWatchdog(clock=clock, on_phase=lambda phase, start, end: phases.append(phase))
+    clock.advance(1)
+    start_write(watchdog)
+    clock.advance(2)
+    watchdog.feed("Writing at 0x00010000... (50 %)")
+    clock.advance(2)
+    watchdog.feed("Wrote 409600 bytes (1000 compressed) at 0x00010000 in 4.0 seconds")
+    clock.advance(1)
+    durations = watchdog.finish()
+    # 进度只重新计时，不拆分阶段
+    assert phases == ['sync', 'stub', 'write', 'verify']
+    assert durations['write'] == 4
+    assert durations['verify'] == 1
+
+
+@pytest.mark.parametrize('name', ['v4.8_ESP32-S3_read_flash.txt', 'v5.6_ESP32-S3_read_flash.txt'])
+def test_slow_read_flash_replay(name, clock):
+    # 按引擎的切分方式重放回读输出，回读开始后每段输出间隔 3 秒：整个回读远超 stub 时限，但一直有进度
+    with open(os.path.join(TRANSCRIPTS, name), encoding='utf-8') as f:
+        text = f.read()
+    phases = []
+    watchdog = PhaseWatchdog(clock=clock, reading=True, on_phase=lambda phase, start, end: phases.append(phase))
+    splitter = OutputSplitter()
+    pieces = splitter.feed(text) + splitter.close()
+    assert len([piece for piece, complete in pieces if not complete]) == (7 if name.startswith('v4') else 0)
+    reading = False
+    for piece, _ in pieces:
+        clock.advance(3 if reading else 0.1)
+        watchdog.feed(piece)
+        reading = reading or piece.startswith('Configuring flash size')
+        assert watchdog.expired() is None, (piece, watchdog.phase)
+    watchdog.finish()
+    assert phases[-2:] == ['verify', 'reset']
+    assert watchdog.durations['verify'] > DEFAULT_DEADLINES['stub']
+
+
+def test_read_flash_stall_expires(clock):
+    watchdog = PhaseWatchdog(clock=clock, reading=True)
+    for line in ("Uploading stub...", "Changed.", "Configuring flash size...", "4096 (12 %)"):
+        watchdog.feed(line)
+    assert (watchdog.phase, watchdog.stalled) == ('verify', True)
+    clock.advance(DEFAULT_DEADLINES['verify'] + 0.5)
+    assert watchdog.expired() == 'verify'
+
+
+def test_configuring_flash_size_only_starts_read_phase_for_read_flash(clock):
+    watchdog = PhaseWatchdog(clock=clock)
+    watchdog.feed("Uploading stub...")
+    watchdog.feed("Configuring flash size...")
+    assert watchdog.phase == 'stub'
+
+
+def test_load_deadlines_ignores_bad_values():
+    deadlines = load_deadlines({'sync': '5', 'write_stall': 'x', 'unknown': 1})
+    assert deadlines['sync'] == 5.0
+    assert deadlines['write_stall'] == DEFAULT_DEADLINES['write_stall']
+    assert 'unknown' not in deadlines
@@ -0,0 +1,86 @@
+import threading
+from types import SimpleNamespace
+
+from hub_scheduler import STALE_SECONDS, UNKNOWN_HUB, HubScheduler
+
+
+def transfer(kbps, size=400 * 1024):
+    return SimpleNamespace(kbps=kbps, size=size)
+
+
+def write_at(scheduler, hub, active, kbps, count=3, waiting=0):
+    """以 active 个并行任务记录 count 段写入"""
+    state = scheduler._state(hub)
+    state.active, state.waiting = active, waiting
+    for _ in range(count):
+        scheduler.record(hub, transfer(kbps))
+
+
+def test_retune_lowers_limit_to_best_throughput(clock):
+    changes = []
+    scheduler = HubScheduler(start=4, clock=clock, on_limit=lambda *args: changes.append(args))
+    write_at(scheduler, '1-4', 4, 100)  # 4 × 100 = 400 kbit/s
+    assert scheduler.hubs['1-4'].limit == 4
+    write_at(scheduler, '1-4', 2, 300)  # 2 × 300 = 600 kbit/s
+    assert scheduler.hubs['1-4'].limit == 2
+    assert changes == [('1-4', 4, 2)]
+
+
+def test_retune_ignores_small_differences(clock):
+    scheduler = HubScheduler(start=4, clock=clock)
+    write_at(scheduler, '1-4', 4, 100)
+    write_at(scheduler, '1-4', 2, 201)  # 402 < 400 × 1.05
+    assert scheduler.hubs['1-4'].limit == 4
+
+
+def test_probe_higher_limit_when_jobs_wait(clock):
+    scheduler = HubScheduler(start=2, max_limit=3, clock=clock)
+    write_at(scheduler, '1-4', 2, 300)
+    assert scheduler.hubs['1-4'].limit == 2  # 无排队：不试探
+    write_at(scheduler, '1-4', 2, 300, count=1, waiting=1)
+    assert scheduler.hubs['1-4'].limit == 3
+    write_at(scheduler, '1-4', 3, 250, waiting=1)  # 750 > 600，但已到 max_limit
+    assert scheduler.hubs['1-4'].limit == 3
+
+
+def test_stale_measurements_not_used(clock):
+    scheduler = HubScheduler(start=4, clock=clock)
+    write_at(scheduler, '1-4', 2, 300)
+    clock.advance(STALE_SECONDS + 1)
+    assert scheduler.hubs['1-4'].measured(clock.now) == {}
+    write_at(scheduler, '1-4', 4, 100)  # 2 的测量已过期，只有 4 的测量
+    assert scheduler.hubs['1-4'].limit == 4
+
+
+def test_fixed_limit_and_cancel(clock):
+    scheduler = HubScheduler(mode=1, clock=clock)
+    assert scheduler.acquire('1-4')
+    waits = []
+    cancel = threading.Event()
+    cancel.set()
+    assert not scheduler.acquire('1-4', cancel, on_wait=waits.append)
+    assert waits == [1]
+    write_at(scheduler, '1-4', 1, 100)
+    write_at(scheduler, '1-4', 2, 300)
+    assert scheduler.hubs['1-4'].limit == 1  # 固定上限不自动调整
+
+
+def test_unknown_hub_and_zero_limit_unlimited(clock):
+    scheduler = HubScheduler(start=1, clock=clock)
+    assert all(scheduler.acquire(UNKNOWN_HUB) for _ in range(5))
+    scheduler.configure(0)
+    assert all(scheduler.acquire('1-4') for _ in range(5))
+    snapshot = {hub['hub']: hub for hub in scheduler.snapshot()}
+    assert snapshot['1-4']['limit'] is None and snapshot['1-4']['active'] == 5
+
+
+def test_release_wakes_waiting_job(clock):
+    scheduler = HubScheduler(mode=1, clock=clock)
+    scheduler.acquire('1-4')
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: scheduler.acquire('1-4') and acquired.set())
+    thread.start()
+    assert not acquired.wait(0.3)
+    scheduler.release('1-4')
+    assert acquired.wait(2)
+    thread.join()
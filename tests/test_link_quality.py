@@ -0,0 +1,72 @@
+from conftest import FakeClock
+from link_quality import RECENT, LinkQualityTracker, location_key
+
+
+def run(tracker, location, kbps, count=RECENT, chip='ESP32-S3', baud=921600, retries=0, sync=1):
+    result = None
+    for _ in range(count):
+        tracker._clock.advance(60)
+        result = tracker.add(location, f'/dev/tty-{location}', chip, baud, [kbps], retries, sync)
+    return result
+
+
+def make_tracker():
+    return LinkQualityTracker(clock=FakeClock(1_700_000_000.0))
+
+
+def test_location_key():
+    assert location_key('1-4.3:1.0', 'COM3') == '1-4.3'
+    assert location_key(None, 'COM3') == 'COM3'
+
+
+def test_slow_location_compared_with_peers():
+    tracker = make_tracker()
+    run(tracker, '1-1', 800)
+    run(tracker, '1-2', 820)
+    issues, changed = run(tracker, '1-3', 500)
+    assert changed and len(issues) == 1 and issues[0].startswith("速率偏低")
+    # 只有一个同组位置时不比较
+    assert tracker._issues('1-1') == []
+
+
+def test_peers_only_in_same_chip_and_baud_group():
+    tracker = make_tracker()
+    run(tracker, '1-1', 800, baud=460800)
+    run(tracker, '1-2', 820, baud=460800)
+    issues, _ = run(tracker, '1-3', 500)
+    assert issues == []
+
+
+def test_drop_against_own_history_and_recovery():
+    tracker = make_tracker()
+    run(tracker, '1-1', 800)
+    issues, changed = run(tracker, '1-1', 500)
+    assert changed and issues[0].startswith("速率下降")
+    assert '1-1' in tracker.flagged
+    # 速率恢复（最近 5 个任务的中位数回到正常）
+    issues, changed = run(tracker, '1-1', 800, count=3)
+    assert issues == [] and changed
+    assert '1-1' not in tracker.flagged
+
+
+def test_retries_and_sync_attempts():
+    tracker = make_tracker()
+    issues, _ = run(tracker, '1-1', 800, retries=1, sync=4)
+    assert [issue.split('：')[0] for issue in issues] == ["重试频繁", "同步困难"]
+    # 问题内容不变（数值变化）时不重复报告
+    issues, changed = run(tracker, '1-1', 800, count=1, retries=2, sync=4)
+    assert issues and not changed
+
+
+def test_verify_only_jobs_have_no_rate(tmp_path):
+    tracker = make_tracker()
+    tracker.path = str(tmp_path / 'lq.json')
+    run(tracker, '1-1', 800, count=2)
+    tracker.add('1-1', 'COM3', 'ESP32-S3', 921600, [], 0, 1)
+    day, rate = tracker.trend('1-1')[0]
+    assert rate == 800
+    tracker.save()
+    loaded = LinkQualityTracker()
+    loaded.load(tracker.path)
+    assert len(loaded.locations['1-1']['samples']) == 3
+    assert loaded.summary()[0]['kbps'] == 800
@@ -0,0 +1,73 @@
+import pytest
+
+from lot_stats import CycleStats, LotTracker, format_duration
+
+
+def record(mac, success=True, port='COM3', chip='ESP32-S3', cycle=20.0, **extra):
+    return dict(extra, mac_address=mac, success=success, port=port, chip_type=chip, cycle_time=cycle)
+
+
+def test_cycle_stats_percentile_within_bucket_error():
+    stats = CycleStats()
+    for seconds in range(1, 101):
+        stats.add(seconds)
+    assert stats.mean == pytest.approx(50.5)
+    assert stats.percentile(95) == pytest.approx(95, rel=0.05)
+    assert stats.percentile(100) == 100
+    assert CycleStats().percentile(95) is None
+
+
+def test_first_pass_yield_by_mac(clock):
+    lot = LotTracker(clock=clock)
+    lot.add(record('aa:01'))
+    lot.add(record('aa:02', retries=1))  # 重试后成功：不算首次通过
+    lot.add(record('aa:03', success=False))
+    lot.add(record('aa:03'))  # 同一设备重烧，不增加设备数
+    lot.add(record('Unknown', success=False))  # 未读到MAC，按独立设备计
+    assert (lot.units, lot.first_pass, lot.passed, lot.failed_jobs) == (4, 1, 3, 2)
+    assert lot.first_pass_yield == 0.25
+
+
+def test_verify_only_not_counted(clock):
+    lot = LotTracker(clock=clock)
+    assert lot.add(record('aa:01', verify_only=True)) is None
+    assert (lot.units, lot.passed) == (0, 0)
+
+
+def test_cycle_keys_and_missing_cycle(clock):
+    lot = LotTracker(clock=clock)
+    assert lot.add(record('aa:01', port='COM4', chip='ESP32-C3')) == ('COM4', 'ESP32-C3')
+    assert lot.add(record('aa:02', cycle=None)) is None
+    assert lot.by_port['COM4'].count == 1
+    assert 'COM3' not in lot.by_port
+
+
+def test_rolling_windows_and_eta(clock):
+    lot = LotTracker(target=10, windows=(5, 15), clock=clock)
+    # 前 2 分钟完成 4 台：批次不足一个窗口时按已进行的时长计算
+    for index in range(4):
+        clock.now = 30.0 * (index + 1)
+        lot.add(record(f'aa:{index:02d}'))
+    assert lot.units_per_hour(5) == pytest.approx(4 * 3600 / 120)
+    assert lot.eta() == pytest.approx(6 / 120 * 3600)
+    # 10 分钟后，5 分钟窗口内已没有完成的设备，15 分钟窗口仍有
+    clock.now = 600.0
+    assert lot.units_per_hour(5) == 0.0
+    assert lot.units_per_hour(15) == pytest.approx(4 * 3600 / 600)
+    assert lot.remaining == 6 and not lot.complete
+
+
+def test_complete_and_new_lot(clock):
+    lot = LotTracker(target=1, clock=clock)
+    lot.add(record('aa:01'))
+    assert lot.complete and lot.eta() == 0.0
+    lot.start(0)
+    assert lot.passed == 0 and lot.eta() is None
+    # 新批次中同一设备重新计为设备
+    lot.add(record('aa:01'))
+    assert lot.units == 1
+
+
+@pytest.mark.parametrize('seconds, text', [(None, '-'), (59.6, '1:00'), (3930, '1:05:30'), (724, '12:04')])
+def test_format_duration(seconds, text):
+    assert format_duration(seconds) == text
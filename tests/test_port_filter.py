@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+from port_filter import PortFilter, port_fields
+
+
+def usb(vid, pid, manufacturer='', description='', location=None):
+    return SimpleNamespace(vid=vid, pid=pid, manufacturer=manufacturer, description=description, location=location)
+
+
+CP2102 = usb(0x10C4, 0xEA60, 'Silicon Labs', 'CP2102 USB to UART Bridge Controller', '1-4.2:1.0')
+JTAG = usb(0x303A, 0x1001, 'Espressif', 'USB JTAG/serial debug unit', '1-4.3:1.0')
+SCANNER = usb(0x05E0, 0x1200, 'Zebra', 'Symbol Bar Code Scanner', '1-4.4:1.0')
+ONBOARD = SimpleNamespace(vid=None, pid=None, manufacturer=None, description='ttyS0', location=None)
+
+
+def test_port_fields():
+    assert port_fields(CP2102)['vid_pid'] == '10C4:EA60'
+    assert port_fields(ONBOARD) == {'vid_pid': '', 'manufacturer': '', 'description': 'ttyS0', 'location': ''}
+    assert port_fields(None)['description'] == ''
+
+
+def test_unconfigured_accepts_everything():
+    for value in (None, {}, 'bogus', {'vid_pid': []}):
+        port_filter = PortFilter.from_config(value)
+        assert not port_filter.enabled
+        assert port_filter.reject_reason(SCANNER) is None
+
+
+def test_vid_pid_wildcards_case_insensitive():
+    port_filter = PortFilter.from_config({'vid_pid': ['303a:*', '10C4:EA60']})
+    assert port_filter.reject_reason(JTAG) is None
+    assert port_filter.reject_reason(CP2102) is None
+    assert port_filter.reject_reason(SCANNER) == "VID:PID 05E0:1200 不在允许列表中"
+    assert port_filter.reject_reason(ONBOARD) == "VID:PID （无） 不在允许列表中"
+
+
+def test_fields_must_all_match():
+    port_filter = PortFilter.from_config({'manufacturer': 'Silicon Labs*', 'location': ['1-4.*']})
+    assert port_filter.reject_reason(CP2102) is None
+    elsewhere = usb(0x10C4, 0xEA60, 'Silicon Labs', 'CP2102', '2-1:1.0')
+    assert port_filter.reject_reason(elsewhere).startswith("USB位置 2-1:1.0")
+
+
+def test_exclude_wins():
+    port_filter = PortFilter.from_config({'vid_pid': ['*'], 'exclude': {'description': ['*JTAG*']}})
+    assert port_filter.reject_reason(JTAG) == "描述 USB JTAG/serial debug unit 在排除列表中"
+    assert port_filter.reject_reason(CP2102) is None
+
+
+def test_split():
+    port_info = {'COM3': CP2102, 'COM4': JTAG, 'COM5': SCANNER}
+    port_filter = PortFilter.from_config({'description': ['*CP210*', '*JTAG*']})
+    accepted, ignored = port_filter.split(['COM3', 'COM4', 'COM5', 'COM9'], port_info)
+    assert accepted == ['COM3', 'COM4']
+    assert set(ignored) == {'COM5', 'COM9'}
@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+from port_lease import PortLeases, describe_holder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_describe_holder():
+    assert describe_holder({'tool': 'readmac', 'pid': 42}) == "MAC读取工具 (PID 42)"
+    assert describe_holder({'tool': 'custom'}) == "custom (PID ?)"
+    assert describe_holder(None) == "其他程序"
+
+
+def test_reentrant_within_instance(tmp_path):
+    leases = PortLeases('flasher', str(tmp_path))
+    other = PortLeases('readmac', str(tmp_path))
+    assert leases.acquire('COM3') and leases.acquire('COM3')
+    leases.release('COM3')
+    assert leases.held('COM3') and not other.acquire('COM3')
+    leases.release('COM3')
+    assert not leases.held('COM3')
+    assert other.acquire('COM3')
+    other.release_all()
+    assert not other.held('COM3')
+
+
+def test_disabled_leases_always_acquire(tmp_path):
+    leases = PortLeases('flasher', str(tmp_path))
+    leases.enabled = False
+    assert leases.acquire('/dev/ttyUSB0')
+    assert os.listdir(tmp_path) == []
+
+
+def test_other_process_holds_port(tmp_path):
+    script = ("import sys; from port_lease import PortLeases; "
+              f"leases = PortLeases('unified', {str(tmp_path)!r}); "
+              "print(leases.acquire('/dev/ttyUSB0'), flush=True); sys.stdin.read()")
+    child = subprocess.Popen([sys.executable, '-c', script], cwd=ROOT, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, text=True)
+    try:
+        assert child.stdout.readline().strip() == 'True'
+        leases = PortLeases('flasher', str(tmp_path))
+        assert not leases.acquire('/dev/ttyUSB0')
+        holder = leases.holder('/dev/ttyUSB0')
+        assert holder['tool'] == 'unified' and holder['pid'] == child.pid
+        assert leases.busy_ports(['/dev/ttyUSB0', '/dev/ttyUSB1']) == {'/dev/ttyUSB0': holder}
+    finally:
+        child.stdin.close()
+        child.wait(10)
+    # 进程退出后锁由系统释放
+    assert leases.holder('/dev/ttyUSB0') is None
+    assert leases.acquire('/dev/ttyUSB0')
+    leases.release('/dev/ttyUSB0')
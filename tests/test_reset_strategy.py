@@ -0,0 +1,64 @@
+import json
+from types import SimpleNamespace
+
+from reset_strategy import (DEFAULT_RESET, NO_RESET, USB_RESET, ResetStrategyTable, default_order,
+                            descriptor_of)
+
+JTAG = '303A:1001'
+CP2102 = '10C4:EA60'
+
+
+def test_descriptor_of():
+    assert descriptor_of(SimpleNamespace(vid=0x303A, pid=0x1001)) == JTAG
+    assert descriptor_of(SimpleNamespace(vid=None, pid=None)) is None
+    assert descriptor_of(None) is None
+
+
+def test_default_order_never_tries_no_reset():
+    assert default_order(JTAG) == [USB_RESET, DEFAULT_RESET]
+    assert default_order(CP2102) == [DEFAULT_RESET]
+    assert default_order(None) == [DEFAULT_RESET]
+
+
+def test_learned_order_prefers_successful_strategy(clock):
+    table = ResetStrategyTable(clock=clock)
+    table.record('1-4.3', JTAG, 'ESP32-S3', USB_RESET, False)
+    table.record('1-4.3', JTAG, 'ESP32-S3', DEFAULT_RESET, True)
+    assert table.order('1-4.3', JTAG) == [DEFAULT_RESET, USB_RESET]
+    # 新位置上的同型号设备参考汇总
+    assert table.order('1-4.4', JTAG) == [DEFAULT_RESET, USB_RESET]
+    assert table.order('1-4.4', JTAG, 'ESP32-S3') == [DEFAULT_RESET, USB_RESET]
+    # 其他描述符不受影响
+    assert table.order('1-4.3', CP2102) == [DEFAULT_RESET]
+
+
+def test_no_reset_is_not_learned(clock):
+    table = ResetStrategyTable(clock=clock)
+    table.record('1-2', CP2102, 'ESP32', NO_RESET, True)
+    assert table.entries == {}
+    assert table.order('1-2', CP2102) == [DEFAULT_RESET]
+
+
+def test_old_no_reset_records_ignored(tmp_path):
+    path = tmp_path / 'rs.json'
+    path.write_text(json.dumps({'version': 1, 'entries': {
+        '1-2|10C4:EA60': {'no_reset': [1, 0, 5.0], 'default_reset': [0, 1, 0]},
+        '1-3|10C4:EA60': {'no_reset': [1, 0, 5.0]},
+    }}), encoding='utf-8')
+    table = ResetStrategyTable()
+    table.load(str(path))
+    assert table.order('1-2', CP2102) == [DEFAULT_RESET]
+    summary = table.summary()
+    assert summary['1-2|10C4:EA60']['preferred'] == DEFAULT_RESET
+    assert '1-3|10C4:EA60' not in summary
+
+
+def test_save_round_trip(tmp_path, clock):
+    path = str(tmp_path / 'rs.json')
+    table = ResetStrategyTable(path, clock=clock)
+    table.record('1-4.3', JTAG, 'ESP32-C3', USB_RESET, True)
+    table.save()
+    loaded = ResetStrategyTable()
+    loaded.load(path)
+    assert loaded.entries == table.entries
+    assert loaded.entries['1-4.3|303A:1001'][USB_RESET] == [1, 0, clock.now]
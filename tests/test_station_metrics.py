@@ -0,0 +1,87 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from station_metrics import CONTENT_TYPE, StationMetrics, hub_of
+
+
+def series(text):
+    """渲染结果中的样本行（去掉 HELP/TYPE 注释）"""
+    return [line for line in text.splitlines() if not line.startswith('#')]
+
+
+def test_hub_of():
+    assert hub_of('1-4.3:1.0') == '1-4'
+    assert hub_of('1-4.3.2') == '1-4.3'
+    assert hub_of('2-1') == '2'
+    assert hub_of(None) == 'unknown'
+
+
+def test_station_info_and_header_lines():
+    text = StationMetrics('flasher').render()
+    assert text == ("# HELP esp32_station_info Tool running on this station\n"
+                    "# TYPE esp32_station_info gauge\n"
+                    'esp32_station_info{tool="flasher"} 1\n')
+
+
+def test_counter_labels_sorted_and_unlabelled_default():
+    metrics = StationMetrics('flasher')
+    jobs = metrics.counter('esp32_jobs_total', 'Jobs by result', ('result', 'hub'))
+    metrics.counter('esp32_resets_total', 'Resets')
+    jobs.inc(result='success', hub='1-4')
+    jobs.inc(2, result='fail', hub='1-4')
+    jobs.inc(result='success', hub='1-4')
+    text = metrics.render()
+    assert "# TYPE esp32_jobs_total counter" in text
+    assert series(text)[1:] == ['esp32_jobs_total{result="fail",hub="1-4"} 2',
+                                'esp32_jobs_total{result="success",hub="1-4"} 2',
+                                'esp32_resets_total 0']
+
+
+def test_label_values_escaped():
+    metrics = StationMetrics('tool "A"\\B\nC')
+    assert series(metrics.render()) == ['esp32_station_info{tool="tool \\"A\\"\\\\B\\nC"} 1']
+
+
+def test_histogram_cumulative_buckets():
+    metrics = StationMetrics('flasher')
+    cycle = metrics.histogram('esp32_cycle_seconds', 'Cycle time', ('chip',), buckets=(10, 1, 5))
+    for value in (0.5, 3, 3, 7.25, 40):
+        cycle.observe(value, chip='ESP32-S3')
+    assert series(metrics.render())[1:] == [
+        'esp32_cycle_seconds_bucket{chip="ESP32-S3",le="1"} 1',
+        'esp32_cycle_seconds_bucket{chip="ESP32-S3",le="5"} 3',
+        'esp32_cycle_seconds_bucket{chip="ESP32-S3",le="10"} 4',
+        'esp32_cycle_seconds_bucket{chip="ESP32-S3",le="+Inf"} 5',
+        'esp32_cycle_seconds_sum{chip="ESP32-S3"} 53.75',
+        'esp32_cycle_seconds_count{chip="ESP32-S3"} 5',
+    ]
+
+
+def test_gauge_values_and_failing_callback():
+    metrics = StationMetrics('flasher')
+    metrics.gauge('esp32_ui_queue_depth', 'Pending UI events', lambda: 3)
+    metrics.gauge('esp32_hub_limit', 'Hub limit', lambda: {('1-4',): 2, ('1-2',): 0.5}, ('hub',))
+    metrics.gauge('esp32_broken', 'Callback fails', lambda: 1 / 0)
+    text = metrics.render()
+    assert series(text)[1:] == ['esp32_ui_queue_depth 3',
+                                'esp32_hub_limit{hub="1-2"} 0.5',
+                                'esp32_hub_limit{hub="1-4"} 2']
+    # 取值失败的仪表只保留注释行
+    assert "# TYPE esp32_broken gauge" in text
+
+
+def test_serve_metrics_over_http():
+    metrics = StationMetrics('readmac')
+    port = metrics.serve('127.0.0.1', 0)
+    try:
+        assert metrics.serving
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=5) as response:
+            assert response.headers['Content-Type'] == CONTENT_TYPE
+            assert response.read().decode('utf-8') == metrics.render()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/other', timeout=5)
+    finally:
+        metrics.shutdown()
+    assert not metrics.serving
@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+from ui_dispatch import EVENT_LOG, EVENT_PORT_LOG, UIDispatcher
+
+
+class StubRoot:
+    """代替 Tk 根窗口：只记录 after() 调度，由测试决定何时执行"""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, delay_ms, func):
+        self.scheduled.append((delay_ms, func))
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = UIDispatcher(StubRoot())
+    dispatcher.events = []
+    dispatcher.register(EVENT_LOG, lambda port, lines: dispatcher.events.append(('log', port, lines)))
+    dispatcher.register(EVENT_PORT_LOG, lambda port, lines: dispatcher.events.append(('port_log', port, lines)))
+    return dispatcher
+
+
+def flush_until(dispatcher, done, timeout=5):
+    """模拟主循环：在工作线程结束前反复处理队列"""
+    deadline = time.monotonic() + timeout
+    while not done.is_set() and time.monotonic() < deadline:
+        dispatcher.flush()
+        time.sleep(0.001)
+
+
+def test_log_lines_coalesced_per_target_in_order(dispatcher):
+    dispatcher.log("a")
+    dispatcher.log("b")
+    dispatcher.port_log('COM3', "x")
+    dispatcher.port_logger('COM3').log("y")
+    dispatcher.port_log('COM4', "z")
+    dispatcher.call(lambda: dispatcher.events.append(('call',)))
+    dispatcher.log("c")
+    dispatcher.port_log('COM3', "w")
+    assert dispatcher.depth() == 8
+    assert dispatcher.flush() == 8
+    assert dispatcher.events == [('log', None, ['a', 'b']), ('port_log', 'COM3', ['x', 'y']),
+                                 ('port_log', 'COM4', ['z']), ('call',),
+                                 ('log', None, ['c']), ('port_log', 'COM3', ['w'])]
+    assert dispatcher.dispatched_total == 8 and dispatcher.depth() == 0
+
+
+def test_flush_limited_to_max_batch(dispatcher):
+    dispatcher.max_batch = 3
+    for i in range(5):
+        dispatcher.log(str(i))
+    assert dispatcher.flush() == 3
+    assert dispatcher.flush() == 2
+    assert dispatcher.events == [('log', None, ['0', '1', '2']), ('log', None, ['3', '4'])]
+
+
+def test_handler_error_does_not_stop_batch(dispatcher, capfd):
+    def fail():
+        raise RuntimeError("boom")
+
+    dispatcher.call(fail)
+    dispatcher.log("after")
+    dispatcher.flush()
+    assert dispatcher.events == [('log', None, ['after'])]
+    # 异常写到原始 stderr
+    assert "RuntimeError: boom" in capfd.readouterr().err
+
+
+def test_call_later_scheduled_on_root(dispatcher):
+    calls = []
+    dispatcher.call_later(250, calls.append, 'late')
+    dispatcher.flush()
+    assert calls == []
+    delay_ms, func = dispatcher.root.scheduled[0]
+    assert delay_ms == 250
+    func()
+    assert calls == ['late']
+
+
+def test_start_schedules_drain(dispatcher):
+    dispatcher.start()
+    dispatcher.start()
+    assert len(dispatcher.root.scheduled) == 1
+    dispatcher.log("a")
+    delay_ms, drain = dispatcher.root.scheduled.pop()
+    drain()
+    assert delay_ms == dispatcher.interval_ms
+    assert dispatcher.events == [('log', None, ['a'])] and len(dispatcher.root.scheduled) == 1
+    dispatcher.stop()
+    dispatcher.root.scheduled.pop()[1]()
+    assert dispatcher.root.scheduled == []
+
+
+def test_call_wait_returns_value_from_main_thread(dispatcher):
+    result = {}
+    done = threading.Event()
+
+    def worker():
+        result['value'] = dispatcher.call_wait(lambda a, b: (a + b, threading.current_thread()), 2, 3)
+        done.set()
+
+    threading.Thread(target=worker).start()
+    flush_until(dispatcher, done)
+    assert result['value'] == (5, threading.main_thread())
+
+
+def test_call_wait_propagates_error(dispatcher):
+    result = {}
+    done = threading.Event()
+
+    def worker():
+        try:
+            dispatcher.call_wait(int, 'not a number')
+        except ValueError as e:
+            result['error'] = e
+        done.set()
+
+    threading.Thread(target=worker).start()
+    flush_until(dispatcher, done)
+    assert isinstance(result['error'], ValueError)
+
+
+def test_call_wait_timeout(dispatcher):
+    with pytest.raises(TimeoutError, match="主线程无响应"):
+        dispatcher.call_wait(lambda: None, timeout=0.05)
+    # 超时后排队的调用仍会执行，结果被丢弃
+    assert dispatcher.flush() == 1
@@ -0,0 +1,206 @@
+"""主线程UI事件队列
+
+工作线程只向队列投递事件，由Tk主循环按固定节拍批量取出并处理，
+工作线程不会直接访问任何Tk控件，也不会因为UI繁忙而被阻塞。
+"""
+import queue
+import sys
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+from flash_trace import UI_TRACK, CAT_UI
+
+# 事件类型
+EVENT_LOG = 'log'                # 主窗口日志，payload 为一行文本
+EVENT_PORT_LOG = 'port_log'      # 端口日志窗口，payload 为一行文本
+EVENT_CALL = 'call'              # 在主线程中执行回调，payload 为 (func, args, kwargs)
+EVENT_CALL_LATER = 'call_later'  # 在主线程中延迟执行回调，payload 为 (delay_ms, func, args)
+
+# 日志类事件会按目标合并后一次性交给处理函数
+_LINE_EVENTS = (EVENT_LOG, EVENT_PORT_LOG)
+
+UIEvent = namedtuple('UIEvent', ['kind', 'port', 'payload', 'posted_at'])
+
+
+class PortLogger:
+    """端口日志代理，接口与 LogWindow.log 一致，可在任意线程中使用"""
+
+    def __init__(self, dispatcher, port):
+        self._dispatcher = dispatcher
+        self.port = port
+
+    def log(self, message):
+        self._dispatcher.port_log(self.port, message)
+
+
+class UIDispatcher:
+    """工作线程到Tk主线程的唯一通道"""
+
+    def __init__(self, root, interval_ms=50, max_batch=2000):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._handlers = {}
+        self._running = False
+        # 队列延迟统计（秒），供性能分析使用
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.dispatched_total = 0
+        # 可选的时间线记录器（flash_trace.TraceRecorder），记录期间每批处理记为一个区间
+        self.tracer = None
+
+    def register(self, kind, handler):
+        """注册事件处理函数
+
+        日志类事件的处理函数签名为 handler(port, lines)，lines 为按顺序合并的多行文本；
+        其他事件的处理函数签名为 handler(port, payload)。
+        """
+        self._handlers[kind] = handler
+
+    def post(self, kind, port=None, payload=None):
+        self._queue.put(UIEvent(kind, port, payload, time.monotonic()))
+
+    def log(self, message):
+        self.post(EVENT_LOG, payload=message)
+
+    def port_log(self, port, message):
+        self.post(EVENT_PORT_LOG, port=port, payload=message)
+
+    def port_logger(self, port):
+        return PortLogger(self, port)
+
+    def call(self, func, *args, **kwargs):
+        """在主线程中执行 func(*args, **kwargs)"""
+        self.post(EVENT_CALL, payload=(func, args, kwargs))
+
+    def call_wait(self, func, *args, timeout=10):
+        """在主线程中执行 func(*args) 并等待返回值（只能在工作线程中调用）"""
+        done = threading.Event()
+        outcome = {}
+
+        def run():
+            try:
+                outcome['value'] = func(*args)
+            except BaseException as e:
+                outcome['error'] = e
+            finally:
+                done.set()
+
+        self.call(run)
+        if not done.wait(timeout):
+            raise TimeoutError("主线程无响应")
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('value')
+
+    def call_later(self, delay_ms, func, *args):
+        """在主线程中延迟 delay_ms 毫秒后执行 func(*args)"""
+        self.post(EVENT_CALL_LATER, payload=(delay_ms, func, args))
+
+    def depth(self):
+        """当前排队的事件数"""
+        return self._queue.qsize()
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval_ms, self._drain)
+
+    def stop(self):
+        self._running = False
+
+    def flush(self):
+        """处理一批排队的事件，返回处理的事件数（主循环定时调用；基准测试等无主循环场景可直接调用）"""
+        events = []
+        try:
+            while len(events) < self.max_batch:
+                events.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        if events:
+            tracer = self.tracer
+            if tracer is not None and tracer.enabled:
+                tracer.counter('UI队列', {'排队事件': len(events) + self._queue.qsize()})
+                with tracer.span('处理UI事件', UI_TRACK, CAT_UI, {'events': len(events)}):
+                    self._dispatch(events)
+            else:
+                self._dispatch(events)
+        return len(events)
+
+    def _drain(self):
+        if not self._running:
+            return
+        self.flush()
+
+        try:
+            self.root.after(self.interval_ms, self._drain)
+        except Exception:
+            # 主窗口已销毁
+            self._running = False
+
+    def _dispatch(self, events):
+        now = time.monotonic()
+        key = None
+        lines = []
+        for event in events:
+            latency = now - event.posted_at
+            self.last_latency = latency
+            if latency > self.max_latency:
+                self.max_latency = latency
+
+            if event.kind in _LINE_EVENTS:
+                event_key = (event.kind, event.port)
+                if event_key != key:
+                    if lines:
+                        self._invoke(key[0], key[1], lines)
+                    key = event_key
+                    lines = []
+                lines.append(event.payload)
+                continue
+
+            if lines:
+                self._invoke(key[0], key[1], lines)
+                key = None
+                lines = []
+            self._invoke(event.kind, event.port, event.payload)
+
+        if lines:
+            self._invoke(key[0], key[1], lines)
+        self.dispatched_total += len(events)
+
+    def _invoke(self, kind, port, payload):
+        try:
+            if kind == EVENT_CALL:
+                func, args, kwargs = payload
+                tracer = self.tracer
+                if tracer is not None and tracer.enabled:
+                    with tracer.span(getattr(func, '__name__', 'call'), UI_TRACK, CAT_UI):
+                        func(*args, **kwargs)
+                else:
+                    func(*args, **kwargs)
+            elif kind == EVENT_CALL_LATER:
+                delay_ms, func, args = payload
+                self.root.after(delay_ms, lambda: self._run_safely(func, args))
+            else:
+                handler = self._handlers.get(kind)
+                if handler:
+                    handler(port, payload)
+        except Exception:
+            self._report_error()
+
+    def _run_safely(self, func, args):
+        try:
+            func(*args)
+        except Exception:
+            self._report_error()
+
+    def _report_error(self):
+        # 处理函数出错不能影响主循环；sys.stderr 可能已被重定向到日志，这里写到原始 stderr
+        try:
+            traceback.print_exc(file=sys.__stderr__)
+        except Exception:
+            pass